@@ -0,0 +1,98 @@
+'''
+聊天记录压缩基准测试
+
+功能描述:
+生成模拟的多天群聊记录（不同群规模、消息长度和媒体比例），对比压缩前后的字符数和估算Token数，
+并校验压缩结果能完整还原、按行切分后的每个片段都带有成员表。
+
+使用方法:
+python benchmarks/bench_chat_compactor.py [--days 3] [--messages-per-day 800]
+'''
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_compactor import MESSAGES_MARK, compact_chat_log  # noqa: E402
+from token_estimator import get_token_estimator  # noqa: E402
+
+SHORT_BODIES = ["好的", "收到👌", "哈哈哈哈", "+1", "明天几点开会？", "同意楼上", "谢谢大佬！", "[捂脸]"]
+LONG_BODIES = [
+    "我觉得这个方案的主要问题是成本，先小范围试点一周，看看数据再决定要不要全面推广。",
+    "分享一篇文章，讲的是大模型推理优化，里面提到的KV缓存复用思路对我们很有参考价值。\n有空可以看看第三节。",
+    "刚才的会议纪要：1. 周五前完成接口联调；2. 下周一评审设计稿；3. 测试环境由小王负责。",
+]
+MEDIA_BODIES = [
+    "![图片](http://127.0.0.1:5030/image/5f0c2d9e8b7a4c3d2e1f0a9b8c7d6e5f)",
+    "![动画表情](http://127.0.0.1:5030/emoji/a1b2c3d4e5f60718293a4b5c6d7e8f90)",
+    "[语音](http://127.0.0.1:5030/voice/0f1e2d3c4b5a69788796a5b4c3d2e1f0)",
+    "[文件|季度总结.pdf](http://127.0.0.1:5030/file/9a8b7c6d5e4f30211203f4e5d6c7b8a9)",
+    "[链接|大模型推理优化实践](https://mp.weixin.qq.com/s/AbCdEfGhIjKlMnOpQrStUv)",
+]
+
+
+def build_chat_log(days, messages_per_day, members, long_ratio, media_ratio, rng):
+    senders = [f"群友{index}号(wxid_{rng.getrandbits(40):010x})" for index in range(members)]
+    weights = [1 / (index + 1) for index in range(members)]  # 少数人发言最多
+    parts = []
+    for day in range(days):
+        seconds = 8 * 3600
+        sender = rng.choices(senders, weights)[0]
+        for _ in range(messages_per_day):
+            seconds += rng.randint(0, 90)
+            if seconds >= 86400:
+                break
+            if rng.random() > 0.4:  # 约四成消息是同一人连续发言
+                sender = rng.choices(senders, weights)[0]
+            roll = rng.random()
+            if roll < media_ratio:
+                body = rng.choice(MEDIA_BODIES)
+            elif roll < media_ratio + long_ratio:
+                body = rng.choice(LONG_BODIES)
+            else:
+                body = rng.choice(SHORT_BODIES)
+            parts.append(f"{sender} 04-{day + 1:02d} {seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}\n{body}\n\n")
+    return "".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='聊天记录压缩基准测试')
+    parser.add_argument('--days', type=int, default=3)
+    parser.add_argument('--messages-per-day', type=int, default=800)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    estimator = get_token_estimator('default')
+    scenarios = [
+        ('小群/短消息', 15, 0.1, 0.15),
+        ('大群/短消息', 300, 0.1, 0.15),
+        ('讨论型/长消息', 40, 0.5, 0.05),
+        ('媒体较多', 40, 0.1, 0.4),
+    ]
+
+    print(f"{'场景':<14}{'原始字符':>10}{'压缩字符':>10}{'原始Token':>11}{'压缩Token':>11}{'节省':>8}{'耗时(秒)':>10}")
+    for name, members, long_ratio, media_ratio in scenarios:
+        text = build_chat_log(args.days, args.messages_per_day, members, long_ratio, media_ratio, rng)
+
+        start = time.perf_counter()
+        compacted = compact_chat_log(text)
+        elapsed = time.perf_counter() - start
+
+        assert compacted is not None and compacted.expand() == text
+        lines = compacted.body.splitlines(keepends=True)
+        segments = compacted.self_contained(["".join(lines[i:i + 500]) for i in range(0, len(lines), 500)])
+        assert all(MESSAGES_MARK in segment for segment in segments)
+
+        original_tokens = estimator.estimate(text)
+        compacted_tokens = estimator.estimate(compacted.text)
+        saving = (original_tokens - compacted_tokens) / original_tokens * 100
+        print(f"{name:<14}{len(text):>10}{len(compacted.text):>10}{original_tokens:>11}{compacted_tokens:>11}"
+              f"{saving:>7.1f}%{elapsed:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+'''
+聊天记录下载基准测试
+
+功能描述:
+在本地启动一个不声明字符集的HTTP服务，返回模拟的一个月聊天记录，
+对比旧的 response.text + 整体打码 方式与流式下载 + 分块打码 方式的耗时和内存峰值。
+
+使用方法:
+python benchmarks/bench_chatlog_fetch.py [--days 30] [--messages-per-day 3000]
+'''
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chatlog_stream import iter_response_batches  # noqa: E402
+from masking import get_data_masker  # noqa: E402
+from http_session import create_http_session  # noqa: E402
+
+MASKING_RULES = {"张三": "[同学A]", "李四": "[同学B]", "13800000000": "[手机号]"}
+
+
+def build_month_export(days, messages_per_day):
+    """生成模拟的多天聊天记录（UTF-8字节）"""
+    rng = random.Random(42)
+    senders = ["张三(wxid_zhangsan)", "李四(wxid_lisi)", "王五(wxid_wangwu)", "Alice(wxid_alice)"]
+    words = ["今天", "的", "会议", "资料", "已经", "上传", "张三", "请", "查看", "OK", "thanks", "链接", "13800000000", "😀"]
+    parts = []
+    for day in range(days):
+        for i in range(messages_per_day):
+            seconds = i * 86400 // messages_per_day
+            header = f"{rng.choice(senders)} 04-{day % 28 + 1:02d} {seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+            body = "".join(rng.choice(words) for _ in range(rng.randint(3, 30)))
+            parts.append(f"{header}\n{body}\n\n")
+    return "".join(parts).encode('utf-8')
+
+
+def start_server(payload):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            # 不返回Content-Type/charset，response.text 会对整个响应体做字符集探测
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def fetch_legacy(session, url):
+    """旧实现：response.text 后整体打码"""
+    chat_logs = session.get(url, timeout=60).text
+    for keyword, replacement in MASKING_RULES.items():
+        chat_logs = chat_logs.replace(keyword, replacement)
+    return chat_logs
+
+
+def fetch_streaming(session, url):
+    """新实现：流式下载，边读取边打码"""
+    text_batches = iter_response_batches(session.get(url, timeout=60, stream=True))
+    return "".join(get_data_masker(MASKING_RULES).mask_stream(text_batches))
+
+
+def measure(func, session, url):
+    """分别测量耗时和内存峰值（tracemalloc 会显著拖慢大量小对象的分配，不能同时计时）"""
+    start = time.perf_counter()
+    result = func(session, url)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func(session, url)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='聊天记录下载基准测试')
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--messages-per-day', type=int, default=3000)
+    args = parser.parse_args()
+
+    payload = build_month_export(args.days, args.messages_per_day)
+    server = start_server(payload)
+    url = f"http://127.0.0.1:{server.server_address[1]}/api/v1/chatlog"
+    session = create_http_session()
+    print(f"模拟聊天记录: {args.days} 天, {len(payload) / 1024 / 1024:.1f} MB")
+
+    legacy, legacy_time, legacy_peak = measure(fetch_legacy, session, url)
+    streaming, streaming_time, streaming_peak = measure(fetch_streaming, session, url)
+    server.shutdown()
+
+    assert legacy == streaming, "两种方式的结果不一致"
+    print(f"{'方式':<16}{'耗时(秒)':>10}{'内存峰值(MB)':>16}")
+    print(f"{'response.text':<16}{legacy_time:>10.2f}{legacy_peak / 1024 / 1024:>16.1f}")
+    print(f"{'流式下载':<16}{streaming_time:>10.2f}{streaming_peak / 1024 / 1024:>16.1f}")
+
+
+if __name__ == '__main__':
+    main()
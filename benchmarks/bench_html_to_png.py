@@ -0,0 +1,73 @@
+'''
+HTML转PNG基准测试
+
+功能描述:
+对比每张图片冷启动一个浏览器（旧实现）与复用浏览器池并行渲染的总耗时和吞吐量。
+需要本机已安装Chrome。
+
+使用方法:
+python benchmarks/bench_html_to_png.py [--files 20]
+'''
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from browser_pool import BrowserPool, get_browser_pool, shutdown_browser_pool  # noqa: E402
+from demo import html_to_png_batch  # noqa: E402
+
+
+def write_sample_files(output_dir, count):
+    paths = []
+    for i in range(count):
+        path = os.path.join(output_dir, f"sample_part_{i + 1}.html")
+        with open(path, 'w', encoding='utf-8') as f:
+            rows = "".join(f"<p>第 {i + 1} 份日报，第 {j} 条消息摘要</p>" for j in range(200))
+            f.write(f"<html><body><h1>群日报 {i + 1}</h1>{rows}</body></html>")
+        paths.append(path)
+    return paths
+
+
+def render_cold(html_filepaths):
+    """旧实现：每张图片启动并关闭一个浏览器，串行执行"""
+    pool = get_browser_pool()
+    for html_filepath in html_filepaths:
+        cold_pool = BrowserPool(size=1, driver_path=pool.driver_path)
+        try:
+            with cold_pool.driver() as driver:
+                driver.get(f"file:///{os.path.abspath(html_filepath)}")
+                time.sleep(3)
+                driver.save_screenshot(os.path.splitext(html_filepath)[0] + "_cold.png")
+        finally:
+            cold_pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HTML转PNG基准测试')
+    parser.add_argument('--files', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        html_filepaths = write_sample_files(output_dir, args.files)
+
+        start = time.perf_counter()
+        render_cold(html_filepaths)
+        cold_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        png_filepaths = html_to_png_batch(html_filepaths)
+        pool_time = time.perf_counter() - start
+        stats = get_browser_pool().stats()
+        shutdown_browser_pool()
+
+    print(f"文件数: {args.files}, 浏览器池大小: {stats['launches']}, 成功: {sum(1 for p in png_filepaths if p)}")
+    print(f"冷启动串行: {cold_time:.2f} 秒 ({args.files * 60 / cold_time:.1f} 张/分钟)")
+    print(f"浏览器池并行: {pool_time:.2f} 秒 ({args.files * 60 / pool_time:.1f} 张/分钟)")
+
+
+if __name__ == '__main__':
+    main()
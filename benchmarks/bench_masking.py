@@ -0,0 +1,82 @@
+'''
+数据打码基准测试
+
+功能描述:
+对比逐条 str.replace 与单遍打码器在不同规则数量下的耗时，并校验最左最长匹配的结果。
+
+使用方法:
+python benchmarks/bench_masking.py [--chars 5000000]
+'''
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from masking import DataMasker  # noqa: E402
+
+
+def sequential_replace(text, rules):
+    """旧实现：逐条规则替换"""
+    for keyword, replacement in rules.items():
+        text = text.replace(keyword, replacement)
+    return text
+
+
+def build_rules(count, rng):
+    rules = {"小严同学": "NPC1号", "小严同学（goDog神走狗神）": "NPC2号"}
+    while len(rules) < count:
+        nickname = "".join(rng.choice("赵钱孙李周吴郑王冯陈褚卫蒋沈韩杨abcdefgh") for _ in range(rng.randint(2, 8)))
+        rules.setdefault(nickname, f"NPC{len(rules) + 1}号")
+    return rules
+
+
+def build_text(chars, rules, rng):
+    keywords = list(rules)
+    filler = "今天的会议资料已经上传请大家查看谢谢OK👍\n"
+    parts = []
+    total = 0
+    while total < chars:
+        part = filler[:rng.randint(5, len(filler))] + (rng.choice(keywords) if rng.random() < 0.2 else "")
+        parts.append(part)
+        total += len(part)
+    return "".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='数据打码基准测试')
+    parser.add_argument('--chars', type=int, default=5000000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    masker = DataMasker({"小严同学": "NPC1号", "小严同学（goDog神走狗神）": "NPC2号"})
+    assert masker.mask("小严同学（goDog神走狗神）和小严同学") == "NPC2号和NPC1号"
+
+    print(f"{'规则数':>8}{'逐条替换(秒)':>16}{'打码器(秒)':>14}{'构建(秒)':>12}")
+    for rule_count in (2, 10, 100, 1000, 5000):
+        rules = build_rules(rule_count, rng)
+        text = build_text(args.chars, rules, rng)
+
+        start = time.perf_counter()
+        sequential_replace(text, rules)
+        sequential_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        masker = DataMasker(rules)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        masked = masker.mask(text)
+        masker_time = time.perf_counter() - start
+
+        # 流式处理在任意位置切块的结果与整体处理一致
+        chunks = [text[i:i + 4096] for i in range(0, len(text), 4096)]
+        assert "".join(masker.mask_stream(chunks)) == masked
+        print(f"{rule_count:>8}{sequential_time:>16.3f}{masker_time:>14.3f}{build_time:>12.3f}")
+
+
+if __name__ == '__main__':
+    main()
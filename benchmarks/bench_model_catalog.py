@@ -0,0 +1,96 @@
+'''
+模型目录缓存基准测试
+
+功能描述:
+模拟海外接口的 genai.list_models()（按页返回，每页一次往返延迟），对比连接AI服务时获取模型信息的耗时：
+- 旧实现: 每次运行遍历一次模型目录，默认模型不存在时再遍历一次；
+- 无缓存（首次运行 / --refresh-models）: 同步获取并写入缓存；
+- 缓存有效: 只读取本地JSON；
+- 缓存过期: 读取本地JSON并在后台刷新，不阻塞启动。
+
+使用方法:
+python benchmarks/bench_model_catalog.py [--models 60] [--page-size 50] [--rtt 0.4]
+'''
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_catalog import ModelCatalog  # noqa: E402
+from model_router import build_model_router  # noqa: E402
+
+
+def make_list_models(count, page_size, rtt):
+    models = [types.SimpleNamespace(name=f"models/gemini-test-{index}",
+                                    supported_generation_methods=['generateContent', 'countTokens'],
+                                    input_token_limit=1048576, output_token_limit=65536)
+              for index in range(count)]
+
+    def list_models():
+        for start in range(0, len(models), page_size):
+            time.sleep(rtt)  # 每页一次网络往返
+            yield from models[start:start + page_size]
+    return list_models
+
+
+def legacy_init(list_models, model_name, missing_default):
+    """旧实现：遍历模型目录找默认模型，找不到时再遍历一次选第一个"""
+    target = 'models/not-exist' if missing_default else model_name
+    selected = None
+    for model in list_models():
+        if 'generateContent' in model.supported_generation_methods and model.name == target:
+            selected = model
+    if selected is None:
+        for model in list_models():
+            if 'generateContent' in model.supported_generation_methods:
+                return model
+    return selected
+
+
+def catalog_init(list_models, cache_path, model_name, ttl_sec=3600, force_refresh=False):
+    catalog = ModelCatalog(list_models, cache_path=cache_path, ttl_sec=ttl_sec, api_key='bench')
+    available = catalog.generate_models(catalog.get(force_refresh=force_refresh))
+    router = build_model_router([{'name': model_name, 'tpm': 250000, 'rpm': 10}], available, lambda name: name)
+    return catalog, router
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='模型目录缓存基准测试')
+    parser.add_argument('--models', type=int, default=60, help='模型目录中的模型数')
+    parser.add_argument('--page-size', type=int, default=50, help='list_models 每页的模型数')
+    parser.add_argument('--rtt', type=float, default=0.4, help='每页请求的往返延迟（秒）')
+    args = parser.parse_args()
+
+    list_models = make_list_models(args.models, args.page_size, args.rtt)
+    model_name = 'models/gemini-test-0'
+    cache_path = os.path.join(tempfile.mkdtemp(prefix='bench_catalog_'), 'model_catalog.json')
+
+    rows = [
+        ('旧实现（默认模型存在）', timed(lambda: legacy_init(list_models, model_name, False))[0]),
+        ('旧实现（默认模型不存在）', timed(lambda: legacy_init(list_models, model_name, True))[0]),
+        ('无缓存 / --refresh-models', timed(lambda: catalog_init(list_models, cache_path, model_name))[0]),
+        ('缓存有效', timed(lambda: catalog_init(list_models, cache_path, model_name))[0]),
+    ]
+    stale_seconds, (catalog, _) = timed(lambda: catalog_init(list_models, cache_path, model_name, ttl_sec=0))
+    rows.append(('缓存过期（后台刷新）', stale_seconds))
+    catalog.wait_refresh()
+
+    print(f"模型目录: {args.models} 个模型, 每页 {args.page_size} 个, 每页往返 {args.rtt} 秒")
+    print(f"{'方式':<24}{'耗时(秒)':>10}")
+    for name, seconds in rows:
+        print(f"{name:<24}{seconds:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+'''
+启动耗时基准测试
+
+功能描述:
+用新的子进程测量冷启动耗时（每次都是全新的解释器，取N次中的最小值）：
+- import demo: 只导入主程序模块，不执行任何操作；
+- demo.py --help: 解析参数后立即退出。
+旧实现在导入时就加载 google.generativeai、requests、tqdm、tkinter 等重量级依赖并创建日志文件，
+现在这些依赖推迟到真正用到时才导入，--help 也不会联网检测或创建日志文件。
+指定 --importtime 时额外输出 python -X importtime 中累计耗时最多的模块。
+
+使用方法:
+python benchmarks/bench_startup.py [--runs 5] [--importtime] [--top 15]
+'''
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_once(args):
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + args, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                   check=False)
+    return time.perf_counter() - start
+
+
+def best_of(args, runs):
+    return min(run_once(args) for _ in range(runs))
+
+
+def import_time_top(top):
+    """返回 import demo 时累计耗时最多的模块: [(模块名, 累计微秒)]"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import demo'], cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=False)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|', 2)
+        rows.append((name.strip(), int(cumulative)))
+    return sorted(rows, key=lambda row: row[1], reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='启动耗时基准测试')
+    parser.add_argument('--runs', type=int, default=5, help='每项测量的次数（取最小值）')
+    parser.add_argument('--importtime', action='store_true', help='输出导入耗时最多的模块')
+    parser.add_argument('--top', type=int, default=15, help='--importtime 输出的模块数')
+    args = parser.parse_args()
+
+    baseline = best_of(['-c', 'pass'], args.runs)
+    rows = [
+        ('python -c pass', baseline),
+        ('import demo', best_of(['-c', 'import demo'], args.runs)),
+        ('demo.py --help', best_of(['demo.py', '--help'], args.runs)),
+    ]
+
+    print(f"每项运行 {args.runs} 次，取最小值")
+    print(f"{'方式':<20}{'耗时(秒)':>10}{'扣除解释器启动(秒)':>20}")
+    for name, seconds in rows:
+        print(f"{name:<20}{seconds:>10.3f}{seconds - baseline:>20.3f}")
+
+    if args.importtime:
+        print(f"\nimport demo 累计耗时最多的 {args.top} 个模块:")
+        for name, cumulative in import_time_top(args.top):
+            print(f"{cumulative / 1000:>10.1f} ms  {name}")
+
+
+if __name__ == '__main__':
+    main()
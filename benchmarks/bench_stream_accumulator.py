@@ -0,0 +1,114 @@
+'''
+流式回复处理基准测试
+
+功能描述:
+模拟模型流式返回一份长日报（默认约6万Token，包在 ```html 代码块中，前后带说明文字），
+对比旧实现（字符串 += 拼接、每块调用 set_description、结束后用 split/find 提取HTML）
+与 StreamAccumulator + HtmlStreamExtractor + ThrottledProgress 的CPU耗时，并校验两者提取的HTML一致。
+
+使用方法:
+python benchmarks/bench_stream_accumulator.py [--chars 240000] [--chunk-chars 40]
+'''
+
+import argparse
+import io
+import os
+import random
+import sys
+import time
+
+import tqdm
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stream_accumulator import HtmlStreamExtractor, StreamAccumulator, ThrottledProgress  # noqa: E402
+
+
+def legacy_extract(response_text):
+    """旧实现的HTML提取"""
+    if response_text.strip().startswith('<'):
+        return response_text
+    if '```html' in response_text and '```' in response_text.split('```html', 1)[1]:
+        return response_text.split('```html', 1)[1].split('```', 1)[0].strip()
+    if '<html' in response_text and '</html>' in response_text:
+        return response_text[response_text.find('<html'):response_text.find('</html>') + 7]
+    raise ValueError("无法从响应中提取HTML")
+
+
+def legacy_consume(chunks, output):
+    """旧实现：字符串 += 拼接，每块都更新进度条描述"""
+    progress_bar = tqdm.tqdm(desc="生成进度", unit="字符", file=output)
+    response_text = ""
+    for current_chunk in chunks:
+        response_text += current_chunk
+        progress_bar.update(len(current_chunk))
+        if 0 < len(current_chunk) < 100:
+            readable_chunk = current_chunk.replace('<', '＜').replace('>', '＞')
+            progress_bar.set_description(f"最新内容: {readable_chunk[:30]}...")
+    progress_bar.close()
+    return legacy_extract(response_text)
+
+
+def streaming_consume(chunks, output):
+    """新实现：累加器 + 增量提取 + 限频进度条"""
+    accumulator = StreamAccumulator()
+    extractor = HtmlStreamExtractor()
+    progress = ThrottledProgress(tqdm.tqdm(desc="生成进度", unit="字符", file=output))
+    for current_chunk in chunks:
+        accumulator.append(current_chunk)
+        extractor.feed(current_chunk)
+        progress.advance(current_chunk)
+    progress.close()
+    return extractor.result(accumulator.text())
+
+
+def build_chunks(chars, chunk_chars, rng):
+    rows = []
+    total = 0
+    while total < chars:
+        row = f'<div class="topic"><h3>话题 {len(rows)}</h3><p>{"群友讨论了推理优化与缓存复用" * rng.randint(1, 4)}</p></div>\n'
+        rows.append(row)
+        total += len(row)
+    text = "好的，以下是生成的群日报：\n\n```html\n<!DOCTYPE html>\n<html><body>\n" + "".join(rows) + "</body></html>\n```\n\n希望对你有帮助！"
+    chunks = []
+    position = 0
+    while position < len(text):
+        size = rng.randint(max(1, chunk_chars // 2), chunk_chars * 2)
+        chunks.append(text[position:position + size])
+        position += size
+    return chunks
+
+
+def measure(func, chunks, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        output = io.StringIO()
+        start = time.process_time()
+        result = func(chunks, output)
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='流式回复处理基准测试')
+    parser.add_argument('--chars', type=int, default=240000, help='回复长度（字符），约6万Token')
+    parser.add_argument('--chunk-chars', type=int, default=40, help='平均每个文本块的字符数')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    chunks = build_chunks(args.chars, args.chunk_chars, random.Random(42))
+    print(f"模拟回复: {sum(len(c) for c in chunks)} 字符, {len(chunks)} 个文本块")
+
+    legacy_time, legacy_html = measure(legacy_consume, chunks, args.repeat)
+    streaming_time, streaming_html = measure(streaming_consume, chunks, args.repeat)
+    assert legacy_html == streaming_html
+
+    print(f"{'方式':<22}{'CPU耗时(秒)':>12}")
+    print(f"{'旧实现(+= / 每块刷新)':<22}{legacy_time:>12.3f}")
+    print(f"{'累加器 + 增量提取':<22}{streaming_time:>12.3f}")
+
+
+if __name__ == '__main__':
+    main()
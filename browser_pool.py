@@ -0,0 +1,310 @@
+'''
+无头浏览器池
+
+功能描述:
+为 html_to_png 复用常驻的无头Chrome实例，而不是每张图片都冷启动一个浏览器：
+- 池大小默认按CPU核数确定（上限4个，Chrome较占内存），多张PNG可以并行渲染；
+- chromedriver 路径优先使用配置，其次使用上次解析并缓存到本地的路径，
+  只有都不可用时才调用 webdriver_manager（需要联网），仍失败时交给 Selenium Manager；
+  Chrome自动更新后缓存的 chromedriver 版本不匹配、启动失败时，删除缓存重新解析并重试一次；
+- 渲染出错的浏览器实例直接关闭丢弃，不再放回池中；程序退出时保证关闭所有实例；
+- 统计渲染次数、平均耗时和吞吐量。
+selenium 在首次创建浏览器时才导入，不生成PNG的运行不加载。
+
+使用方法:
+1. pool = get_browser_pool()
+2. with pool.driver() as driver:
+       driver.get(url)
+3. shutdown_browser_pool() 关闭所有浏览器并输出统计
+
+依赖安装:
+pip install selenium webdriver-manager
+'''
+
+import atexit
+import json
+import logging
+import os
+import queue
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW_SIZE = (1920, 1080)
+MAX_DEFAULT_POOL_SIZE = 4
+DEFAULT_DRIVER_PATH_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temp', 'chromedriver_path.json')
+
+
+def default_pool_size():
+    """按CPU核数确定的默认池大小"""
+    return max(1, min(os.cpu_count() or 1, MAX_DEFAULT_POOL_SIZE))
+
+
+def resolve_chromedriver_path(configured_path=None, cache_file=DEFAULT_DRIVER_PATH_CACHE, use_cache=True):
+    """
+    解析 chromedriver 可执行文件路径
+
+    参数:
+        configured_path (str): 配置中指定的路径
+        cache_file (str): 缓存上次解析结果的文件
+        use_cache (bool): 是否使用缓存的路径（False时重新调用 webdriver_manager 并更新缓存）
+
+    返回:
+        str: chromedriver 路径；返回None时由 Selenium Manager 自动查找
+    """
+    if configured_path:
+        if os.path.exists(configured_path):
+            return configured_path
+        logger.warning(f"配置的chromedriver路径不存在，将自动查找: {configured_path}")
+
+    # 上次解析的路径仍然存在时直接使用，不再联网检查版本（版本不匹配时由 refresh_chromedriver_path 重新解析）
+    if use_cache:
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                cached_path = json.load(f).get('path')
+            if cached_path and os.path.exists(cached_path):
+                return cached_path
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"读取chromedriver路径缓存失败: {str(e)}")
+
+    try:
+        from webdriver_manager.chrome import ChromeDriverManager
+        driver_path = ChromeDriverManager().install()
+    except Exception as e:
+        logger.warning(f"webdriver_manager 获取chromedriver失败，将交给 Selenium Manager 查找: {str(e)}")
+        return None
+
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(cache_file, 'w', encoding='utf-8') as f:
+            json.dump({'path': driver_path}, f, ensure_ascii=False)
+    except Exception as e:
+        logger.warning(f"保存chromedriver路径缓存失败: {str(e)}")
+    return driver_path
+
+
+def refresh_chromedriver_path(configured_path=None, cache_file=DEFAULT_DRIVER_PATH_CACHE):
+    """删除chromedriver路径缓存并重新解析（缓存的chromedriver与自动更新后的Chrome版本不匹配时调用）"""
+    try:
+        os.remove(cache_file)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"删除chromedriver路径缓存失败: {str(e)}")
+    return resolve_chromedriver_path(configured_path, cache_file, use_cache=False)
+
+
+def create_chrome_options(window_size=DEFAULT_WINDOW_SIZE):
+    """无头Chrome的启动参数"""
+    from selenium.webdriver.chrome.options import Options
+
+    chrome_options = Options()
+    chrome_options.add_argument("--headless")  # 无头模式
+    chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument(f"--window-size={window_size[0]},{window_size[1]}")  # 设置窗口大小
+    return chrome_options
+
+
+class BrowserPool:
+    """
+    无头Chrome实例池，线程安全
+    """
+
+    def __init__(self, size=None, driver_path=None, window_size=DEFAULT_WINDOW_SIZE, driver_resolver=None):
+        """
+        初始化浏览器池（浏览器在首次使用时才启动）
+
+        参数:
+            size (int): 最多同时存在的浏览器实例数，None表示按CPU核数确定
+            driver_path (str): chromedriver 路径，None表示由 Selenium Manager 查找
+            window_size (tuple): 每次渲染前重置的窗口大小
+            driver_resolver (callable): 启动失败时重新解析 chromedriver 路径的函数，None表示不重试
+        """
+        self.size = size or default_pool_size()
+        self.driver_path = driver_path
+        self.driver_resolver = driver_resolver
+        self._resolver_lock = Lock()
+        self.window_size = window_size
+        self._idle = queue.LifoQueue()  # 优先复用最近使用过的实例
+        self._count = 0  # 已启动（含正在启动）的实例数
+        self._lock = Lock()
+        self._closed = False
+        self._started_at = None
+        self._stats = {'renders': 0, 'failures': 0, 'launches': 0, 'busy_sec': 0.0, 'launch_sec': 0.0}
+
+    def _launch(self):
+        from selenium import webdriver
+        from selenium.webdriver.chrome.service import Service
+
+        start = time.time()
+        driver_path = self.driver_path
+        try:
+            service = Service(driver_path) if driver_path else Service()
+            driver = webdriver.Chrome(service=service, options=create_chrome_options(self.window_size))
+        except Exception as e:
+            driver_path = self._refresh_driver_path(driver_path, e)
+            service = Service(driver_path) if driver_path else Service()
+            driver = webdriver.Chrome(service=service, options=create_chrome_options(self.window_size))
+        elapsed = time.time() - start
+        with self._lock:
+            self._stats['launches'] += 1
+            self._stats['launch_sec'] += elapsed
+        logger.info(f"浏览器池: 已启动第 {self._stats['launches']} 个浏览器实例，耗时 {elapsed:.2f} 秒")
+        return driver
+
+    def _refresh_driver_path(self, failed_path, error):
+        """
+        浏览器启动失败后重新解析 chromedriver 路径（多个线程同时失败时只解析一次）
+
+        返回:
+            str: 新的 chromedriver 路径；无法换用其他路径时重新抛出 error
+        """
+        with self._resolver_lock:
+            if self.driver_path == failed_path:
+                if self.driver_resolver is None:
+                    raise error
+                logger.warning(f"浏览器启动失败（可能是Chrome已更新、chromedriver版本不匹配），重新解析chromedriver: {str(error)}")
+                new_path = self.driver_resolver()
+                if new_path == failed_path:
+                    raise error
+                self.driver_path = new_path
+            return self.driver_path
+
+    def _acquire(self):
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError("浏览器池已关闭")
+                if self._started_at is None:
+                    self._started_at = time.time()
+                try:
+                    return self._idle.get_nowait()
+                except queue.Empty:
+                    pass
+                # 池未满时占一个名额并启动新实例，启动过程不持有锁
+                if self._count < self.size:
+                    self._count += 1
+                    break
+            # 池已满，等待其他线程归还；定期醒来检查是否有实例被丢弃而空出名额
+            try:
+                return self._idle.get(timeout=1)
+            except queue.Empty:
+                continue
+        try:
+            return self._launch()
+        except Exception:
+            with self._lock:
+                self._count -= 1
+            raise
+
+    def _discard(self, driver):
+        with self._lock:
+            self._count -= 1
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.warning(f"关闭浏览器实例失败: {str(e)}")
+
+    @contextmanager
+    def driver(self):
+        """
+        借出一个浏览器实例，用完自动归还；使用过程中出错时关闭该实例
+
+        返回:
+            WebDriver: 窗口大小已重置的浏览器实例
+        """
+        driver = self._acquire()
+        start = time.time()
+        try:
+            driver.set_window_size(*self.window_size)
+            yield driver
+        except BaseException:
+            with self._lock:
+                self._stats['failures'] += 1
+            self._discard(driver)
+            raise
+        else:
+            with self._lock:
+                self._stats['renders'] += 1
+                self._stats['busy_sec'] += time.time() - start
+                closed = self._closed
+            if closed:
+                self._discard(driver)
+            else:
+                self._idle.put(driver)
+
+    def stats(self):
+        """
+        浏览器池统计
+
+        返回:
+            dict: renders、failures、launches、avg_render_sec、avg_launch_sec、throughput_per_min
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            elapsed = time.time() - self._started_at if self._started_at else 0.0
+        stats['avg_render_sec'] = stats['busy_sec'] / stats['renders'] if stats['renders'] else 0.0
+        stats['avg_launch_sec'] = stats['launch_sec'] / stats['launches'] if stats['launches'] else 0.0
+        stats['throughput_per_min'] = stats['renders'] * 60 / elapsed if elapsed > 0 else 0.0
+        return stats
+
+    def log_stats(self):
+        """在日志中输出浏览器池统计"""
+        stats = self.stats()
+        if not stats['renders'] and not stats['failures']:
+            return
+        logger.info(f"浏览器池统计: 渲染 {stats['renders']} 次（失败 {stats['failures']} 次）, "
+                    f"启动浏览器 {stats['launches']} 次（平均 {stats['avg_launch_sec']:.2f} 秒）, "
+                    f"平均渲染 {stats['avg_render_sec']:.2f} 秒, 吞吐量 {stats['throughput_per_min']:.1f} 张/分钟")
+
+    def close(self):
+        """关闭所有浏览器实例，正在使用中的实例归还时关闭"""
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(driver)
+
+
+_pool = None
+_pool_lock = Lock()
+
+
+def get_browser_pool():
+    """获取进程内共享的浏览器池，池大小和chromedriver路径从cfg.py读取"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            try:
+                from cfg import CHAT_DEMO_CFG
+            except ImportError:
+                CHAT_DEMO_CFG = {}
+            configured_path = CHAT_DEMO_CFG.get('chromedriver_path')
+            _pool = BrowserPool(
+                size=CHAT_DEMO_CFG.get('browser_pool_size'),
+                driver_path=resolve_chromedriver_path(configured_path),
+                driver_resolver=lambda: refresh_chromedriver_path(configured_path),
+            )
+            atexit.register(_pool.close)
+            logger.info(f"浏览器池已创建，最多 {_pool.size} 个浏览器实例")
+        return _pool
+
+
+def shutdown_browser_pool():
+    """输出统计并关闭共享的浏览器池"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.log_stats()
+        pool.close()
@@ -36,6 +36,8 @@ CHAT_DEMO_CFG = {
         #     "auto_send_to_wechat": False,  # 是否自动发送到微信
         #     "wechat_message_prefix": "今日群日报已生成：",  # 微信消息前缀
         #     "auto_sync_to_feishu": True,  # 是否同步到飞书
+        #     "summary_mode": "map_reduce",  # 多片段时先浓缩再合并生成一份日报
+        #     "chatlog_compaction": False,  # 不压缩该群的聊天记录
         #     "related_link": {
         #         "text": "查看更多群日报",  # 链接显示的文本
         #         "url": "https://www.baidu.com/"  # 链接的目标URL
@@ -62,7 +64,7 @@ CHAT_DEMO_CFG = {
         # "互联网行业交流（北京）",
     ],
     'days': 1,  # 获取最近多少天的聊天记录。当填写为0时，代表就只是当天。填写为1时，代表今天和昨天。命令行未指定时使用此值。
-    # 数据打码脱敏规则
+    # 数据打码脱敏规则。所有规则单遍匹配，同一位置优先匹配最长的关键词，与规则顺序无关
     "data_masking_rules": {
         "小严同学": "NPC1号",
         "小严同学（goDog神走狗神）": "NPC2号"
@@ -76,10 +78,27 @@ CHAT_DEMO_CFG = {
         "output_dir": r"./output",  # 输出的html地址
         "auto_open_browser": True,  # 是否自动打开浏览器
         "auto_generate_png": True,  # 是否自动生成PNG图片
+        "browser_pool_size": None,  # 生成PNG时最多同时运行的无头浏览器数，None表示按CPU核数确定（最多4个）
+        "png_ready_timeout_sec": 15,  # 生成PNG时等待页面（字体、图片、网络请求）就绪的最长秒数
+        "png_network_idle_ms": 500,  # 多少毫秒内没有新的资源请求完成即视为网络空闲
+        "png_max_capture_height": 16000,  # 单次截图的最大高度（像素），更高的页面分块截图后拼接（需安装Pillow）
+        "render_cache_enabled": True,  # 是否缓存渲染好的PNG：HTML内容和截图参数都相同时直接复用，不再启动浏览器
+        "render_cache_max_mb": 200,  # PNG渲染缓存（位于输出目录下的 .render_cache）的总大小上限，超出后淘汰最久未使用的
+        "render_cache_max_age_days": 30,  # PNG渲染缓存中超过多少天未使用的图片会被清理
+        "chromedriver_path": None,  # chromedriver路径，None表示自动查找（首次解析后会缓存到temp目录，之后不再联网）
         "auto_generate_url": True,  # 是否自动生成URL
         "url_requires_password": False,  # 是否自动生成URL
         "website_hosting_address":"http://139.196.112.100:8888",
         "chatlog_exe_path": "./chatlog/chatlog.exe",  # 开源项目chatlog的exe可执行程序。
+        "chatlog_cache_enabled": True,  # 是否按天缓存聊天记录：已结束的日期只下载一次，当天只增量获取新消息（--refresh-chatlog-cache 可忽略缓存重新获取）
+        "chatlog_cache_incremental": True,  # 当天的记录是否只从最后一条消息的时间开始增量获取（失败时自动改为获取整天）
+        "chatlog_cache_dir": r"./temp/chatlog_cache",  # 聊天记录缓存目录（注意：其中是未经 data_masking_rules 打码的原始聊天记录，请勿共享或上传）
+        "chatlog_cache_close_grace_hours": 6,  # 日期结束多少小时后获取的非空记录才视为完整、不再重新获取（等待微信数据库同步）
+        "chatlog_cache_retention_days": 30,  # 聊天记录缓存保留的天数，更早日期的原始记录在写入缓存时删除；0表示不删除
+        "chatlog_spool_max_size": 8 * 1024 * 1024,  # 流式下载聊天记录时内存中最多缓存的大小（字节），超出后写入临时文件
+        "chatlog_compaction_enabled": True,  # 发送给模型前是否压缩聊天记录：发言人改为短代号+成员表、时间改为时间差、合并连续发言、缩短媒体占位符（可在talker中用 chatlog_compaction 单独配置）
+        "http_timeout": (5, 30),  # HTTP请求默认超时（连接秒数, 读取秒数），适用于chatlog、网页托管和飞书接口
+        "http_retries": 3,  # HTTP GET请求在连接失败或502/503/504时的自动重试次数
         "manual_gui_auto_decryption": False,  # 是否需要手动启动GUI以获取最新数据
         "manual_gui_auto_decryption_wait_sec": 10,  # 等待N秒，秒数
     },
@@ -90,9 +109,46 @@ CHAT_DEMO_CFG = {
         "logging_date_format": '%Y-%m-%d %H:%M:%S'
     },
     # Gemini API 调用相关配置
+    # 可用的模型及各自的限制，排在前面的优先；某个模型配额用尽、不可用或已下线时自动切换到下一个，
+    # 主模型当前窗口额度用满时请求也会分流到其他模型。聊天记录按第一个可用模型的限制切分
+    'gemini_models': [
+        {
+            "name": 'models/gemini-2.5-flash-preview-04-17-thinking',  # 模型名称
+            "tpm": 250000,  # 每分钟Token数上限
+            "rpm": 10,  # 每分钟请求数上限
+            # "input_token_limit": 1048576,  # 单次输入Token上限，不填则使用服务端返回的值
+            # "output_token_limit": 65536,  # 单次输出Token上限，不填则使用服务端返回的值
+            "speed": 1.0,  # 相对速度（1.0为基准），配合 gemini_latency_target_sec 使用
+        },
+        # {"name": 'models/gemini-2.0-flash', "tpm": 1000000, "rpm": 15, "speed": 2.0},
+    ],
+    'model_catalog_path': r"./temp/model_catalog.json",  # 模型目录（名称、支持的方法、输入/输出Token上限）的本地缓存，启动时不再遍历模型列表（--refresh-models 强制刷新）
+    'model_catalog_ttl_sec': 24 * 3600,  # 模型目录缓存的有效期（秒），过期后先用旧目录启动，同时在后台刷新
+    'gemini_latency_target_sec': None,  # 每份日报的目标生成时间（秒），设置后优先选择按相对速度估算能在该时间内完成的模型；None表示不考虑
+    'gemini_expected_output_tokens': 16000,  # 估算生成时间时假设的日报输出Token数
+    'prompt_compile_enabled': True,  # 是否编译Prompt模板：去掉多余空白、重复段落并压缩示例代码，减少每次请求的固定Token数
+    'prompt_compile_strip_examples': False,  # 编译时是否去掉"示例/案例代码"标题下的示例代码（会影响生成的页面风格）
+    'prompt_compile_strip_comments': False,  # 编译时是否去掉HTML/CSS/JS注释（模板注释中多是写给模型的填写说明，去掉会改变要求）
     'safety_margin_tokens': 1000,  # token计算时的安全边际
-    'gemini_retry_attempts': 5,  # Gemini API调用失败时的最大重试次数
-    'gemini_retry_delay_sec': 60,  # Gemini API调用失败时重试的等待秒数
+    'token_cache_path': r"./temp/token_count_cache.sqlite3",  # Token计数缓存（SQLite），相同文本不再重复调用count_tokens
+    'token_cache_max_entries': 5000,  # Token计数缓存最多保留的条目数，超出后淘汰最久未使用的
+    'llm_cache_dir': r"./temp/llm_cache",  # 模型响应缓存目录：模型、生成参数和Prompt都相同时直接复用之前生成的HTML（--no-llm-cache 可跳过）
+    'llm_cache_max_mb': 100,  # 模型响应缓存的总大小上限，超出后淘汰最久未使用的
+    'gemini_context_cache_enabled': False,  # 是否使用Gemini显式上下文缓存：开场说明+日报模板只上传一次，同一模板的所有群聊/片段引用该缓存（缓存部分按较低单价计费，失败时自动回退为完整Prompt）
+    'gemini_context_cache_ttl_sec': 3600,  # 上下文缓存的有效期（秒），应覆盖整次运行；运行结束时会主动删除
+    'gemini_context_cache_min_tokens': 1024,  # 固定前缀少于该Token数时不创建缓存（服务端的最小要求因模型而异）
+    'gemini_context_cache_backend': 'gemini',  # 'gemini' 调用Gemini缓存接口；'local' 本地替身（不联网，用于离线测试缓存与回退逻辑）
+    'gemini_retry_attempts': 5,  # Gemini API调用的最多尝试次数；参数错误、鉴权失败、Prompt被拦截等不可重试的错误直接失败
+    'gemini_retry_delay_sec': 60,  # 重试前单次等待的上限秒数（按指数退避+随机抖动增长；服务端给出的429重试时间不受此限制）
+    'gemini_retry_base_delay_sec': 2,  # 网络错误、503等临时错误第一次重试前的基础等待秒数，之后每次翻倍
+    'gemini_retry_rate_limit_delay_sec': 30,  # 429限流且服务端未给出重试时间时的基础等待秒数，之后每次翻倍
+    'gemini_retry_content_attempts': 2,  # 回复被安全策略截断、无法提取HTML等内容错误的最多尝试次数
+    'gemini_retry_budget_sec': 900,  # 每份日报（一次生成调用）从第一次请求开始的总时间预算（秒），超出后不再重试
+    'gemini_stream_to_disk': True,  # 生成HTML时是否边接收边写入检查点目录下的临时文件，完成后原子地重命名
+    'gemini_continuation_attempts': 2,  # 流式生成中途断开时，带上已生成的部分发起续写请求的最大次数（0表示不续写，直接从头重试）
+    'summary_mode': 'per_segment',  # 聊天记录被切分为多个片段时：'per_segment' 每个片段各生成一份日报（_part_N）；'map_reduce' 先把各片段浓缩为摘要，再合并生成一份日报（可在talker中单独配置）
+    'map_summary_max_output_tokens': 4096,  # map_reduce 模式下每个片段摘要的最大输出Token数
+    'max_concurrency': 1,  # 最多同时处理的群聊数/片段数，1表示逐个串行处理；所有并发请求共享同一份TPM限制
     'related_link': {
         'text': '查看更多群日报',  # 链接显示的文本
         'url': 'https://www.baidu.com/'  # 链接的目标URL
@@ -0,0 +1,313 @@
+'''
+聊天记录压缩编码
+
+功能描述:
+chatlog 返回的每条消息都重复完整的 "昵称(wxid) 日期 时间" 消息头、消息之间的空行，以及带完整URL的媒体占位符，
+这些内容占用大量Token，还会导致聊天记录被切分成更多片段。本模块在获取聊天记录之后、切分之前，
+把聊天记录转换为可逆的紧凑格式：
+- 发言人使用短代号（A、B、…，发言越多代号越短），开头附成员表说明代号对应的昵称；
+- 每条消息一行，时间写成距上一条消息的秒数；日期变化、时间倒退或进入新的小时时写一行 "@日期 时间" 作为基准；
+- 同一人连续发言时省略代号；
+- 图片、视频、语音、表情占位符去掉URL并缩短标签（URL单独保存，可还原）；
+  链接、文件、小程序等占位符保持原样，模型需要其中的URL整理分享的资源。
+空消息、结尾缺少空行等不规范的消息块照常压缩，其原始结尾单独保存用于还原。
+压缩后会校验能否完整还原，校验失败时不压缩，直接使用原文。
+
+紧凑格式示例:
+    @04-27 15:04:05
+    A:大家好
+    B+35:[图]
+    +3:这是刚才的截图
+
+使用方法:
+1. compacted = compact_chat_log(chat_logs)，无法压缩时返回None
+2. 按 compacted.body 切分片段，再用 compacted.self_contained(segments) 为每个片段补上成员表和时间基准
+3. compacted.expand() 还原为原始聊天记录
+'''
+
+import logging
+import re
+from collections import Counter
+
+from chatlog_format import parse_header, split_messages
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+LEGEND_HEADER = ("【压缩格式说明】每行一条消息，格式为\"代号+秒数:内容\"。代号对应的成员见成员表，省略代号表示与上一条消息是同一人；"
+                 "\"+秒数\"为距上一条消息的间隔，省略表示同一秒；\"@日期 时间\"行是之后消息的时间基准；内容中的\\n表示换行；"
+                 "[图][视][音][表]依次为图片、视频、语音、表情占位符。"
+                 "生成日报时请使用成员昵称，不要使用代号。")
+MEMBERS_MARK = "【成员】"
+MESSAGES_MARK = "【消息】"
+
+# chatlog 的媒体占位符，如 ![图片](http://...)；只缩短URL对模型没有意义的类型，
+# [链接|标题](url)、[文件|名称](url)、[小程序|...](url) 等保留URL，供日报整理分享的资源
+_MEDIA_RE = re.compile(r'!?\[(图片|视频|语音|动画表情|表情)(\|[^\]\n]*)?\]\([^)\s]*\)')
+MEDIA_SHORT_LABELS = {'图片': '图', '视频': '视', '语音': '音', '动画表情': '表', '表情': '表'}
+_SHORT_MEDIA_RE = re.compile(r'\[(?:' + '|'.join(sorted(set(MEDIA_SHORT_LABELS.values()))) + r')(?:\|[^\]\n]*)?\]')
+
+# 需要转义的字符：反斜杠、换行，以及 str.splitlines 会视为换行的其他字符（保证一条消息只占一行）
+_ESCAPE_RE = re.compile('[\\\\\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]')
+_UNESCAPE_RE = re.compile(r'\\(\\|n|u[0-9a-f]{4})')
+_LINE_RE = re.compile(r'^(?P<alias>[A-Z]*)(?:\+(?P<delta>\d+))?:(?P<body>.*)$')
+_ANCHOR_RE = re.compile(r'^@(?:(?P<date>(?:\d{4}-)?\d{2}-\d{2}) )?(?P<time>\d{2}:\d{2}:\d{2})$')
+
+
+def _alias(index):
+    """第 index 个代号：A..Z, AA..ZZ, ..."""
+    alias = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        alias = chr(ord('A') + remainder) + alias
+    return alias
+
+
+def _escape(text):
+    def replace(match):
+        char = match.group(0)
+        if char == '\\':
+            return '\\\\'
+        if char == '\n':
+            return '\\n'
+        return f'\\u{ord(char):04x}'
+    return _ESCAPE_RE.sub(replace, text)
+
+
+def _unescape(text):
+    def replace(match):
+        code = match.group(1)
+        if code == '\\':
+            return '\\'
+        if code == 'n':
+            return '\n'
+        return chr(int(code[1:], 16))
+    return _UNESCAPE_RE.sub(replace, text)
+
+
+def _to_seconds(time_text):
+    hours, minutes, seconds = time_text.split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+def _to_time(seconds):
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def _anchor_line(date, seconds):
+    return f"@{date} {_to_time(seconds)}" if date else f"@{_to_time(seconds)}"
+
+
+def _build_legend(aliases):
+    """aliases: (代号, 发言人) 列表"""
+    return "\n".join([LEGEND_HEADER, MEMBERS_MARK] + [f"{alias}={sender}" for alias, sender in aliases] + [MESSAGES_MARK]) + "\n"
+
+
+class CompactedChatLog:
+    """
+    压缩后的聊天记录
+
+    属性:
+        legend (str): 格式说明和成员表
+        body (str): 紧凑格式的消息，每行一条消息或一个时间基准
+        media (list): 按出现顺序保存的原始媒体占位符，用于还原
+        senders (dict): 代号 -> 发言人（昵称(wxid)）
+        original_text (str): 原始聊天记录
+        tails (dict): 不规范消息块的序号 -> 消息头之后的原始文本，用于还原
+    """
+
+    def __init__(self, legend, body, media, senders, original_text, tails=None):
+        self.legend = legend
+        self.body = body
+        self.media = media
+        self.senders = senders
+        self.original_text = original_text
+        self.tails = tails or {}
+
+    @property
+    def text(self):
+        """完整的紧凑文本（成员表 + 消息）"""
+        return self.legend + self.body
+
+    def expand(self):
+        """还原为原始聊天记录"""
+        return expand_chat_log(self.text, self.media, self.tails)
+
+    def self_contained(self, segments):
+        """
+        为按行切分出的片段补上成员表（只含片段中出现的成员）、片段开头的时间基准和发言人代号，
+        使每个片段都能单独阅读
+
+        参数:
+            segments (list): body 按行切分后的连续片段（拼接后等于 body）
+
+        返回:
+            list: 可以单独发送给模型的片段
+        """
+        results = []
+        date, seconds, alias = None, None, None
+        for segment in segments:
+            lines = segment.split('\n')
+            if lines and lines[-1] == '':
+                lines.pop()
+            prefix_lines = []
+            if seconds is not None and lines and not lines[0].startswith('@'):
+                prefix_lines.append(_anchor_line(date, seconds))
+            for index, line in enumerate(lines):
+                if line.startswith('@'):
+                    continue
+                if line.startswith(('+', ':')) and alias:
+                    # 片段以省略代号的连续发言开头时补上代号
+                    lines[index] = alias + line
+                break
+
+            used_aliases = []
+            for line in lines:
+                anchor = _ANCHOR_RE.match(line)
+                if anchor:
+                    date, seconds = anchor.group('date'), _to_seconds(anchor.group('time'))
+                    continue
+                match = _LINE_RE.match(line)
+                if not match:
+                    continue
+                if match.group('alias'):
+                    alias = match.group('alias')
+                    if alias not in used_aliases:
+                        used_aliases.append(alias)
+                seconds = (seconds or 0) + int(match.group('delta') or 0)
+
+            legend = _build_legend([(a, self.senders[a]) for a in sorted(used_aliases, key=lambda a: (len(a), a))
+                                    if a in self.senders])
+            results.append(legend + "".join(line + "\n" for line in prefix_lines + lines))
+        return results
+
+
+def compact_chat_log(text, shorten_media=True):
+    """
+    把chatlog聊天记录转换为紧凑格式
+
+    参数:
+        text (str): chatlog 返回（已打码）的聊天记录
+        shorten_media (bool): 是否缩短媒体占位符
+
+    返回:
+        CompactedChatLog: 压缩结果；聊天记录为空、开头不是消息头或无法完整还原时返回None
+    """
+    if not text:
+        return None
+
+    messages = []
+    tails = {}
+    for index, block in enumerate(split_messages(text)):
+        match = parse_header(block)
+        if not match:
+            # 只有开头第一块可能不以消息头开始
+            logger.info("聊天记录开头不是消息头，跳过压缩")
+            return None
+        first_line, sep, rest = block.partition('\n')
+        if sep and rest.endswith('\n\n') and not first_line.endswith('\r'):
+            body = rest[:-2]
+        else:
+            # 空消息、结尾缺少空行等不规范的消息块：正文去掉结尾换行后照常压缩，原始结尾单独保存
+            body = rest.rstrip('\r\n')
+            tails[index] = block[len(match.group(0)):]
+        messages.append((match.group('sender'), match.group('date'), _to_seconds(match.group('time')), body))
+
+    # 原文中已经出现缩短后的占位符时无法区分，不缩短
+    if shorten_media and _SHORT_MEDIA_RE.search(text):
+        shorten_media = False
+
+    sender_counts = Counter(sender for sender, _, _, _ in messages)
+    aliases = {sender: _alias(index) for index, (sender, _) in enumerate(sender_counts.most_common())}
+
+    media = []
+
+    def shorten(match):
+        media.append(match.group(0))
+        return f"[{MEDIA_SHORT_LABELS[match.group(1)]}{match.group(2) or ''}]"
+
+    lines = []
+    current_date, current_seconds, current_sender = None, None, None
+    for sender, date, seconds, body in messages:
+        if (current_seconds is None or date != current_date or seconds < current_seconds
+                or seconds // 3600 != current_seconds // 3600):
+            lines.append(_anchor_line(date, seconds))
+            current_date, current_seconds = date, seconds
+        delta = seconds - current_seconds
+        current_seconds = seconds
+        if shorten_media:
+            body = _MEDIA_RE.sub(shorten, body)
+        alias = aliases[sender] if sender != current_sender else ''
+        current_sender = sender
+        lines.append(f"{alias}{f'+{delta}' if delta else ''}:{_escape(body)}")
+
+    senders = {alias: sender for sender, alias in aliases.items()}
+    compacted = CompactedChatLog(_build_legend(sorted(senders.items(), key=lambda item: (len(item[0]), item[0]))),
+                                 "".join(line + "\n" for line in lines), media, senders, text, tails)
+    if compacted.expand() != text:
+        logger.warning("聊天记录压缩后无法完整还原，跳过压缩")
+        return None
+    return compacted
+
+
+def expand_chat_log(text, media=(), tails=None):
+    """
+    把紧凑格式（含成员表）还原为chatlog聊天记录
+
+    参数:
+        text (str): 紧凑格式文本
+        media (list): 压缩时保存的原始媒体占位符
+        tails (dict): 压缩时保存的不规范消息块的原始结尾（消息序号 -> 消息头之后的原始文本）
+
+    返回:
+        str: 原始聊天记录
+    """
+    legend, _, body = text.partition(MESSAGES_MARK + "\n")
+    senders = {}
+    in_members = False
+    for line in legend.split('\n'):
+        if line == MEMBERS_MARK:
+            in_members = True
+        elif in_members and '=' in line:
+            alias, sender = line.split('=', 1)
+            senders[alias] = sender
+
+    media_iter = iter(media)
+
+    def restore(match):
+        return next(media_iter, match.group(0))
+
+    blocks = []
+    date, seconds, sender = None, 0, None
+    for line in body.split('\n'):
+        if not line:
+            continue
+        anchor = _ANCHOR_RE.match(line)
+        if anchor:
+            date, seconds = anchor.group('date'), _to_seconds(anchor.group('time'))
+            continue
+        match = _LINE_RE.match(line)
+        if not match:
+            raise ValueError(f"无法解析的紧凑格式行: {line[:50]}")
+        if match.group('alias'):
+            sender = senders[match.group('alias')]
+        seconds += int(match.group('delta') or 0)
+        content = _unescape(match.group('body'))
+        if media:
+            content = _SHORT_MEDIA_RE.sub(restore, content)
+        header = f"{sender} {date} {_to_time(seconds)}" if date else f"{sender} {_to_time(seconds)}"
+        if tails and len(blocks) in tails:
+            blocks.append(header + tails[len(blocks)])
+        else:
+            blocks.append(f"{header}\n{content}\n\n")
+    return "".join(blocks)
+
+
+def format_compaction(compacted, token_estimator):
+    """格式化压缩前后的字符数和估算Token数对比，用于日志"""
+    original_tokens = token_estimator.estimate(compacted.original_text)
+    compacted_tokens = token_estimator.estimate(compacted.text)
+    ratio = (original_tokens - compacted_tokens) / original_tokens * 100 if original_tokens else 0.0
+    return (f"{len(compacted.original_text)}→{len(compacted.text)}字符, "
+            f"约{original_tokens}→{compacted_tokens} tokens（节省 {ratio:.1f}%）")
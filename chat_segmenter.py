@@ -0,0 +1,87 @@
+'''
+聊天记录分片引擎
+
+功能描述:
+对聊天记录的每一行只估算一次Token数，结果存入紧凑的前缀和数组，
+之后任意行区间的Token数都可以 O(1) 求出，片段边界通过对前缀和数组二分（bisect）得到。
+调用方只需一次贪心扫描即可完成切分，不再需要反复拼接字符串、重复计数。
+贪心地让每个片段尽可能长，对于"连续切分、代价单调"的问题，得到的片段数是最少的。
+
+使用方法:
+1. index = LineTokenIndex(lines, estimator)
+2. end = index.max_end(start, budget)  # 从start行开始，不超过budget的最远结束行（不含）
+'''
+
+import logging
+import time
+from array import array
+from bisect import bisect_right
+
+from token_estimator import count_script_chars
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class LineTokenIndex:
+    """
+    逐行Token数的前缀和索引
+
+    prefix[i] 为前 i 行的估算Token数之和（浮点数，避免逐行取整带来的累积误差）。
+    """
+
+    def __init__(self, lines, estimator):
+        """
+        初始化索引，对每一行估算一次Token数
+
+        参数:
+            lines (list): 按行切分的聊天记录（保留换行符）
+            estimator (TokenEstimator): 本地Token估算器
+        """
+        self.lines = lines
+        self.prefix = array('d', [0.0])
+        self.stats = {
+            'lines': len(lines),
+            'chars': 0,
+            'count_seconds': 0.0,
+        }
+
+        start_time = time.time()
+        ratios = estimator.ratios
+        running_total = 0.0
+        chars = 0
+        for line in lines:
+            counts = count_script_chars(line)
+            running_total += (counts['cjk'] * ratios['cjk'] + counts['ascii'] * ratios['ascii']
+                              + counts['emoji'] * ratios['emoji'] + counts['other'] * ratios['other'])
+            self.prefix.append(running_total)
+            chars += len(line)
+        self.stats['chars'] = chars
+        self.stats['count_seconds'] = time.time() - start_time
+
+    def __len__(self):
+        return len(self.lines)
+
+    @property
+    def total_tokens(self):
+        """全部行的估算Token数之和"""
+        return self.prefix[-1]
+
+    def tokens(self, start, end):
+        """行区间 [start, end) 的估算Token数"""
+        return self.prefix[end] - self.prefix[start]
+
+    def max_end(self, start, budget):
+        """
+        求从 start 行开始、估算Token数不超过 budget 的最远结束行
+
+        返回:
+            int: 结束行索引（不含），若连 start 这一行都超出预算则返回 start
+        """
+        end = bisect_right(self.prefix, self.prefix[start] + budget, lo=start) - 1
+        return max(start, min(end, len(self.lines)))
+
+    def text(self, start, end):
+        """拼接行区间 [start, end) 的文本"""
+        return "".join(self.lines[start:end])
+
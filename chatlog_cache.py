@@ -0,0 +1,218 @@
+'''
+聊天记录按天增量缓存
+
+功能描述:
+按 群聊/联系人 + 日期 在本地缓存从 chatlog 服务器获取的原始聊天记录（未打码）：
+- 日期结束超过宽限时间（默认6小时，等待微信数据库同步）后获取到的非空记录视为"已关闭"，之后直接读取缓存；
+- 未关闭的日期（当天、刚结束不久或记录为空）记录最后一条消息的时间，下次只从该时间点开始增量获取并合并；
+- 超过保留天数（默认30天）的日期在写入缓存时删除。
+这样 days=1 的每日任务不必重复下载昨天的记录，多天范围也只需下载缓存中没有的日期。
+注意: 缓存目录中是未打码的原始聊天记录，请勿共享或上传该目录；demo.py --refresh-chatlog-cache 可忽略缓存重新获取。
+
+缓存目录结构:
+    <cache_dir>/<群名称摘要>/meta.json      # 群名称、各日期的关闭状态和最后消息时间
+    <cache_dir>/<群名称摘要>/<YYYY-MM-DD>.txt
+'''
+
+import hashlib
+import json
+import logging
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+from threading import Lock
+
+from chatlog_format import last_message_time, parse_header, split_messages
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temp', 'chatlog_cache')
+DEFAULT_CLOSE_GRACE_HOURS = 6
+DEFAULT_RETENTION_DAYS = 30
+
+
+def _write_meta(meta_file, meta):
+    tmp_file = meta_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, meta_file)
+
+
+class ChatLogCache:
+    """
+    聊天记录按天缓存
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, close_grace_hours=DEFAULT_CLOSE_GRACE_HOURS,
+                 retention_days=DEFAULT_RETENTION_DAYS):
+        """
+        初始化缓存
+
+        参数:
+            cache_dir (str): 缓存根目录
+            close_grace_hours (float): 日期结束多少小时后获取的记录才视为完整（已关闭）
+            retention_days (int): 缓存保留的天数（按聊天记录的日期计算），None或0表示不删除
+        """
+        self.cache_dir = cache_dir
+        self.close_grace_hours = close_grace_hours
+        self.retention_days = retention_days
+        self._lock = Lock()
+        self._pruned = False
+
+    def _talker_dir(self, talker_name):
+        digest = hashlib.sha1(talker_name.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_dir, digest)
+
+    def _load_meta(self, talker_name):
+        meta_file = os.path.join(self._talker_dir(talker_name), 'meta.json')
+        if os.path.exists(meta_file):
+            try:
+                with open(meta_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                logger.warning(f"读取聊天记录缓存元数据失败，将忽略缓存: {str(e)}")
+        return {'talker': talker_name, 'days': {}}
+
+    def _save_meta(self, talker_name, meta):
+        _write_meta(os.path.join(self._talker_dir(talker_name), 'meta.json'), meta)
+
+    def get_day(self, talker_name, day):
+        """
+        读取某一天的缓存
+
+        参数:
+            talker_name (str): 群聊/联系人名称
+            day (str): 日期 YYYY-MM-DD
+
+        返回:
+            tuple: (聊天记录文本, 该天的元数据)；没有缓存时返回 (None, None)
+        """
+        with self._lock:
+            day_meta = self._load_meta(talker_name)['days'].get(day)
+            day_file = os.path.join(self._talker_dir(talker_name), f"{day}.txt")
+            if day_meta is None or not os.path.exists(day_file):
+                return None, None
+            with open(day_file, 'r', encoding='utf-8', newline='') as f:
+                return f.read(), day_meta
+
+    def is_closed(self, day, text, fetched_at=None):
+        """
+        获取到的记录是否可以视为该天的完整记录（之后不再请求服务器）
+
+        日期结束后需再经过宽限时间，等待微信数据库同步；空记录可能是服务器尚未同步或返回异常，不视为完整
+        """
+        if not text:
+            return False
+        day_end = datetime.strptime(day, "%Y-%m-%d") + timedelta(days=1)
+        return (fetched_at or datetime.now()) >= day_end + timedelta(hours=self.close_grace_hours)
+
+    def put_day(self, talker_name, day, text):
+        """
+        写入某一天的聊天记录（是否关闭由 is_closed 判断），并删除超过保留天数的缓存
+
+        参数:
+            talker_name (str): 群聊/联系人名称
+            day (str): 日期 YYYY-MM-DD
+            text (str): 当天完整的原始聊天记录
+
+        返回:
+            bool: 该天是否已关闭
+        """
+        now = datetime.now()
+        closed = self.is_closed(day, text, now)
+        with self._lock:
+            talker_dir = self._talker_dir(talker_name)
+            os.makedirs(talker_dir, exist_ok=True)
+            day_file = os.path.join(talker_dir, f"{day}.txt")
+            tmp_file = day_file + '.tmp'
+            with open(tmp_file, 'w', encoding='utf-8', newline='') as f:
+                f.write(text)
+            os.replace(tmp_file, day_file)
+
+            meta = self._load_meta(talker_name)
+            meta['days'][day] = {
+                'closed': closed,
+                'last_seen': last_message_time(text),
+                'chars': len(text),
+                'fetched_at': now.strftime('%Y-%m-%d %H:%M:%S'),
+            }
+            self._save_meta(talker_name, meta)
+            if not self._pruned:
+                self._pruned = True
+                self._prune(now)
+        return closed
+
+    def _prune(self, now):
+        """删除所有群聊中早于保留天数的日期（调用方需持有锁）"""
+        if not self.retention_days:
+            return
+        cutoff = (now - timedelta(days=self.retention_days)).strftime("%Y-%m-%d")
+        removed = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_dir():
+                continue
+            meta_file = os.path.join(entry.path, 'meta.json')
+            try:
+                with open(meta_file, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+            except Exception:
+                continue
+            expired = [day for day in meta.get('days', {}) if day < cutoff]
+            if not expired:
+                continue
+            for day in expired:
+                try:
+                    os.remove(os.path.join(entry.path, f"{day}.txt"))
+                except FileNotFoundError:
+                    pass
+                del meta['days'][day]
+            _write_meta(meta_file, meta)
+            removed += len(expired)
+        if removed:
+            logger.info(f"已删除 {removed} 天超过保留期（{self.retention_days} 天）的聊天记录缓存")
+
+
+def merge_delta(cached_text, delta_text, last_seen):
+    """
+    将增量获取的聊天记录合并到缓存中
+
+    增量请求从最后一条消息的时间（含）开始：
+    - 增量中出现早于 last_seen 的消息，说明服务端没有按查询中的时刻过滤（返回了整天），
+      此时抛出 ValueError，调用方应改为重新获取整天，避免把已缓存的消息重复追加；
+    - 与 last_seen 同一秒的消息可能已在缓存中，逐条与缓存中同一秒的消息比对（按出现次数）去重。
+
+    参数:
+        cached_text (str): 缓存中的聊天记录
+        delta_text (str): 增量获取的聊天记录
+        last_seen (str): 缓存中最后一条消息的时间 HH:MM:SS
+
+    返回:
+        str: 合并后的聊天记录
+    """
+    if not delta_text:
+        return cached_text
+    seen_blocks = Counter()
+    for block in reversed(split_messages(cached_text)):
+        match = parse_header(block)
+        if not match or match.group('time') != last_seen:
+            break
+        seen_blocks[block.rstrip()] += 1
+
+    new_blocks = []
+    for block in split_messages(delta_text):
+        match = parse_header(block)
+        if match:
+            message_time = match.group('time')
+            if message_time < last_seen:
+                raise ValueError(f"增量结果包含早于 {last_seen} 的消息（{message_time}），服务端可能未按时刻过滤")
+            key = block.rstrip()
+            if message_time == last_seen and seen_blocks[key] > 0:
+                seen_blocks[key] -= 1
+                continue
+        new_blocks.append(block)
+    merged_delta = "".join(new_blocks)
+    if merged_delta and cached_text and not cached_text.endswith('\n\n'):
+        # 保证消息之间有空行分隔
+        cached_text += '\n' if cached_text.endswith('\n') else '\n\n'
+    return cached_text + merged_delta
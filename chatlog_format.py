@@ -0,0 +1,89 @@
+'''
+chatlog 文本格式解析工具
+
+功能描述:
+chatlog 服务器以纯文本返回聊天记录，每条消息的格式为：
+    昵称(wxid) 时间
+    消息内容（可能多行）
+    <空行>
+其中时间格式取决于查询范围：同一天为 "15:04:05"，同一年为 "01-02 15:04:05"，跨年为 "2006-01-02 15:04:05"。
+本模块负责把文本拆分为消息块、解析消息头，以及在拼接多天记录时补全消息头中的日期。
+'''
+
+import re
+
+# 消息头：发送者 + 空格 + [日期 + 空格] + 时间
+HEADER_RE = re.compile(r'^(?P<sender>.+?) (?:(?P<date>(?:\d{4}-)?\d{2}-\d{2}) )?(?P<time>\d{2}:\d{2}:\d{2})$')
+
+
+def split_messages(text):
+    """
+    将聊天记录文本拆分为消息块
+
+    只有紧跟在空行之后（或位于开头）且符合消息头格式的行才被视为新消息的开始，
+    避免把消息正文中恰好以时间结尾的行误判为消息头。
+
+    参数:
+        text (str): chatlog 返回的聊天记录文本
+
+    返回:
+        list: 消息块列表，每个消息块保留原始文本（含结尾换行和空行），拼接后与原文完全一致
+    """
+    if not text:
+        return []
+    lines = text.splitlines(keepends=True)
+    blocks = []
+    current = []
+    previous_blank = True
+    for line in lines:
+        if previous_blank and current and HEADER_RE.match(line.rstrip('\r\n')):
+            blocks.append("".join(current))
+            current = []
+        current.append(line)
+        previous_blank = not line.strip()
+    if current:
+        blocks.append("".join(current))
+    return blocks
+
+
+def parse_header(block):
+    """
+    解析消息块的消息头
+
+    返回:
+        re.Match: 匹配结果（含 sender、date、time 分组），不是消息头时返回None
+    """
+    first_line = block.split('\n', 1)[0].rstrip('\r')
+    return HEADER_RE.match(first_line)
+
+
+def last_message_time(text):
+    """返回聊天记录中最后一条消息的时间（HH:MM:SS），没有消息时返回None"""
+    for block in reversed(split_messages(text)):
+        match = parse_header(block)
+        if match:
+            return match.group('time')
+    return None
+
+
+def add_date_to_headers(text, date_label):
+    """
+    为只有时间的消息头补全日期
+
+    单天查询返回的消息头只有 "15:04:05"，把多天的记录拼接在一起时，
+    需要补成与多天查询相同的 "01-02 15:04:05" 格式，否则无法区分日期。
+
+    参数:
+        text (str): 单天的聊天记录
+        date_label (str): 要补上的日期，如 "04-27"
+
+    返回:
+        str: 补全日期后的聊天记录
+    """
+    blocks = split_messages(text)
+    for i, block in enumerate(blocks):
+        match = parse_header(block)
+        if match and not match.group('date'):
+            first_line, sep, rest = block.partition('\n')
+            blocks[i] = f"{match.group('sender')} {date_label} {match.group('time')}" + first_line[match.end():] + sep + rest
+    return "".join(blocks)
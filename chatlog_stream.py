@@ -0,0 +1,71 @@
+'''
+聊天记录流式下载工具
+
+功能描述:
+以流式方式读取 chatlog 服务器的响应：按块读取、显式使用UTF-8增量解码（不触发requests的字符集探测），
+内容先写入 SpooledTemporaryFile，超过阈值后自动落盘到临时文件，下载完成后按行边界分块产出，
+供打码等后续环节边读取边处理，避免同时在内存中保留整个响应的字节、字符串及其副本。
+
+使用方法:
+response = session.get(url, stream=True)
+for text_batch in iter_response_batches(response):
+    ...
+'''
+
+import codecs
+import logging
+import tempfile
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 64 * 1024  # 每次读取的字节数
+DEFAULT_SPOOL_MAX_SIZE = 8 * 1024 * 1024  # 内存中缓存的大小（字节）超过该值后落盘到临时文件
+DEFAULT_BATCH_CHARS = 1024 * 1024  # 按行边界分块处理时每块的字符数
+
+
+def iter_response_batches(response, chunk_size=DEFAULT_CHUNK_SIZE, spool_max_size=DEFAULT_SPOOL_MAX_SIZE,
+                          batch_chars=DEFAULT_BATCH_CHARS):
+    """
+    流式读取响应，按行边界分块产出文本
+
+    参数:
+        response (requests.Response): 以 stream=True 发起请求得到的响应
+        chunk_size (int): 每次读取的字节数
+        spool_max_size (int): 内存中最多缓存的大小（字节，UTF-8编码后），超过后落盘
+        batch_chars (int): 每个文本块的大致字符数
+
+    返回:
+        generator: 以完整行结尾的文本块（最后一块可能没有结尾换行）
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    received_bytes = 0
+    with tempfile.SpooledTemporaryFile(max_size=spool_max_size, mode='w+', encoding='utf-8', newline='') as spool:
+        try:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    received_bytes += len(chunk)
+                    spool.write(decoder.decode(chunk))
+            spool.write(decoder.decode(b'', final=True))
+        finally:
+            # 下载完成后立即归还连接，后续处理不再占用连接
+            response.close()
+
+        logger.debug(f"聊天记录下载完成: {received_bytes} 字节, "
+                     f"{'已落盘到临时文件' if received_bytes > spool_max_size else '保存在内存中'}")
+        spool.seek(0)
+        pending = ''
+        while True:
+            text = spool.read(batch_chars)
+            if not text:
+                break
+            text = pending + text
+            cut = text.rfind('\n') + 1
+            if cut == 0:
+                pending = text
+                continue
+            pending = text[cut:]
+            yield text[:cut]
+        if pending:
+            yield pending
+
@@ -0,0 +1,296 @@
+'''
+Gemini 显式上下文缓存
+
+功能描述:
+每个群聊的每个片段都要重复发送同一份很长的日报模板。开启上下文缓存后，"开场说明 + 模板"这一固定前缀
+只在第一次使用时上传一次，创建为 Gemini 的缓存内容（CachedContent，有效期覆盖整次运行），
+之后所有使用同一模板的群聊/片段只发送群聊名称和聊天记录，并引用该缓存：
+- 缓存部分按较低的缓存单价计费，不再重复上传，请求体明显变小；
+- 限流器只为未缓存的部分预留TPM额度，给聊天记录留出更多余量。
+缓存以 (模型名称, 固定前缀的SHA256) 为键，不同群聊共用同一模板时共用同一个缓存。
+固定前缀少于服务端要求的最小Token数、创建缓存失败或缓存已失效时，自动回退为发送完整Prompt。
+运行结束时删除本次创建的缓存，避免继续产生存储费用。
+
+后端:
+- 'gemini': 调用 google.generativeai 的缓存接口；
+- 'local': 本地替身，在内存中保存前缀，请求时把前缀拼回Prompt再调用原模型，便于离线测试缓存和回退逻辑。
+
+使用方法:
+1. manager = get_context_cache_manager()
+2. cached_model = manager.get_model(model, prefix_text, prefix_tokens)
+   返回None时回退为完整Prompt；否则 cached_model.generate_content(后缀部分, ...)
+3. manager.invalidate(model, prefix_text) 缓存失效（如请求报 NotFound）时丢弃
+4. shutdown_context_cache() 删除本次创建的缓存并输出统计
+'''
+
+import logging
+import time
+from datetime import timedelta
+from threading import Lock
+
+from disk_cache import sha256_hexdigest
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SEC = 3600
+DEFAULT_MIN_TOKENS = 1024  # Gemini 2.5 Flash 的最小缓存Token数，其他模型可能更高（如 4096）
+EXPIRE_MARGIN_SEC = 60  # 距离过期不足该秒数的缓存视为已失效，重新创建
+
+
+class GeminiContextCacheBackend:
+    """
+    调用 google.generativeai 缓存接口的后端
+    """
+
+    name = 'gemini'
+
+    def create(self, model_name, prefix_text, ttl_sec, display_name=None):
+        """
+        上传固定前缀，创建缓存内容
+
+        返回:
+            CachedContent: 缓存内容
+        """
+        from google.generativeai import caching
+
+        return caching.CachedContent.create(
+            model=model_name,
+            display_name=display_name,
+            contents=[prefix_text],
+            ttl=timedelta(seconds=ttl_sec),
+        )
+
+    def model_for(self, handle):
+        """引用缓存内容的模型"""
+        import google.generativeai as genai
+
+        return genai.GenerativeModel.from_cached_content(cached_content=handle)
+
+    def delete(self, handle):
+        """删除缓存内容"""
+        handle.delete()
+
+
+class LocalCachedContent:
+    """本地替身的缓存内容"""
+
+    def __init__(self, name, model, prefix_text, expire_at):
+        self.name = name
+        self.model = model
+        self.prefix_text = prefix_text
+        self.expire_at = expire_at
+        self.deleted = False
+
+
+class LocalCachedModel:
+    """
+    本地替身的缓存模型：请求时把缓存的前缀拼回Prompt，再调用原模型
+    """
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.model_name = getattr(handle.model, 'model_name', 'default')
+        self.requests = 0
+
+    def generate_content(self, contents, **kwargs):
+        if self.handle.deleted or time.time() >= self.handle.expire_at:
+            raise LookupError(f"404 CachedContent not found (local): {self.handle.name}")
+        self.requests += 1
+        return self.handle.model.generate_content(self.handle.prefix_text + contents, **kwargs)
+
+
+class LocalContextCacheBackend:
+    """
+    离线替身后端：不访问网络，在内存中保存前缀，请求时调用 get_model 传入的原模型
+    """
+
+    name = 'local'
+
+    def __init__(self):
+        self.created = []
+        self._base_models = {}
+
+    def bind(self, model):
+        """记录模型名称对应的原模型，create 时据此拼回前缀"""
+        self._base_models[getattr(model, 'model_name', 'default')] = model
+
+    def create(self, model_name, prefix_text, ttl_sec, display_name=None):
+        model = self._base_models[model_name]
+        handle = LocalCachedContent(f"cachedContents/local-{len(self.created) + 1}", model, prefix_text,
+                                    time.time() + ttl_sec)
+        self.created.append(handle)
+        return handle
+
+    def model_for(self, handle):
+        return LocalCachedModel(handle)
+
+    def delete(self, handle):
+        handle.deleted = True
+
+
+class ContextCacheManager:
+    """
+    按 (模型名称, 固定前缀) 创建和复用上下文缓存，线程安全
+    """
+
+    def __init__(self, backend, ttl_sec=DEFAULT_TTL_SEC, min_tokens=DEFAULT_MIN_TOKENS):
+        """
+        初始化缓存管理器
+
+        参数:
+            backend: GeminiContextCacheBackend 或 LocalContextCacheBackend
+            ttl_sec (int): 缓存有效期（秒），应覆盖整次运行
+            min_tokens (int): 固定前缀少于该Token数时不创建缓存
+        """
+        self.backend = backend
+        self.ttl_sec = ttl_sec
+        self.min_tokens = min_tokens
+        self._entries = {}  # 键 -> (缓存内容, 引用缓存的模型, 过期时间, 前缀Token数)
+        self._unavailable = set()  # 创建失败或前缀太短的键，本次运行不再尝试
+        self._lock = Lock()
+        self._key_locks = {}
+        self._stats = {'created': 0, 'hits': 0, 'fallbacks': 0, 'cached_tokens': 0}
+
+    @staticmethod
+    def _key(model, prefix_text):
+        return sha256_hexdigest(getattr(model, 'model_name', 'default'), prefix_text)
+
+    def _count_fallback(self):
+        with self._lock:
+            self._stats['fallbacks'] += 1
+
+    def get_model(self, model, prefix_text, prefix_tokens):
+        """
+        获取引用固定前缀缓存的模型，没有可用缓存时创建
+
+        参数:
+            model: 原模型
+            prefix_text (str): 固定前缀（开场说明 + 模板）
+            prefix_tokens (int): 固定前缀的Token数
+
+        返回:
+            模型或None: None表示不使用缓存，调用方应发送完整Prompt
+        """
+        key = self._key(model, prefix_text)
+        with self._lock:
+            if key in self._unavailable:
+                self._stats['fallbacks'] += 1
+                return None
+            key_lock = self._key_locks.setdefault(key, Lock())
+
+        # 同一前缀只由一个线程创建，其他线程等待后直接复用
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[2] - EXPIRE_MARGIN_SEC > time.time():
+                    self._stats['hits'] += 1
+                    self._stats['cached_tokens'] += entry[3]
+                    return entry[1]
+
+            if prefix_tokens < self.min_tokens:
+                logger.info(f"固定前缀只有 {prefix_tokens} tokens，少于上下文缓存的最小要求 {self.min_tokens}，使用完整Prompt")
+                with self._lock:
+                    self._unavailable.add(key)
+                self._count_fallback()
+                return None
+
+            model_name = getattr(model, 'model_name', 'default')
+            if hasattr(self.backend, 'bind'):
+                self.backend.bind(model)
+            try:
+                start = time.time()
+                handle = self.backend.create(model_name, prefix_text, self.ttl_sec,
+                                             display_name=f"chat-summary-{key[:12]}")
+                cached_model = self.backend.model_for(handle)
+            except Exception as e:
+                logger.warning(f"创建上下文缓存失败，本次运行将使用完整Prompt: {str(e)}")
+                with self._lock:
+                    self._unavailable.add(key)
+                self._count_fallback()
+                return None
+
+            logger.info(f"已创建上下文缓存 {getattr(handle, 'name', '')}: 固定前缀 {prefix_tokens} tokens, "
+                        f"有效期 {self.ttl_sec} 秒, 耗时 {time.time() - start:.2f} 秒")
+            with self._lock:
+                self._entries[key] = (handle, cached_model, time.time() + self.ttl_sec, prefix_tokens)
+                self._stats['created'] += 1
+                self._stats['hits'] += 1
+                self._stats['cached_tokens'] += prefix_tokens
+            return cached_model
+
+    def invalidate(self, model, prefix_text):
+        """丢弃失效的缓存（如请求报 NotFound），下次使用时重新创建"""
+        with self._lock:
+            entry = self._entries.pop(self._key(model, prefix_text), None)
+        if entry is not None:
+            logger.warning(f"上下文缓存已失效，将重新创建: {getattr(entry[0], 'name', '')}")
+
+    def stats(self):
+        """
+        上下文缓存统计
+
+        返回:
+            dict: created、hits、fallbacks、cached_tokens
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def log_stats(self):
+        """在日志中输出上下文缓存统计"""
+        stats = self.stats()
+        if not stats['hits'] and not stats['fallbacks']:
+            return
+        logger.info(f"上下文缓存统计: 创建 {stats['created']} 个, 引用缓存的请求 {stats['hits']} 次"
+                    f"（共约 {stats['cached_tokens']} tokens 未重复上传）, 回退为完整Prompt {stats['fallbacks']} 次")
+
+    def close(self):
+        """删除本次创建的所有缓存"""
+        with self._lock:
+            entries, self._entries = list(self._entries.values()), {}
+        for handle, _, _, _ in entries:
+            try:
+                self.backend.delete(handle)
+            except Exception as e:
+                logger.warning(f"删除上下文缓存失败（到期后会自动删除）: {str(e)}")
+
+
+_manager = None
+_manager_lock = Lock()
+
+
+def get_context_cache_manager():
+    """
+    获取进程内共享的上下文缓存管理器，开关、后端、有效期和最小Token数从cfg.py读取
+
+    返回:
+        ContextCacheManager或None: 未开启上下文缓存时返回None
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            try:
+                from cfg import CHAT_DEMO_CFG
+            except ImportError:
+                CHAT_DEMO_CFG = {}
+            if not CHAT_DEMO_CFG.get('gemini_context_cache_enabled', False):
+                return None
+            backend_name = CHAT_DEMO_CFG.get('gemini_context_cache_backend', 'gemini')
+            backend = LocalContextCacheBackend() if backend_name == 'local' else GeminiContextCacheBackend()
+            _manager = ContextCacheManager(
+                backend,
+                ttl_sec=CHAT_DEMO_CFG.get('gemini_context_cache_ttl_sec', DEFAULT_TTL_SEC),
+                min_tokens=CHAT_DEMO_CFG.get('gemini_context_cache_min_tokens', DEFAULT_MIN_TOKENS),
+            )
+            logger.info(f"上下文缓存已开启: 后端 {backend.name}, 有效期 {_manager.ttl_sec} 秒")
+        return _manager
+
+
+def shutdown_context_cache():
+    """输出统计并删除本次运行创建的上下文缓存"""
+    global _manager
+    with _manager_lock:
+        manager, _manager = _manager, None
+    if manager is not None:
+        manager.log_stats()
+        manager.close()
@@ -24,66 +24,96 @@ pip install google-generativeai tqdm requests selenium webdriver-manager
 版本: 1.2
 """
 
-import requests
+# google.generativeai、requests、tkinter、tqdm、webbrowser、selenium 等较重的依赖在用到的阶段才导入，
+# --help、只获取聊天记录的运行和定时任务的子进程不必为用不到的模块付出启动时间
 import subprocess
 import time
 import argparse
 import logging
 import sys
-import webbrowser
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-import google.generativeai as genai
-import tqdm  # 添加tqdm库用于显示进度条
-import tkinter as tk
-from tkinter import messagebox  # 弹窗，用于提示
+from urllib.parse import quote
 import json
 import os.path
 
-# 添加HTML转PNG所需的依赖
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
+# 添加HTML转PNG所需的依赖（复用常驻的无头浏览器池）
+from browser_pool import DEFAULT_WINDOW_SIZE, get_browser_pool, shutdown_browser_pool
+from llm_cache import get_llm_response_cache, llm_cache_key
+from context_cache import get_context_cache_manager, shutdown_context_cache
+from run_manifest import RunManifest, stage_reached
+from prompt_compiler import compile_prompt_template, format_savings
+from page_capture import capture_full_page, get_render_cache, render_cache_key, wait_for_page_ready
 
 # 配置日志
 from cfg import CHAT_DEMO_CFG
+from token_estimator import get_token_estimator
+from chat_segmenter import LineTokenIndex
+from token_cache import get_token_count_cache
+from chatlog_cache import ChatLogCache, merge_delta
+from chatlog_format import add_date_to_headers
+from chat_compactor import compact_chat_log, format_compaction
+from chatlog_stream import iter_response_batches
+from stream_accumulator import (HtmlExtractionError, HtmlStreamExtractor, HtmlStreamWriter, StreamAccumulator,
+                                ThrottledProgress, stitch_continuation)
+from masking import MaskingStats, format_hits, get_data_masker
+from rate_limiter import is_rate_limit_error
+from model_router import build_model_router
+from model_catalog import DEFAULT_CATALOG_PATH, DEFAULT_TTL_SEC as DEFAULT_CATALOG_TTL_SEC, ModelCatalog
+from retry_policy import (ERROR_PERMANENT, ERROR_RATE_LIMIT, ERROR_TRANSIENT, classify_error, get_retry_stats,
+                          new_retry_policy)
+from startup_timeline import StartupTimeline
 
 import os
 
 
-# 创建日志目录
-log_dir = CHAT_DEMO_CFG.get('log_dir', './logs')
-os.makedirs(log_dir, exist_ok=True)
+logger = logging.getLogger(__name__)
+log_filename = None  # 错误日志文件，setup_logging() 后才创建
 
-# 获取当前时间作为日志文件名
-log_filename = f"{log_dir}/error_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log.txt"
 
-# 配置日志
-logging.basicConfig(
-    level=getattr(logging, CHAT_DEMO_CFG.get('logging_level', 'INFO')),
-    format=CHAT_DEMO_CFG.get(
-        'logging_format', '%(asctime)s - %(levelname)s - %(message)s'),
-    datefmt=CHAT_DEMO_CFG.get('logging_date_format', '%Y-%m-%d %H:%M:%S')
-)
-logger = logging.getLogger(__name__)
+def setup_logging():
+    """配置日志：控制台输出，ERROR级别同时写入logs目录下按启动时间命名的文件（在main中调用，导入模块时不创建文件）"""
+    global log_filename
+    if log_filename is not None:
+        return log_filename
+
+    # 创建日志目录
+    log_dir = CHAT_DEMO_CFG.get('log_dir', './logs')
+    os.makedirs(log_dir, exist_ok=True)
+
+    # 获取当前时间作为日志文件名
+    log_filename = f"{log_dir}/error_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log.txt"
+
+    # 配置日志
+    logging.basicConfig(
+        level=getattr(logging, CHAT_DEMO_CFG.get('logging_level', 'INFO')),
+        format=CHAT_DEMO_CFG.get(
+            'logging_format', '%(asctime)s - %(levelname)s - %(message)s'),
+        datefmt=CHAT_DEMO_CFG.get('logging_date_format', '%Y-%m-%d %H:%M:%S')
+    )
+
+    # 添加文件处理器，只记录ERROR级别的日志
+    file_handler = logging.FileHandler(log_filename, encoding='utf-8')
+    file_handler.setLevel(logging.ERROR)
+    file_formatter = logging.Formatter(CHAT_DEMO_CFG.get(
+        'logging_format', '%(asctime)s - %(levelname)s - %(message)s'))
+    file_handler.setFormatter(file_formatter)
+    logger.addHandler(file_handler)
+    return log_filename
 
-# 添加文件处理器，只记录ERROR级别的日志
-file_handler = logging.FileHandler(log_filename, encoding='utf-8')
-file_handler.setLevel(logging.ERROR)
-file_formatter = logging.Formatter(CHAT_DEMO_CFG.get(
-    'logging_format', '%(asctime)s - %(levelname)s - %(message)s'))
-file_handler.setFormatter(file_formatter)
-logger.addHandler(file_handler)
 
 base_server_ip_port = CHAT_DEMO_CFG.get(
     'chatlog_server_ip_port', "127.0.0.1:5036")
 base_server_url = CHAT_DEMO_CFG.get(
     'chatlog_server_url', f"http://{base_server_ip_port}")
 
-TPM_errorFix = {
-    "token_ratio": 0.9,  # 减少token贴近【边界极值】的情况
-    "sec_ratio": 1.2,  # 增长等待时间
-}
+# 启动阶段名称（用于启动时间线）
+PHASE_OVERSEA_CONN = '检查海外网络'
+PHASE_CHATLOG = '启动数据服务'
+PHASE_GEMINI = '连接AI服务'
+PHASE_PROMPT = '加载日报模板'
+MARK_FIRST_REQUEST = '首次请求AI'
+
 
 def parse_arguments():
     """解析命令行参数"""
@@ -111,6 +141,14 @@ def parse_arguments():
                         help='发布URL是否需要密码')
     parser.add_argument('--auto-mode', action='store_true',
                         help='自动模式，不需要用户交互')
+    parser.add_argument('--resume', action='store_true',
+                        help='继续当天被中断的运行：根据输出目录中的运行清单，只执行未完成的阶段')
+    parser.add_argument('--no-llm-cache', action='store_true',
+                        help='不读取本地的模型响应缓存，强制重新调用模型生成（生成结果仍会写入缓存）')
+    parser.add_argument('--refresh-models', action='store_true',
+                        help='忽略本地缓存的模型目录，重新从Gemini获取可用模型及其Token上限')
+    parser.add_argument('--refresh-chatlog-cache', action='store_true',
+                        help='忽略按天缓存的聊天记录（包括已关闭的日期），重新从chatlog服务器获取并覆盖缓存')
 
     return parser.parse_args()
 
@@ -118,9 +156,27 @@ def parse_arguments():
 def load_config_from_json():
     return CHAT_DEMO_CFG
 
-def init_gemini_api(api_key):
-    """初始化Gemini API"""
+# 未配置 gemini_models 时使用的默认模型
+DEFAULT_GEMINI_MODEL = {
+    "name": 'models/gemini-2.5-flash-preview-04-17-thinking',
+    "tpm": 250000,
+    "rpm": 10,
+}
+
+
+def init_gemini_api(api_key, refresh_models=False):
+    """
+    初始化Gemini API，按 cfg.py 的 gemini_models 创建多模型路由
+
+    模型目录（名称、支持的方法、输入/输出Token上限）优先读取本地缓存，过期时后台刷新；
+    refresh_models 为True时忽略缓存，同步重新获取。
+
+    返回:
+        ModelRouter: 模型路由，router.primary 为配置中第一个可用的模型
+    """
     try:
+        import google.generativeai as genai
+
         genai.configure(api_key=api_key)
 
         # gemini-2.5-pro-preview-03-25 available for free (this an update of gemini-2.5-pro-exp-03-25) : r/LocalLLaMA    https://www.reddit.com/r/LocalLLaMA/comments/1jrwstn/gemini25propreview0325_available_for_free_this_an/
@@ -128,51 +184,46 @@ def init_gemini_api(api_key):
         # 'gemini-2.5-pro-preview-05-06',
         # 'gemini-2.5-pro-exp-03-25'  # 这个是免费的。
         # 'gemini-2.5-flash-preview-04-17',
-        model_name = 'models/gemini-2.5-flash-preview-04-17-thinking'  # 默认模型
-        selected_model_info = None
-
-        # 模型 TPM 配置 (Tokens Per Minute)
-        MODEL_CONFIG = {
-            'models/gemini-2.5-flash-preview-04-17-thinking': {
-                # "name": 'models/gemini-2.5-flash-preview-04-17-thinking',
-                "tpm": 250000,
-            },
-            # 'models/gemini-1.5-flash-latest': 250000, # 假设值，请根据实际情况调整
-            # 'models/gemini-1.5-pro-latest': 1000000, # 假设值
-            # 可以根据需要添加更多模型的TPM配置
-        }
-        tpm_limit = MODEL_CONFIG.get(model_name).get("tpm") * (TPM_errorFix["token_ratio"])  # 默认 TPM 或从配置读取
-
+        # 模型列表及各自的 TPM (Tokens Per Minute)、RPM (Requests Per Minute) 等限制，排在前面的优先
+        model_configs = CHAT_DEMO_CFG.get('gemini_models') or [DEFAULT_GEMINI_MODEL]
+
+        # 模型目录缓存在本地，不必每次运行都请求海外接口遍历模型列表
+        catalog = ModelCatalog(
+            genai.list_models,
+            cache_path=CHAT_DEMO_CFG.get('model_catalog_path', DEFAULT_CATALOG_PATH),
+            ttl_sec=CHAT_DEMO_CFG.get('model_catalog_ttl_sec', DEFAULT_CATALOG_TTL_SEC),
+            api_key=api_key,
+        )
+        available_models = catalog.generate_models(catalog.get(force_refresh=refresh_models))
+        if not refresh_models and not any(config['name'] in available_models for config in model_configs):
+            # 缓存中没有任何配置的模型（可能刚修改了配置），重新获取一次
+            logger.info("模型目录缓存中没有配置的模型，重新获取模型目录")
+            available_models = catalog.generate_models(catalog.fetch())
         # print("可用模型列表:")
-        for m in genai.list_models():
-            if 'generateContent' in m.supported_generation_methods:
-                print(f"  - {m.name}")
-                if m.name == model_name:  # 选择我们想要使用的模型
-                    selected_model_info = m
-
-        if not selected_model_info:
-            # 如果默认模型不可用，尝试选择第一个可用的
-            for m in genai.list_models():
-                if 'generateContent' in m.supported_generation_methods:
-                    model_name = m.name
-                    selected_model_info = m
-                    logger.warning(f"默认模型 {model_name} 未找到或不可用，已自动选择第一个可用模型: {model_name}")
-                    break
-            if not selected_model_info:
-                raise Exception("未找到任何可用的 Gemini 模型。")
-
-        model = genai.GenerativeModel(model_name)
-
-        input_token_limit = selected_model_info.input_token_limit
-        output_token_limit = selected_model_info.output_token_limit
-
-        logger.info(f"成功连接到Gemini API，使用模型: {model_name}")
-        logger.info(f"模型输入 Token 限制: {input_token_limit}")
-        logger.info(f"模型输出 Token 限制: {output_token_limit}")
-        logger.info(f"模型 TPM (Tokens Per Minute) 限制: {tpm_limit}")
-        # print(f"DEBUG: Selected model info: {selected_model_info}")
+        for name in available_models:
+            logger.debug(f"可用模型: {name}")
 
-        return model, model_name, input_token_limit, output_token_limit, tpm_limit
+        router = build_model_router(
+            model_configs, available_models, genai.GenerativeModel,
+            latency_target_sec=CHAT_DEMO_CFG.get('gemini_latency_target_sec'),
+            expected_output_tokens=CHAT_DEMO_CFG.get('gemini_expected_output_tokens', 16000),
+        )
+        if router is None:
+            # 如果配置的模型都不可用，尝试选择第一个可用的（沿用第一个配置的TPM/RPM）
+            if not available_models:
+                raise Exception("未找到任何可用的 Gemini 模型。")
+            fallback_name = next(iter(available_models))
+            logger.warning(f"配置的模型均未找到或不可用，已自动选择第一个可用模型: {fallback_name}")
+            router = build_model_router([{**model_configs[0], 'name': fallback_name}], available_models,
+                                        genai.GenerativeModel)
+
+        logger.info(f"成功连接到Gemini API，使用模型: {', '.join(route.name for route in router.routes)}")
+        for route in router.routes:
+            logger.info(f"模型 {route.name}: 输入 Token 限制 {route.input_token_limit}, 输出 Token 限制 {route.output_token_limit}, "
+                        f"TPM (Tokens Per Minute) 限制 {route.tpm_limit}, RPM (Requests Per Minute) 限制 {route.rpm_limit}, "
+                        f"相对速度 {route.speed}")
+
+        return router
     except Exception as e:
         logger.error(f"初始化Gemini API失败: {str(e)}")
         print("此为常见问题：根源在海外接口无法联通，请考虑全局proxy上网等选项。")
@@ -192,6 +243,8 @@ def alert_msg():
         return
         
     try:
+        import tkinter as tk
+
         print("正在创建提示对话框...")
 
         # 用于跟踪用户是否正常点击了确认按钮
@@ -270,6 +323,10 @@ def alert_msg():
 
 def run_chatlog_commands():
     """运行chatlog命令启动服务器"""
+    import requests
+    import tqdm
+    from http_session import get_probe_session
+
     try:
         # 从配置中获取chatlog可执行文件路径
         chatlog_exe = CHAT_DEMO_CFG.get(
@@ -344,9 +401,9 @@ def run_chatlog_commands():
 
         test_alive_api = base_server_url + "/api/v1/chatroom"
 
-        # 检查服务器是否已经在运行
+        # 检查服务器是否已经在运行（存活探测不重试：服务器未启动时连接被拒绝，应立即返回）
         try:
-            requests.get(test_alive_api, timeout=2)
+            get_probe_session().get(test_alive_api, timeout=2)
             logger.info("Chatlog服务器已经在运行")
             return None
         except requests.exceptions.RequestException as e:
@@ -372,7 +429,7 @@ def run_chatlog_commands():
             retry_interval = 1
             for i in range(max_retries):
                 try:
-                    response = requests.get(
+                    response = get_probe_session().get(
                         test_alive_api, timeout=2)
                     if response.status_code == 200 and response.text:
                         logger.info("服务器启动成功，已确认可以访问聊天室数据")
@@ -395,8 +452,109 @@ def run_chatlog_commands():
         raise
 
 
-def get_chat_logs(talker_name, days, start_date=None, end_date=None, ):
-    """获取指定群的聊天记录"""
+def fetch_chat_log_batches(talker_name, time_range):
+    """
+    从chatlog服务器流式获取指定时间范围的原始聊天记录（未打码）
+
+    响应按块读取并显式按UTF-8解码，超过阈值的内容落盘到临时文件，最后按行边界分块产出。
+
+    参数:
+        talker_name (str): 群聊/联系人名称
+        time_range (str): chatlog 的 time 参数，如 "2025-04-26~2025-04-27"
+
+    返回:
+        generator: 以完整行结尾的聊天记录文本块
+    """
+    # noinspection PyUnresolvedReferences
+    # URL编码群名称
+    encoded_talker_name = quote(talker_name)
+    encoded_time_range = quote(time_range, safe='~-:')
+
+    # 构建API URL
+    url = f"{base_server_url}/api/v1/chatlog?time={encoded_time_range}&talker={encoded_talker_name}"
+
+    # 发送GET请求（流式读取响应体）
+    from http_session import get_http_session
+
+    response = get_http_session().get(url, timeout=30, stream=True)
+
+    if response.status_code != 200:
+        error_msg = f"获取聊天记录失败: {response.status_code}, {response.text}"
+        logger.error(error_msg)
+        raise Exception(error_msg)
+    return iter_response_batches(response, spool_max_size=CHAT_DEMO_CFG.get('chatlog_spool_max_size', 8 * 1024 * 1024))
+
+
+def fetch_chat_log_text(talker_name, time_range):
+    """从chatlog服务器获取指定时间范围的原始聊天记录（未打码），返回完整文本"""
+    return "".join(fetch_chat_log_batches(talker_name, time_range))
+
+
+def get_day_chat_log(talker_name, day, chatlog_cache, refresh=False):
+    """
+    获取某一天的原始聊天记录，优先使用按天缓存
+
+    已关闭（日期结束超过宽限时间后获取的非空记录）的日期直接读取缓存；
+    缓存中未关闭的日期只从最后一条消息的时间开始增量获取；增量获取失败，或增量结果中有早于该时间的消息
+    （服务端未按时刻过滤）时，重新获取整天。refresh 为True时忽略缓存，重新获取整天。
+    """
+    cached_text, day_meta = (None, None) if refresh else chatlog_cache.get_day(talker_name, day)
+
+    if cached_text is not None and day_meta.get('closed'):
+        logger.info(f"使用缓存的聊天记录: 「{talker_name}」{day} ({len(cached_text)}字符)")
+        return cached_text
+
+    last_seen = day_meta.get('last_seen') if day_meta else None
+    if cached_text is not None and last_seen and CHAT_DEMO_CFG.get('chatlog_cache_incremental', True):
+        try:
+            delta_text = fetch_chat_log_text(talker_name, f"{day} {last_seen}~{day} 23:59:59")
+            chat_log = merge_delta(cached_text, delta_text, last_seen)
+            chatlog_cache.put_day(talker_name, day, chat_log)
+            logger.info(f"增量获取聊天记录: 「{talker_name}」{day} 从 {last_seen} 开始, "
+                        f"新增 {len(chat_log) - len(cached_text)}字符, 合计 {len(chat_log)}字符")
+            return chat_log
+        except Exception as e:
+            logger.warning(f"增量获取「{talker_name}」{day} 的聊天记录失败，改为重新获取整天: {str(e)}")
+
+    chat_log = fetch_chat_log_text(talker_name, f"{day}~{day}")
+    closed = chatlog_cache.put_day(talker_name, day, chat_log)
+    logger.info(f"获取并缓存聊天记录: 「{talker_name}」{day} ({len(chat_log)}字符, {'已关闭' if closed else '进行中'})")
+    return chat_log
+
+
+def iter_chat_logs_with_cache(talker_name, start_date, end_date, refresh=False):
+    """
+    按天从缓存和增量请求中获取 [start_date, end_date] 范围内的原始聊天记录（refresh 为True时忽略缓存重新获取）
+
+    返回:
+        generator: 每天一个文本块（逐天读取，同一时间只在内存中保留一天的原始记录）
+    """
+    chatlog_cache = ChatLogCache(
+        CHAT_DEMO_CFG.get('chatlog_cache_dir', './temp/chatlog_cache'),
+        close_grace_hours=CHAT_DEMO_CFG.get('chatlog_cache_close_grace_hours', 6),
+        retention_days=CHAT_DEMO_CFG.get('chatlog_cache_retention_days', 30),
+    )
+    today = datetime.now().strftime("%Y-%m-%d")
+    start_date_obj = datetime.strptime(start_date, "%Y-%m-%d")
+    end_date_obj = datetime.strptime(end_date, "%Y-%m-%d")
+
+    days = []
+    day_obj = start_date_obj
+    while day_obj <= end_date_obj and day_obj.strftime("%Y-%m-%d") <= today:
+        days.append(day_obj.strftime("%Y-%m-%d"))
+        day_obj += timedelta(days=1)
+
+    # 多天拼接时，与chatlog多天查询的格式保持一致：消息头补上日期（跨年时带上年份）
+    same_year = start_date_obj.year == end_date_obj.year
+    for day in days:
+        day_log = get_day_chat_log(talker_name, day, chatlog_cache, refresh)
+        if not day_log:
+            continue
+        yield day_log if len(days) <= 1 else add_date_to_headers(day_log, day[5:] if same_year else day)
+
+
+def get_chat_logs(talker_name, days, start_date=None, end_date=None, refresh_cache=False):
+    """获取指定群的聊天记录（refresh_cache 为True时忽略按天缓存）"""
     try:
         # 计算日期范围
         if end_date is None:
@@ -421,48 +579,51 @@ def get_chat_logs(talker_name, days, start_date=None, end_date=None, ):
 
         logger.info(f"获取群'{talker_name}'从{start_date}到{end_date}的聊天记录...")
 
-        # noinspection PyUnresolvedReferences
-        # URL编码群名称
-        encoded_talker_name = requests.utils.quote(talker_name)
-
-        # 构建API URL
-        url = f"{base_server_url}/api/v1/chatlog?time={start_date}~{end_date}&talker={encoded_talker_name}"
+        if CHAT_DEMO_CFG.get('chatlog_cache_enabled', True):
+            text_batches = iter_chat_logs_with_cache(talker_name, start_date, end_date, refresh_cache)
+        else:
+            text_batches = fetch_chat_log_batches(talker_name, f"{start_date}~{end_date}")
 
-        # 发送GET请求
-        response = requests.get(url, timeout=30)
+        # 边读取边打码，所有规则构建成一个打码器，单遍扫描完成替换（最左最长匹配）；
+        # 打码后的结果需要整体写入检查点、压缩和切分，在此拼接为一个字符串
+        data_masking_rules = CHAT_DEMO_CFG.get('data_masking_rules', {})
+        masking_stats = MaskingStats()
+        chat_logs = "".join(get_data_masker(data_masking_rules).mask_stream(text_batches, masking_stats))
 
-        if response.status_code == 200:
-            chat_logs = response.text
-            if not chat_logs:
-                logger.warning("获取到的聊天记录为空。可能是群不存在或在指定时间范围内没有消息。")
-            else:
-                logger.info(f"成功获取聊天记录: {len(chat_logs)}字符")
-
-                # 应用数据打码规则
-                data_masking_rules = CHAT_DEMO_CFG.get('data_masking_rules', {})
-                if data_masking_rules:
-                    logger.info(f"开始应用数据打码规则，共 {len(data_masking_rules)} 条规则...")
-                    for keyword, replacement in data_masking_rules.items():
-                        chat_logs = chat_logs.replace(keyword, replacement)
-                    logger.info(f"数据打码完成，处理后聊天记录长度: {len(chat_logs)}字符")
-                else:
-                    logger.info("未配置数据打码规则，跳过处理。")
-            return chat_logs
+        if not chat_logs:
+            logger.warning("获取到的聊天记录为空。可能是群不存在或在指定时间范围内没有消息。")
         else:
-            error_msg = f"获取聊天记录失败: {response.status_code}, {response.text}"
-            logger.error(error_msg)
-            raise Exception(error_msg)
+            logger.info(f"成功获取聊天记录: {masking_stats.chars_in}字符")
+            if data_masking_rules:
+                logger.info(f"已应用数据打码规则，共 {len(data_masking_rules)} 条规则，处理后聊天记录长度: {len(chat_logs)}字符")
+                logger.info(f"打码规则命中: {format_hits(masking_stats)}")
+            else:
+                logger.info("未配置数据打码规则，跳过处理。")
+        return chat_logs
     except Exception as e:
         logger.error(f"获取聊天记录时出错: {str(e)}")
         raise
 
 
 def read_prompt_template(template_path):
-    """读取Prompt模板文件"""
+    """读取Prompt模板文件
+
+    开启模板编译（prompt_compile_enabled）时，返回去掉多余空白和重复内容后的模板（注释默认保留），
+    编译结果缓存在模板目录的 .compiled/ 下，并在日志中输出节省的Token数。
+    """
     try:
         logger.info(f"从{template_path}读取prompt模板")
-        with open(template_path, 'r', encoding='utf-8') as file:
-            template = file.read()
+        if CHAT_DEMO_CFG.get('prompt_compile_enabled', True):
+            result = compile_prompt_template(
+                template_path,
+                strip_examples=CHAT_DEMO_CFG.get('prompt_compile_strip_examples', False),
+                strip_comments=CHAT_DEMO_CFG.get('prompt_compile_strip_comments', False),
+            )
+            template = result['text']
+            logger.info(f"prompt模板已编译{'（使用缓存）' if result['from_cache'] else ''}: {format_savings(result)}")
+        else:
+            with open(template_path, 'r', encoding='utf-8') as file:
+                template = file.read()
 
         if not template:
             raise ValueError("Prompt模板文件为空")
@@ -474,31 +635,67 @@ def read_prompt_template(template_path):
         raise
 
 
-def split_chat_logs_into_segments(model, base_prompt_fixed_parts_text, chat_logs_text, model_input_token_limit, tpm_limit):
+def count_tokens_cached(model, text, token_estimator=None):
+    """
+    计算文本的Token数：优先读取持久化的Token计数缓存，未命中时调用远程 count_tokens，
+    并用远程返回的真实结果写入缓存、校准本地估算器
+    """
+    model_name = getattr(model, 'model_name', 'default')
+    try:
+        token_cache = get_token_count_cache()
+        tokens = token_cache.get(model_name, text)
+    except Exception as e:
+        logger.warning(f"读取Token计数缓存失败: {str(e)}")
+        token_cache, tokens = None, None
+    if tokens is not None:
+        return tokens
+
+    tokens = model.count_tokens(text).total_tokens
+    if token_cache is not None:
+        try:
+            token_cache.put(model_name, text, tokens)
+        except Exception as e:
+            logger.warning(f"写入Token计数缓存失败: {str(e)}")
+    if token_estimator is not None:
+        token_estimator.observe(text, tokens)
+    return tokens
+
+
+def split_chat_logs_into_segments(model, base_prompt_fixed_parts_text, chat_logs_text, model_input_token_limit, tpm_limit, token_estimator=None):
     """
     将聊天记录分割成适合模型输入长度的片段。
 
+    每行Token数只在本地估算一次并存入前缀和数组，片段边界通过一次贪心扫描 + bisect 得到；
+    count_tokens 只用于校验基础Prompt和每个最终片段（优先读取持久化缓存），校验结果会反过来校准估算器。
+
     Args:
         model: Gemini 模型实例。
         base_prompt_fixed_parts_text: 基础prompt中除了聊天记录本身之外的固定文本内容。
         chat_logs_text: 完整的聊天记录文本。
         model_input_token_limit: 模型允许的总输入token数。
         tpm_limit: 模型 TPM (Tokens Per Minute) 限制。
+        token_estimator: 本地Token估算器，默认使用该模型共享的估算器。
 
     Returns:
         list: 聊天记录片段的列表。
     """
     SAFETY_MARGIN_TOKENS = CHAT_DEMO_CFG.get('safety_margin_tokens', 1000)  # 安全边际，防止精确达到上限
+    MAX_VERIFY_ATTEMPTS = 5  # 单个片段远程校验失败后，最多收缩重试的次数
+
+    if token_estimator is None:
+        token_estimator = get_token_estimator(getattr(model, 'model_name', 'default'))
+    count_calls = 0
 
     try:
         logger.info("正在计算基础Prompt的Token数...")  # 增加日志
         base_prompt_start_time = time.time()
-        base_prompt_tokens = model.count_tokens(base_prompt_fixed_parts_text).total_tokens
+        base_prompt_tokens = count_tokens_cached(model, base_prompt_fixed_parts_text, token_estimator)
+        count_calls += 1
         base_prompt_end_time = time.time()
         logger.info(f"基础Prompt部分的Token数: {base_prompt_tokens} (计算耗时: {base_prompt_end_time - base_prompt_start_time:.4f} 秒)")
     except Exception as e:
-        logger.error(f"计算基础Prompt Token数时出错: {e}. 使用默认值0.")
-        base_prompt_tokens = 0  # 容错处理
+        base_prompt_tokens = token_estimator.estimate(base_prompt_fixed_parts_text)
+        logger.error(f"计算基础Prompt Token数时出错: {e}. 使用本地估算值 {base_prompt_tokens}.")
 
     # 确定单个请求的最大允许Token数，考虑模型输入限制和TPM限制
     # 注意：这里的 token 限制是针对整个 prompt (基础 prompt + 聊天记录片段)
@@ -515,196 +712,272 @@ def split_chat_logs_into_segments(model, base_prompt_fixed_parts_text, chat_logs
         max_tokens_for_chat_log_segment = 100
         logger.warning(f"已将聊天记录片段允许的最大Token数强制设置为 {max_tokens_for_chat_log_segment} 以尝试继续。")
 
-    # ==== 优化：尝试将整个聊天记录作为单个片段处理 ====
-    try:
-        logger.info("正在尝试计算整个聊天记录的Token总数...")
-        overall_token_count_start_time = time.time()
-        if not chat_logs_text:  # 确保 chat_logs_text 不为空
-            logger.info("聊天记录为空，无需切分，返回空列表。")
-            return []
-
-        total_chat_log_tokens = model.count_tokens(chat_logs_text).total_tokens
-        overall_token_count_end_time = time.time()
-        logger.info(f"整个聊天记录的Token总数: {total_chat_log_tokens} (计算耗时: {overall_token_count_end_time - overall_token_count_start_time:.4f} 秒)")
-
-        if total_chat_log_tokens <= max_tokens_for_chat_log_segment:
-            logger.info(f"整个聊天记录 ({total_chat_log_tokens} tokens) 小于或等于允许的最大片段Token数 ({max_tokens_for_chat_log_segment}). 将其作为单个片段处理。")
-            return [chat_logs_text]
-        else:
-            logger.info(f"整个聊天记录 ({total_chat_log_tokens} tokens) 大于允许的最大片段Token数 ({max_tokens_for_chat_log_segment}). 需要进行切分。")
+    if not chat_logs_text:  # 确保 chat_logs_text 不为空
+        logger.info("聊天记录为空，无需切分，返回空列表。")
+        return []
 
-    except Exception as e:
-        logger.error(f"计算整个聊天记录Token数时出错: {e}. 将继续进行切分逻辑。")
+    # ==== 优化：尝试将整个聊天记录作为单个片段处理 ====
+    # 先用本地估算判断，只有估算值落在可能放得下的范围内时才调用远程接口确认
+    estimated_total_tokens = token_estimator.estimate(chat_logs_text)
+    logger.info(f"整个聊天记录的本地估算Token数: {estimated_total_tokens}")
+    if estimated_total_tokens <= max_tokens_for_chat_log_segment * 1.25:
+        try:
+            logger.info("正在校验整个聊天记录的Token总数...")
+            overall_token_count_start_time = time.time()
+            total_chat_log_tokens = count_tokens_cached(model, chat_logs_text, token_estimator)
+            count_calls += 1
+            overall_token_count_end_time = time.time()
+            logger.info(f"整个聊天记录的Token总数: {total_chat_log_tokens} (计算耗时: {overall_token_count_end_time - overall_token_count_start_time:.4f} 秒)")
+
+            if total_chat_log_tokens <= max_tokens_for_chat_log_segment:
+                logger.info(f"整个聊天记录 ({total_chat_log_tokens} tokens) 小于或等于允许的最大片段Token数 ({max_tokens_for_chat_log_segment}). 将其作为单个片段处理。")
+                token_estimator.save()
+                return [chat_logs_text]
+            else:
+                logger.info(f"整个聊天记录 ({total_chat_log_tokens} tokens) 大于允许的最大片段Token数 ({max_tokens_for_chat_log_segment}). 需要进行切分。")
+        except Exception as e:
+            logger.error(f"计算整个聊天记录Token数时出错: {e}. 将继续进行切分逻辑。")
+    else:
+        logger.info(f"本地估算值明显超过允许的最大片段Token数 ({max_tokens_for_chat_log_segment})，跳过整体校验，直接切分。")
     # ==== 优化结束 ====
 
-    # ---- 如果整体日志过大，则使用二分法进行分片 ----
-    logger.info("由于整个日志过大或初步Token计算失败，开始使用二分法进行智能分片...")
+    # ---- 如果整体日志过大，则基于逐行Token前缀和一次贪心扫描进行分片，远程接口只校验最终片段 ----
+    logger.info("开始基于逐行Token前缀和进行智能分片...")
     segments = []
     all_lines = chat_logs_text.splitlines(keepends=True)
     current_pos = 0  # 当前处理到的起始行索引
     total_lines_count = len(all_lines)
 
     segment_creation_loop_start_time = time.time()
+    line_index = LineTokenIndex(all_lines, token_estimator)
+    index_stats = line_index.stats
+    logger.info(f"逐行Token估算完成: {index_stats['lines']} 行, {index_stats['chars']} 字符, "
+                f"估算总Token数 {line_index.total_tokens:.0f}, 耗时 {index_stats['count_seconds']:.4f} 秒")
+
+    # 本地搜索时按估算器的历史偏差预留余量
+    local_budget = max_tokens_for_chat_log_segment / token_estimator.safety_factor()
     segment_count = 0
 
     while current_pos < total_lines_count:
         segment_count += 1
-        logger.info(f"开始为第 {segment_count} 个片段寻找最佳行数 (从第 {current_pos + 1} 行开始)...总行数 {total_lines_count}")
-
-        # 二分搜索的范围是 [1, total_lines_count - current_pos]
-        low = 1
-        high = total_lines_count - current_pos
-        best_k_for_segment = 0  # 本次二分查找到的最佳行数
-
-        # 在二分查找前，先检查剩余所有行是否能直接放入一个片段 (可能在之前整体检查失败，但剩余部分较小)
-        # This check is somewhat redundant if the overall check passed, but useful if it failed for other reasons
-        # or if we want to be absolutely sure for the remainder.
-        # For simplicity and performance, let's rely on the binary search to find the largest possible chunk.
-
-        binary_search_start_time = time.time()
-        iterations = 0
-        while low <= high:
-            iterations += 1
-            mid_k = low + (high - low) // 2
-            if mid_k == 0:  # 防止 mid_k 变为0导致死循环或切片错误
-                break
+        best_k_for_segment = line_index.max_end(current_pos, local_budget) - current_pos
 
-            segment_text_to_test = "".join(all_lines[current_pos: current_pos + mid_k])
+        # 远程校验最终片段，超限则按真实Token数等比收缩预算后重新定位边界
+        for verify_attempt in range(MAX_VERIFY_ATTEMPTS):
+            if best_k_for_segment <= 0:
+                break
+            actual_segment_text = line_index.text(current_pos, current_pos + best_k_for_segment)
             try:
-                tokens = model.count_tokens(segment_text_to_test).total_tokens
-                if tokens <= max_tokens_for_chat_log_segment:
-                    best_k_for_segment = mid_k  # 这是一个可行的k，尝试更大的k
-                    low = mid_k + 1
-                else:
-                    high = mid_k - 1  # k太大了，减小k
+                tokens = count_tokens_cached(model, actual_segment_text, token_estimator)
+                count_calls += 1
             except Exception as e:
-                logger.error(f"二分查找中计算 {mid_k} 行的Token数时出错 (行范围: {current_pos + 1}-{current_pos + mid_k}): {e}. 尝试减小行数。")
-                high = mid_k - 1  # 假设出错的块过大或无效
-
-        binary_search_duration = time.time() - binary_search_start_time
-        logger.info(f"片段 {segment_count} 的二分查找完成: {iterations} 次迭代, 耗时 {binary_search_duration:.4f} 秒.")
+                logger.error(f"校验片段 {segment_count} ({best_k_for_segment} 行) 的Token数时出错: {e}. 采用本地估算结果。")
+                break
+            if tokens <= max_tokens_for_chat_log_segment:
+                logger.info(f"片段 {segment_count} 远程校验通过: {tokens} tokens (第 {verify_attempt + 1} 次校验)")
+                break
+            shrunk_budget = line_index.tokens(current_pos, current_pos + best_k_for_segment) * max_tokens_for_chat_log_segment / tokens * 0.98
+            shrunk_k = min(line_index.max_end(current_pos, shrunk_budget) - current_pos, best_k_for_segment - 1)
+            logger.warning(f"片段 {segment_count} 远程校验超限 ({tokens} > {max_tokens_for_chat_log_segment})，行数由 {best_k_for_segment} 收缩至 {shrunk_k}")
+            best_k_for_segment = shrunk_k
 
         if best_k_for_segment > 0:
-            actual_segment_text = "".join(all_lines[current_pos: current_pos + best_k_for_segment])
-            segments.append(actual_segment_text)
-            logger.info(f"创建片段 {segment_count}: 包含 {best_k_for_segment} 行 (从 {current_pos + 1} 到 {current_pos + best_k_for_segment}), Token数计算应已达标。")
+            segments.append(line_index.text(current_pos, current_pos + best_k_for_segment))
+            logger.info(f"创建片段 {segment_count}: 包含 {best_k_for_segment} 行 (从 {current_pos + 1} 到 {current_pos + best_k_for_segment})。")
             current_pos += best_k_for_segment
         else:
-            # 如果 best_k_for_segment 为 0, 说明即使是第一行 (k=1) 也超限或出错
-            logger.warning(f"无法为片段 {segment_count} 找到合适的行数（即使一行也可能超限或出错）。将尝试添加从 {current_pos + 1} 开始的第一行作为单独片段。")
-            if current_pos < total_lines_count:  # 确保还有行可加
-                single_line_segment = all_lines[current_pos]
-                segments.append(single_line_segment)
-                try:
-                    sl_tokens = model.count_tokens(single_line_segment).total_tokens
-                    logger.info(f"片段 {segment_count} (单行): 第 {current_pos + 1} 行, 字符数 {len(single_line_segment)}, Token数 {sl_tokens}. (可能超限)")
-                except Exception as e_sl:
-                    logger.warning(f"片段 {segment_count} (单行): 第 {current_pos + 1} 行, 字符数 {len(single_line_segment)}. Token计数失败: {e_sl}")
-                current_pos += 1
-            else:
-                logger.error("已无更多行可处理，但未能正确切分。这不应发生。")
-                break  # 避免死循环
+            # 如果 best_k_for_segment 为 0, 说明即使是第一行 (k=1) 也超限
+            single_line_segment = all_lines[current_pos]
+            segments.append(single_line_segment)
+            logger.warning(f"片段 {segment_count} 即使一行也可能超限，将第 {current_pos + 1} 行单独作为片段 "
+                           f"(字符数 {len(single_line_segment)}, 估算Token数 {line_index.tokens(current_pos, current_pos + 1):.0f})。")
+            current_pos += 1
 
     segment_creation_loop_duration = time.time() - segment_creation_loop_start_time
-    logger.info(f"二分法分片完成。总共创建 {len(segments)} 个片段。总耗时: {segment_creation_loop_duration:.4f} 秒。")
+    token_estimator.save()
+    logger.info(f"分片完成。总共创建 {len(segments)} 个片段，逐行估算 {index_stats['lines']} 行，"
+                f"count_tokens 校验 {count_calls} 次。总耗时: {segment_creation_loop_duration:.4f} 秒。")
     return segments
 
 
-def build_complete_prompt(prompt_template, chat_logs, talker):
-    """构建发送给Gemini的完整Prompt"""
-    logger.info("构建完整prompt...")
-
-    if not chat_logs:
-        raise ValueError("聊天记录为空，无法构建prompt")
-
-    complete_prompt = f"""你好，此处的txt为我的【群日报生成要求prompt】，另一外一份txt为我的【群聊记录】。
+def build_prompt_prefix(prompt_template):
+    """构建Prompt的固定前缀（开场说明 + 日报模板），使用同一模板的群聊和片段完全相同，可作为上下文缓存"""
+    return f"""你好，此处的txt为我的【群日报生成要求prompt】，另一外一份txt为我的【群聊记录】。
 
 请你根据最新的群聊记录，按照prompt要求，生成一份群日报。要求仅返回html，不要返回其他内容。
 
-【群聊名称】：
-{talker}
-
 【群日报生成要求prompt】：
 {prompt_template}
 
+"""
+
+
+def build_prompt_suffix(chat_logs, talker):
+    """构建Prompt中每个群聊/片段各不相同的部分（群聊名称 + 聊天记录）"""
+    return f"""【群聊名称】：
+{talker}
+
 【群聊记录】：
 {chat_logs}
 
 谢谢"""
+
+
+def build_complete_prompt(prompt_template, chat_logs, talker):
+    """构建发送给Gemini的完整Prompt（固定前缀 + 群聊名称和聊天记录）"""
+    logger.info("构建完整prompt...")
+
+    if not chat_logs:
+        raise ValueError("聊天记录为空，无法构建prompt")
+
+    complete_prompt = build_prompt_prefix(prompt_template) + build_prompt_suffix(chat_logs, talker)
     logger.info(f"完整prompt已构建: {len(complete_prompt)}字符")
     return complete_prompt
 
 
-def extract_html_from_response(response_text):
-    """从Gemini API的响应文本中提取HTML内容"""
-    # 如果已经是HTML，直接返回
-    if response_text.strip().startswith('<'):
-        return response_text
-
-    # 尝试从代码块中提取HTML
-    if '```html' in response_text and '```' in response_text.split('```html', 1)[1]:
-        html_content = response_text.split(
-            '```html', 1)[1].split('```', 1)[0].strip()
-        return html_content
+def extract_html_from_response(response_text, extractor=None):
+    """从Gemini API的响应文本中提取HTML内容
 
-    # 尝试提取<html>标签内容
-    if '<html' in response_text and '</html>' in response_text:
-        start_idx = response_text.find('<html')
-        end_idx = response_text.find('</html>') + 7
-        html_content = response_text[start_idx:end_idx]
+    依次尝试：整个回复就是HTML、```html 代码块、<html>…</html> 标签。
+    流式接收时传入已经逐块处理过的 extractor，直接按记录的位置切片，不再重新扫描全文。
+    """
+    if extractor is None:
+        extractor = HtmlStreamExtractor()
+        extractor.feed(response_text)
+    html_content = extractor.result(response_text)
+    if html_content is not None:
         return html_content
 
     # 如果无法提取HTML，抛出异常
     err_msg = "无法从响应中提取HTML，原始文本内容如下（最多显示100字符）：\n" + response_text[:100]
     logger.error(err_msg)
-    raise ValueError(err_msg)
+    raise HtmlExtractionError(err_msg)
+
+
+# Gemini 生成参数（同时作为响应缓存键的一部分）
+GEMINI_GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "top_p": 0.8,
+    "top_k": 40,
+    # "max_output_tokens": 8192,
+    "max_output_tokens": 65536,
+}
+
+
+# 分段摘要（map-reduce 模式的 map 阶段）的生成参数：低温度、小输出，不生成HTML
+GEMINI_SUMMARY_CONFIG = {
+    "temperature": 0.3,
+    "top_p": 0.8,
+    "top_k": 40,
+    "max_output_tokens": CHAT_DEMO_CFG.get('map_summary_max_output_tokens', 4096),
+}
+
+SEGMENT_SUMMARY_PROMPT = """你是群聊记录整理助手。下面是群聊「{talker}」按时间顺序切分后的第 {index}/{count} 段聊天记录。
+请把这一段浓缩为简洁的中间摘要，之后会与其他分段的摘要合并，统一生成一份群日报。要求：
+1. 只输出纯文本要点，不要输出HTML、CSS、Markdown表格或任何样式代码；
+2. 按话题归纳：话题名称、大致时间范围、主要参与者（昵称）、关键观点与结论、提到的链接/资源/待办事项；
+3. 每个话题保留不超过3句有代表性的原话，并记录发言较多的成员及大致发言次数；
+4. 不要编造聊天记录中没有的内容。
+
+【群聊记录】：
+{chat_logs}
+"""
+
 
+def generate_html_with_gemini(model, prompt, rate_limiter, use_cache=True, cached_prefix=None,
+                              stream_path=None, talker_name='default', router=None, report_meta=None):
+    """使用Gemini API生成HTML内容，包含重试机制，请求前通过共享的滑动窗口限流器控制TPM/RPM
+
+    use_cache为True时，相同模型、生成参数和Prompt的结果直接从本地响应缓存读取，不再调用模型。
+    指定cached_prefix（Prompt的固定前缀）且开启了上下文缓存时，前缀只上传一次，之后的请求引用缓存。
+    指定stream_path时，提取出的HTML边接收边写入该文件；流式接收中途失败时发起续写请求，而不是从头重新生成。
+    失败时按错误类型决定是否重试、等待多久，重试统计按 talker_name 汇总。
+    指定router（多模型路由）时按Prompt大小选择模型，配额用尽或不可用时切换到下一个模型；实际使用的模型写入report_meta['model']。
+    """
+    return generate_with_gemini(model, prompt, rate_limiter, GEMINI_GENERATION_CONFIG, extract_html=True,
+                                use_cache=use_cache, cached_prefix=cached_prefix,
+                                stream_path=stream_path, talker_name=talker_name, router=router,
+                                report_meta=report_meta)
 
-def generate_html_with_gemini(model, prompt, tpm_limit, last_request_state):
-    """使用Gemini API生成HTML内容，包含重试机制"""
-    max_retries = CHAT_DEMO_CFG.get('gemini_retry_attempts', 3)
-    retry_delay = CHAT_DEMO_CFG.get('gemini_retry_delay_sec', 10)
-    attempts = 0
 
-    while attempts < max_retries:
+def generate_with_gemini(model, prompt, rate_limiter, generation_config, extract_html=True, use_cache=True,
+                         cached_prefix=None, stream_path=None, talker_name='default', router=None, report_meta=None):
+    """
+    调用Gemini API流式生成内容，包含按错误类型退避的重试、多模型切换、TPM/RPM限流和本地响应缓存
+
+    参数:
+        model: Gemini模型（指定router时不使用）
+        prompt (str): 完整的Prompt
+        rate_limiter (SlidingWindowRateLimiter): 共享的限流器（指定router时使用各模型自己的限流器）
+        generation_config (dict): 生成参数（同时作为响应缓存键的一部分）
+        extract_html (bool): 是否从响应中提取HTML；为False时返回去除首尾空白的纯文本
+        use_cache (bool): 是否读取本地响应缓存
+        cached_prefix (str): prompt 的固定前缀，开启上下文缓存时作为缓存内容上传一次，请求只发送其后的部分
+        stream_path (str): 提取出的HTML边接收边写入的临时文件（仅 extract_html 时有效）
+        talker_name (str): 群聊名称，用于按群聊汇总重试次数和等待时间
+        router (ModelRouter): 多模型路由，每次尝试前按Prompt大小和各模型的额度选择模型
+        report_meta (dict): 不为None时写入实际生成内容的模型名称（'model'）
+
+    返回:
+        str: 生成的HTML或文本
+    """
+    if router is not None:
+        model, rate_limiter = router.primary.model, router.primary.rate_limiter
+    model_name = getattr(model, 'model_name', 'default')
+    # 多模型时内容可能由其中任一模型生成，响应缓存按实际生成的模型记录，读取时依次查找
+    cache_model_names = [route.name for route in router.routes] if router is not None else [model_name]
+    if use_cache:
+        for cache_model_name in cache_model_names:
+            cached_html = get_llm_response_cache().get_text(llm_cache_key(cache_model_name, generation_config, prompt))
+            if cached_html is not None:
+                logger.info(f"命中模型响应缓存，跳过Gemini调用: {len(cached_html)}字符 (模型: {cache_model_name})")
+                print(f"♻️ 命中本地缓存，复用之前生成的内容 ({len(cached_html)}字符)")
+                if report_meta is not None:
+                    report_meta['model'] = cache_model_name
+                return cached_html
+    # 选择模型时使用本地估算的Prompt Token数
+    estimated_prompt_tokens = get_token_estimator(model_name).estimate(prompt) if router is not None else 0
+
+    # 按错误类型决定是否重试及等待时间（指数退避+抖动、服务端重试提示、整份日报的时间预算）
+    retry_policy = new_retry_policy(talker_name)
+    max_continuations = CHAT_DEMO_CFG.get('gemini_continuation_attempts', 2) if extract_html else 0
+
+    context_cache = get_context_cache_manager() if cached_prefix and prompt.startswith(cached_prefix) else None
+
+    while True:
+        # 每次尝试前选择模型：之前失败的模型暂停期间改用其他模型
+        route = router.select(estimated_prompt_tokens) if router is not None else None
+        attempt_model = route.model if route is not None else model
+        attempt_limiter = route.rate_limiter if route is not None else rate_limiter
+        attempt_model_name = getattr(attempt_model, 'model_name', model_name)
+        request_model = attempt_model
+        request_contents = prompt
         try:
-            # 计算当前prompt的token数
+            # 上下文缓存：固定前缀作为缓存内容只上传一次，请求只发送群聊名称和聊天记录
+            if context_cache is not None:
+                try:
+                    prefix_tokens = count_tokens_cached(attempt_model, cached_prefix)
+                except Exception as e_count:
+                    prefix_tokens = get_token_estimator(attempt_model_name).estimate(cached_prefix)
+                    logger.warning(f"计算固定前缀Token数失败: {str(e_count)}. 使用本地估算值 {prefix_tokens}。")
+                cached_model = context_cache.get_model(attempt_model, cached_prefix, prefix_tokens)
+                if cached_model is not None:
+                    request_model = cached_model
+                    request_contents = prompt[len(cached_prefix):]
+                    logger.info(f"引用上下文缓存，固定前缀 {prefix_tokens} tokens 不再重复上传")
+
+            # 计算当前prompt的token数（引用上下文缓存时只计算未缓存的部分）
             current_prompt_tokens = 0
             try:
-                count_tokens_result = model.count_tokens(prompt)
-                current_prompt_tokens = count_tokens_result.total_tokens
+                current_prompt_tokens = count_tokens_cached(attempt_model, request_contents)
                 logger.info(f"当前请求的Prompt Token数: {current_prompt_tokens}")
             except Exception as e_count:
-                logger.error(f"计算Prompt Token数失败: {str(e_count)}. 无法执行TPM检查，将直接发送请求。")
-                # 如果无法计算token，为避免阻塞，不执行等待逻辑，但后续TPM可能仍会超限
-
-            # TPM控制逻辑
-            if current_prompt_tokens > 0 and last_request_state['start_time'] is not None:
-                current_time = time.time()
-                time_since_last_request = current_time - last_request_state['start_time']
-
-                TPM_best_sec = (60 * TPM_errorFix["sec_ratio"])  # 增加容错，减少错误重试次数（变相节省时间）
-                # 检查是否在1分钟内，并且组合token数超过TPM
-                if time_since_last_request < TPM_best_sec:
-                    combined_tokens = last_request_state['tokens'] + current_prompt_tokens
-                    if combined_tokens > tpm_limit:
-                        wait_duration = TPM_best_sec - time_since_last_request
-                        logger.warning(
-                            f"TPM限制可能超额 ({last_request_state['tokens']} + {current_prompt_tokens} = {combined_tokens} > {tpm_limit}). "
-                            f"等待 {wait_duration:.2f} 秒..."
-                        )
-                        print(f"⏳ 为满足TPM限制，程序将暂停 {wait_duration:.2f} 秒...")
-                        sys.stdout.flush()
-                        time.sleep(wait_duration)
-                        # 等待后，重置上一次请求状态，因为现在相当于一个新的分钟窗口的开始
-                        # 或者说，我们认为等待后，之前那个请求的影响已经过去了
-                        last_request_state['start_time'] = None
-                        last_request_state['tokens'] = 0
-                else:
-                    # 如果距离上次请求超过1分钟，则之前的请求不再计入当前分钟的TPM额度
-                    # 因此，我们将 last_request_state['tokens'] 视为0，或者说，我们只关心当前请求是否会触发等待
-                    # （这里我们不需要做什么，因为如果 combined_tokens 检查不满足，就不会等待）
-                    pass  # 实际上，如果超过1分钟，last_request_state['tokens'] 对 combined_tokens 的影响会消失
+                current_prompt_tokens = get_token_estimator(attempt_model_name).estimate(request_contents)
+                logger.error(f"计算Prompt Token数失败: {str(e_count)}. 使用本地估算值 {current_prompt_tokens} 进行TPM检查。")
+
+            # 滑动窗口TPM/RPM控制：所有并发请求共享同一个限流器，额度不足时只等待到窗口内最早的请求过期
+            logger.info(f"当前窗口用量: {attempt_limiter.format_usage()}")
+            reservation = attempt_limiter.acquire(current_prompt_tokens)
 
             print("""
                 调试1 （有时会卡在这里，丢失后续的 logger.info 输出？）
@@ -713,77 +986,227 @@ def generate_html_with_gemini(model, prompt, tpm_limit, last_request_state):
             sys.stdout.flush()
             logger.info("向Gemini API发送prompt...")
             sys.stdout.flush()
-            # 设置生成参数
-            generation_config = {
-                "temperature": 0.7,
-                "top_p": 0.8,
-                "top_k": 40,
-                # "max_output_tokens": 8192,
-                "max_output_tokens": 65536,
-            }
-
             # 发送请求到Gemini
-            response = model.generate_content(
-                prompt,
+            response = request_model.generate_content(
+                request_contents,
                 generation_config=generation_config,
                 stream=True,  # 流式传输
             )
 
-            # 请求发送成功后，更新上一次请求的状态
-            if current_prompt_tokens > 0:  # 仅当成功计算token时更新
-                last_request_state['start_time'] = time.time()  # 记录本次请求的开始时间 (或结束时间)
-                last_request_state['tokens'] = current_prompt_tokens
-                logger.info(f"更新TPM状态: last_request_start_time={last_request_state['start_time']}, last_request_tokens={last_request_state['tokens']}")
-
             # 处理流式响应
             print("正在生成日报内容，请稍候...")
             sys.stdout.flush()
-            response_text = ""
-            # 创建一个动态进度条
-            progress_bar = tqdm.tqdm(desc="生成进度", unit="字符", dynamic_ncols=True)
+            # 文本块先追加到列表，结束后只拼接一次；HTML的起止位置随接收过程逐块识别
+            accumulator = StreamAccumulator()
+            extractor = HtmlStreamExtractor() if extract_html else None
+            # 已确认的HTML边接收边写入临时文件（stream_path），中途失败时据此续写
+            writer = HtmlStreamWriter(stream_path) if extract_html else None
+            # 创建一个动态进度条（限制刷新频率，避免每个文本块都重绘）
+            import tqdm
 
-            for chunk in response:
-                if hasattr(chunk, 'text') and chunk.text:
-                    current_chunk = chunk.text
-                    response_text += current_chunk
-                    # 更新进度条
-                    progress_bar.update(len(current_chunk))
-                    # 可选：每接收到一个块后显示最新的少量文本
-                    if len(current_chunk) > 0 and len(current_chunk) < 100:
-                        # 显示最近添加的文本片段，但避免输出HTML标签
-                        readable_chunk = current_chunk.replace(
-                            '<', '＜').replace('>', '＞')
-                        progress_bar.set_description(
-                            f"最新内容: {readable_chunk[:30]}...")
-
-            # 关闭进度条
-            progress_bar.close()
-            print(f"内容生成完毕！共 {len(response_text)} 个字符")
-            sys.stdout.flush()
+            progress = ThrottledProgress(tqdm.tqdm(desc="生成进度", unit="字符", dynamic_ncols=True))
 
-            # 提取HTML内容
-            html_content = extract_html_from_response(response_text)
+            continued_html = None
+            try:
+                for chunk in response:
+                    if hasattr(chunk, 'text') and chunk.text:
+                        current_chunk = chunk.text
+                        accumulator.append(current_chunk)
+                        if extractor is not None:
+                            writer.write(extractor.feed(current_chunk), extractor.restarts)
+                        progress.advance(current_chunk)
+            except BaseException as stream_error:
+                # 中断（如Ctrl-C）或出错；--resume 以片段为单位重新生成，不保存已接收的部分内容
+                logger.warning(f"生成过程被中断，已接收 {len(accumulator)} 个字符")
+                progress.close()
+                if writer is not None:
+                    writer.flush()
+                partial_html = writer.text() if writer is not None else ''
+                # 网络等错误导致流式接收中断、且已经收到部分HTML时，发起续写请求而不是从头重新生成
+                if not isinstance(stream_error, Exception) or not partial_html or max_continuations <= 0:
+                    if writer is not None:
+                        writer.close()
+                    raise
+                logger.warning(f"流式接收在第 {len(accumulator)} 个字符处中断: {str(stream_error)}，"
+                               f"已生成 {len(partial_html)} 个字符的HTML，将发起续写请求")
+                attempt_limiter.record_output(reservation, get_token_estimator(attempt_model_name).estimate(accumulator.text()))
+                try:
+                    continued_html = continue_html_with_gemini(request_model, request_contents, partial_html, attempt_limiter,
+                                                               generation_config, writer, max_continuations)
+                except BaseException:
+                    writer.close()
+                    raise
+
+            if continued_html is None:
+                # 关闭进度条
+                progress.close()
+                response_text = accumulator.text()
+                print(f"内容生成完毕！共 {len(response_text)} 个字符")
+                sys.stdout.flush()
+
+                # 补记输出Token数（优先使用服务端返回的用量，否则本地估算）
+                usage_metadata = getattr(response, 'usage_metadata', None)
+                output_tokens = getattr(usage_metadata, 'candidates_token_count', 0) or \
+                    get_token_estimator(attempt_model_name).estimate(response_text)
+                attempt_limiter.record_output(reservation, output_tokens)
+                logger.info(f"本次输出Token数: {output_tokens}，当前窗口用量: {attempt_limiter.format_usage()}")
+
+            if extract_html:
+                # 提取HTML内容（续写时为拼接后的HTML）
+                try:
+                    html_content = continued_html if continued_html is not None else \
+                        extract_html_from_response(response_text, extractor)
+                finally:
+                    writer.close()
+                writer.commit(html_content)
 
-            # 验证HTML基本结构
-            if not ('<html' in html_content.lower() and '</html>' in html_content.lower()):
-                logger.warning("生成的内容可能不是有效的HTML")
+                # 验证HTML基本结构
+                if not ('<html' in html_content.lower() and '</html>' in html_content.lower()):
+                    logger.warning("生成的内容可能不是有效的HTML")
 
-            logger.info(f"成功生成HTML内容: {len(html_content)}字符")
+                logger.info(f"成功生成HTML内容: {len(html_content)}字符")
+            else:
+                html_content = response_text.strip()
+                logger.info(f"成功生成文本内容: {len(html_content)}字符")
+            try:
+                get_llm_response_cache().put_text(llm_cache_key(attempt_model_name, generation_config, prompt), html_content)
+            except Exception as e_cache:
+                logger.warning(f"写入模型响应缓存失败: {str(e_cache)}")
+            if report_meta is not None:
+                report_meta['model'] = attempt_model_name
             return html_content  # 成功获取响应，跳出重试循环并返回结果
 
         except Exception as e:
-            attempts += 1
-            logger.error(f"使用Gemini生成HTML失败 (尝试 {attempts}/{max_retries}): {str(e)}")
-            if attempts < max_retries:
-                logger.info(f"将在 {retry_delay} 秒后重试...")
-                print(f"⚠️ Gemini API请求失败，将在 {retry_delay} 秒后重试 ({attempts}/{max_retries})...")
-                time.sleep(retry_delay)
-            else:
-                logger.error(f"已达到最大重试次数 ({max_retries})，Gemini API调用最终失败。错误: {str(e)}")
-                raise  # 重试次数耗尽，重新引发最后一个异常
-    # 如果循环结束仍未成功（理论上不会到这里，因为要么return要么raise）
-    logger.error("Gemini API调用在所有重试后均失败，且未正确抛出异常。")
-    raise Exception("Gemini API调用在所有重试后均失败。")
+            logger.error(f"使用Gemini生成{'HTML' if extract_html else '内容'}失败 "
+                         f"(第 {retry_policy.attempts + 1} 次尝试): {str(e)}")
+            error_kind = None
+            failover = False
+            if request_model is not attempt_model:
+                # 缓存可能已过期或被删除，重试前丢弃，下次重新创建（创建失败时回退为完整Prompt）
+                context_cache.invalidate(attempt_model, cached_prefix)
+                if classify_error(e) == ERROR_PERMANENT:
+                    # 引用缓存时的 NotFound 等错误，丢弃缓存后重试即可恢复
+                    error_kind = ERROR_TRANSIENT
+            elif route is not None:
+                # 多模型：限流、不可用或模型已下线时暂停/停用该模型，有其他可用模型时立即切换，不再等待
+                failover = router.report_failure(route, e, classify_error(e)) and \
+                    router.has_alternative(estimated_prompt_tokens)
+            retry_delay = retry_policy.next_delay(e, error_kind, failover=failover)
+            if retry_policy.last_kind == ERROR_RATE_LIMIT:
+                # 429：按服务端给出的重试时间暂停所有共享该限流器的请求
+                attempt_limiter.penalize(retry_policy.last_server_delay)
+            if retry_delay is None:
+                logger.error(f"Gemini API调用最终失败（共尝试 {retry_policy.attempts} 次，等待 {retry_policy.wait_sec:.1f} 秒）。"
+                             f"错误: {str(e)}")
+                raise  # 不可重试或重试次数/时间预算耗尽，重新引发最后一个异常
+            if failover:
+                print(f"⚠️ 模型 {attempt_model_name} 请求失败，改用其他模型重试 ({retry_policy.attempts}/{retry_policy.max_attempts})...")
+                continue
+            print(f"⚠️ Gemini API请求失败，将在 {retry_delay:.1f} 秒后重试 ({retry_policy.attempts}/{retry_policy.max_attempts})...")
+            time.sleep(retry_delay)
+
+
+CONTINUATION_PROMPT = """{prompt}
+
+【已经生成的部分】：
+{partial_html}
+
+上面这段HTML在生成过程中因网络问题被中断。请紧接着它的最后一个字符继续输出剩余的HTML，直到 </html> 结束。
+不要重复已经输出的内容，不要添加任何解释，也不要使用```代码块标记。"""
+
+
+def continue_html_with_gemini(model, prompt, partial_html, rate_limiter, generation_config, writer, max_continuations):
+    """
+    流式生成中途失败后发起续写请求：把已生成的HTML附在原Prompt后面，让模型从中断处继续，再把两部分拼接起来。
+    续写本身再次中断时，以拼接后的内容为新的起点继续，最多 max_continuations 次。
+
+    参数:
+        model: 发起原请求的模型（可能引用了上下文缓存）
+        prompt (str): 原请求发送的内容
+        partial_html (str): 中断前已生成的HTML
+        rate_limiter (SlidingWindowRateLimiter): 共享的限流器
+        generation_config (dict): 生成参数
+        writer (HtmlStreamWriter): 流式写入的临时文件，续写内容继续追加到其中
+        max_continuations (int): 最多续写次数
+
+    返回:
+        str: 拼接后的完整HTML；续写全部失败时抛出最后一次的异常
+    """
+    token_estimator = get_token_estimator(getattr(model, 'model_name', 'default'))
+    for continuation in range(1, max_continuations + 1):
+        continuation_prompt = CONTINUATION_PROMPT.format(prompt=prompt, partial_html=partial_html)
+        reservation = rate_limiter.acquire(token_estimator.estimate(continuation_prompt))
+        print(f"🔁 生成中断，正在从第 {len(partial_html)} 个字符处续写 ({continuation}/{max_continuations})...")
+        logger.info(f"发起续写请求 ({continuation}/{max_continuations})，已生成 {len(partial_html)} 个字符")
+        accumulator = StreamAccumulator()
+        try:
+            response = model.generate_content(continuation_prompt, generation_config=generation_config, stream=True)
+            for chunk in response:
+                if hasattr(chunk, 'text') and chunk.text:
+                    accumulator.append(chunk.text)
+                    writer.write(chunk.text)
+        except Exception as e:
+            rate_limiter.record_output(reservation, token_estimator.estimate(accumulator.text()))
+            partial_html = stitch_continuation(partial_html, accumulator.text())
+            writer.reset(partial_html)
+            writer.flush()
+            logger.warning(f"续写请求再次中断 ({continuation}/{max_continuations}): {str(e)}")
+            if continuation == max_continuations or is_rate_limit_error(e):
+                raise
+            continue
+
+        usage_metadata = getattr(response, 'usage_metadata', None)
+        rate_limiter.record_output(reservation, getattr(usage_metadata, 'candidates_token_count', 0) or
+                                   token_estimator.estimate(accumulator.text()))
+        html_content = stitch_continuation(partial_html, accumulator.text())
+        print(f"✅ 续写完成，拼接后共 {len(html_content)} 个字符")
+        logger.info(f"续写完成: 续写 {len(accumulator)} 个字符，拼接后HTML共 {len(html_content)} 个字符")
+        return html_content
+
+
+def mark_first_request(run_context):
+    """在启动时间线上记录第一次请求AI的时间"""
+    timeline = run_context.get('startup_timeline')
+    if timeline is not None and timeline.mark(MARK_FIRST_REQUEST):
+        logger.info(f"启动后 {timeline.elapsed():.2f} 秒开始第一次请求AI")
+
+
+def summarize_segment_with_gemini(segment_index, chat_segment, segments_count, talker_name, run_context):
+    """
+    map-reduce 模式的 map 阶段：把一个聊天记录片段浓缩为纯文本的中间摘要
+
+    返回:
+        str: 中间摘要
+    """
+    print(f"  ⏳ 正在浓缩「{talker_name}」片段 {segment_index + 1}/{segments_count} ...")
+    mark_first_request(run_context)
+    summary = generate_with_gemini(
+        run_context['model'],
+        SEGMENT_SUMMARY_PROMPT.format(talker=talker_name, index=segment_index + 1,
+                                      count=segments_count, chat_logs=chat_segment),
+        run_context['rate_limiter'],
+        GEMINI_SUMMARY_CONFIG,
+        extract_html=False,
+        use_cache=not run_context['args'].no_llm_cache,
+        talker_name=talker_name,
+        router=run_context.get('model_router'),
+    )
+    print(f"  ✅ 「{talker_name}」片段 {segment_index + 1}/{segments_count} 已浓缩为 {len(summary)} 字符")
+    return summary
+
+
+def merge_segment_summaries(summaries):
+    """
+    map-reduce 模式的 reduce 输入：把各片段的中间摘要按时间顺序合并，代替原始聊天记录传给日报模板
+
+    返回:
+        str: 合并后的摘要
+    """
+    parts = ["（说明：以下内容不是原始聊天记录，而是按时间顺序分段整理的群聊要点摘要，请据此生成一份完整的群日报。）"]
+    for index, summary in enumerate(summaries):
+        parts.append(f"【第 {index + 1}/{len(summaries)} 段要点】\n{summary}")
+    return "\n\n".join(parts)
+
 
 def save_report_urls_to_unified_file(reports_info):
     """
@@ -812,6 +1235,9 @@ def save_report_urls_to_unified_file(reports_info):
             content += f"--- 群日报 #{i} ---\n"
             content += f"群聊名称: {report['talker']}\n"
             content += f"HTML文件: {os.path.abspath(report['html_filepath'])}\n"
+
+            if report.get('model'):
+                content += f"生成模型: {report['model']}\n"
             
             if report.get('html_url'):
                 content += f"发布地址(URL): {report['html_url']}\n"
@@ -879,9 +1305,16 @@ def save_html(html_content, output_dir, talker_name, related_link=None):
             else:
                 html_content += footer_html
         
-        # 写入HTML文件
-        with open(filepath, 'w', encoding='utf-8') as file:
-            file.write(html_content)
+        # 先写入同目录下的临时文件，再原子地重命名，中途失败不会留下不完整的日报文件
+        tmp_filepath = filepath + '.tmp'
+        try:
+            with open(tmp_filepath, 'w', encoding='utf-8') as file:
+                file.write(html_content)
+            os.replace(tmp_filepath, filepath)
+        except BaseException:
+            if os.path.exists(tmp_filepath):
+                os.remove(tmp_filepath)
+            raise
 
         logger.info(f"成功保存HTML文件: {filepath}")
         return filepath
@@ -893,6 +1326,8 @@ def html_to_png(html_filepath):
     """将HTML文件转换为PNG图片 便于分享
     toDo 后续可根据系统判断使用怎样方式进行截图
 
+    浏览器实例从共享的浏览器池中借用，多个线程可以同时渲染不同的HTML文件。
+
     Args:
         html_filepath: HTML文件的完整路径
 
@@ -902,41 +1337,49 @@ def html_to_png(html_filepath):
     try:
         logger.info(f"开始将HTML转换为PNG: {html_filepath}")
 
-        # 设置Chrome选项
-        chrome_options = Options()
-        chrome_options.add_argument("--headless")  # 无头模式
-        chrome_options.add_argument("--disable-gpu")
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--window-size=1920,1080")  # 设置窗口大小
-
-        # 初始化WebDriver
-        driver = webdriver.Chrome(
-            service=Service(ChromeDriverManager().install()),
-            options=chrome_options
-        )
-
-        # 加载HTML文件
-        html_url = f"file:///{os.path.abspath(html_filepath)}"
-        driver.get(html_url)
-
-        # 等待页面加载完成
-        time.sleep(2)
-
-        # 获取页面实际高度
-        page_height = driver.execute_script("return document.body.scrollHeight")
-        driver.set_window_size(1920, page_height)
-
-        # 再次等待以确保调整后的页面完全加载
-        time.sleep(1)
-
         # 生成PNG文件路径
         png_filepath = os.path.splitext(html_filepath)[0] + ".png"
+        max_capture_height = CHAT_DEMO_CFG.get('png_max_capture_height', 16000)
+
+        # 相同的HTML和截图参数直接复用之前渲染的PNG（如上传或发送失败后重新运行）
+        render_cache = None
+        render_key = None
+        if CHAT_DEMO_CFG.get('render_cache_enabled', True):
+            render_cache = get_render_cache(
+                os.path.dirname(os.path.dirname(os.path.abspath(html_filepath))),  # 输出目录（HTML位于其下的日期目录中）
+                max_mb=CHAT_DEMO_CFG.get('render_cache_max_mb', 200),
+                max_age_days=CHAT_DEMO_CFG.get('render_cache_max_age_days', 30),
+            )
+            with open(html_filepath, 'rb') as f:
+                render_key = render_cache_key(f.read(), {
+                    'window_size': list(DEFAULT_WINDOW_SIZE),
+                    'max_capture_height': max_capture_height,
+                })
+            if render_cache.materialize(render_key, png_filepath):
+                logger.info(f"命中PNG渲染缓存，直接复用: {png_filepath}")
+                return png_filepath
+
+        # 借用浏览器实例，出错时该实例会被关闭，不会遗留进程
+        with get_browser_pool().driver() as driver:
+            # 加载HTML文件
+            html_url = f"file:///{os.path.abspath(html_filepath)}"
+            driver.get(html_url)
+
+            # 等待页面加载、网页字体、图片和网络请求完成，而不是固定等待
+            wait_for_page_ready(
+                driver,
+                timeout=CHAT_DEMO_CFG.get('png_ready_timeout_sec', 15),
+                network_idle_ms=CHAT_DEMO_CFG.get('png_network_idle_ms', 500),
+            )
 
-        # 截图并保存
-        driver.save_screenshot(png_filepath)
+            # 通过DevTools协议截取整页，超长页面自动分块截图并拼接
+            capture_full_page(driver, png_filepath, max_capture_height)
 
-        # 关闭WebDriver
-        driver.quit()
+        if render_cache is not None:
+            try:
+                render_cache.put_file(render_key, png_filepath)
+            except Exception as e:
+                logger.warning(f"写入PNG渲染缓存失败: {str(e)}")
 
         logger.info(f"HTML已成功转换为PNG: {png_filepath}")
         return png_filepath
@@ -946,6 +1389,22 @@ def html_to_png(html_filepath):
         return None
 
 
+def html_to_png_batch(html_filepaths):
+    """
+    并行地将多个HTML文件转换为PNG图片，并发数与浏览器池大小一致
+
+    Args:
+        html_filepaths: HTML文件路径列表
+
+    Returns:
+        list: 与输入顺序一致的PNG图片路径，失败的为None
+    """
+    if not html_filepaths:
+        return []
+    with ThreadPoolExecutor(max_workers=get_browser_pool().size, thread_name_prefix='png') as executor:
+        return list(executor.map(html_to_png, html_filepaths))
+
+
 def upload_html_to_server(html_content, is_protected=False,
     server_url="http://localhost:8888"):
   """
@@ -975,10 +1434,13 @@ def upload_html_to_server(html_content, is_protected=False,
 
   try:
     # 使用会话发送POST请求
-    response = requests.post(
+    from http_session import get_http_session
+
+    response = get_http_session().post(
         api_endpoint,
         headers=headers,
-        json=payload  # 使用json参数自动处理JSON序列化
+        json=payload,  # 使用json参数自动处理JSON序列化
+        timeout=(5, 120),  # 上传内容较大，读取超时放宽
     )
 
     # 检查响应状态
@@ -1006,16 +1468,16 @@ def upload_html_to_server(html_content, is_protected=False,
 def open_in_browser(html_filepath):
     """在默认浏览器中打开HTML文件"""
     try:
+        import webbrowser
+
         logger.info(f"在浏览器中打开HTML文件: {html_filepath}")
         webbrowser.open(f"file://{os.path.abspath(html_filepath)}")
     except Exception as e:
         logger.error(f"在浏览器中打开文件失败: {str(e)}")
 
 
-# 测试海外Google联通性。
-def check_oversea_conn():
-    import os
-
+def set_proxy_env():
+    """设置代理环境变量（在启动其他联网阶段之前、于主线程中调用）"""
     # 如果您需要指定本机Proxy代理（如Clash、V2ray等），可以开启此开关（并修改IP、端口）。
     use_env_proxy = True
     if use_env_proxy:
@@ -1023,27 +1485,407 @@ def check_oversea_conn():
         os.environ['https_proxy'] = 'http://127.0.0.1:7899'
         os.environ['all_proxy'] = 'socks5://127.0.0.1:7899'
 
+
+# 测试海外Google联通性。
+def check_oversea_conn():
+    from http_session import get_http_session
+
+    set_proxy_env()
+
     # 相关API文档测试
-    resp____oversea_conn_test = requests.get("https://generativelanguage.googleapis.com/$discovery/rest")
+    resp____oversea_conn_test = get_http_session().get("https://generativelanguage.googleapis.com/$discovery/rest")
     print("\n检查Google服务网络连接\n", resp____oversea_conn_test.text, '（此处【 "code": 403 、 200 】都属于正常）')
 
 
-def main():
-    check_oversea_conn()
+def process_segment(segment_index, chat_segment, segments_count, talker_name, talker_config, prompt_template, run_context,
+                    defer_png=False):
+    """
+    处理单个聊天记录片段：生成、保存、PNG、发布URL
+
+    defer_png 为True时不在此处渲染PNG，只在返回的信息中标记 png_pending，
+    由 render_pending_pngs 把同一群聊的所有片段交给浏览器池并行渲染
+
+    返回:
+        dict: 当前片段的群日报信息，片段为空时返回None
+    """
+    args = run_context['args']
+    segment_display_name = f"{talker_name} (片段 {segment_index + 1}/{segments_count})"
+    print(f"\n  --- 开始处理 「{segment_display_name}」 ---")
+
+    if not chat_segment.strip():
+        print(f"⚪ 「{segment_display_name}」内容为空，跳过此片段。")
+        logger.info(f"「{segment_display_name}」内容为空，跳过。")
+        return None
+
+    # 运行清单：--resume 时已完成的阶段直接复用之前的产物
+    manifest = run_context['manifest']
+    _, segment_artifacts = manifest.segment_state(talker_name, segment_index)
+
+    report_meta = {'model': segment_artifacts.get('model')}
+    if segment_artifacts.get('generated_html') and os.path.exists(segment_artifacts['generated_html']):
+        html_content = manifest.read_checkpoint(segment_artifacts['generated_html'])
+        print(f"  ♻️ 「{segment_display_name}」已在之前的运行中生成，直接复用")
+    else:
+        # 构建完整的Prompt
+        print(f"  ⏳ 正在为「{segment_display_name}」准备AI分析数据...")
+        complete_prompt = build_complete_prompt(
+            prompt_template, chat_segment,  # 使用切分后的片段
+            talker=talker_name,
+        )
+        print(f"  ✅ 「{segment_display_name}」分析数据准备完成 (Prompt长度: {len(complete_prompt)}字符)")
+
+        # 使用Gemini生成HTML
+        print(f"  ⏳ 「{segment_display_name}」开始AI分析并生成日报...")
+        # 生成的HTML边接收边写入检查点目录下的临时文件，完成后原子地重命名为检查点
+        stream_path = None
+        if CHAT_DEMO_CFG.get('gemini_stream_to_disk', True):
+            stream_path = manifest.checkpoint_path(talker_name, f"segment_{segment_index + 1}.stream.html")
+            if os.path.exists(stream_path):
+                os.remove(stream_path)  # 之前运行遗留的不完整内容
+        mark_first_request(run_context)
+        html_content = generate_html_with_gemini(
+            run_context['model'],
+            complete_prompt,
+            run_context['rate_limiter'],  # 所有请求共享的TPM/RPM限流器
+            use_cache=not args.no_llm_cache,
+            cached_prefix=build_prompt_prefix(prompt_template),  # 使用同一模板的群聊/片段共用上下文缓存
+            stream_path=stream_path,
+            talker_name=talker_name,
+            router=run_context.get('model_router'),  # 按Prompt大小和各模型额度选择模型，失败时自动切换
+            report_meta=report_meta,
+        )
+        if stream_path and os.path.exists(stream_path):
+            generated_html_path = manifest.checkpoint_path(talker_name, f"segment_{segment_index + 1}.html")
+            os.replace(stream_path, generated_html_path)
+        else:
+            generated_html_path = manifest.write_checkpoint(talker_name, f"segment_{segment_index + 1}.html", html_content)
+        manifest.mark_segment(talker_name, segment_index, 'generated', generated_html=generated_html_path,
+                              model=report_meta.get('model'))
+        # 旧版本在生成中断时保存的部分内容，生成完成后不再需要
+        legacy_partial_path = manifest.checkpoint_path(talker_name, f"segment_{segment_index + 1}.partial.html")
+        if os.path.exists(legacy_partial_path):
+            os.remove(legacy_partial_path)
+        if report_meta.get('model'):
+            logger.info(f"「{segment_display_name}」由模型 {report_meta['model']} 生成")
+
+    # 获取talker个性化配置，如果没有则使用全局配置
+    auto_generate_png = talker_config.get('auto_generate_png', CHAT_DEMO_CFG.get('auto_generate_png', False))
+    auto_generate_url = talker_config.get('auto_generate_url', CHAT_DEMO_CFG.get('auto_generate_url', False))
+    url_requires_password = talker_config.get('url_requires_password', CHAT_DEMO_CFG.get('url_requires_password', False))
+    # 获取相关链接配置
+    related_link = talker_config.get('related_link', None)
+
+    # 保存HTML文件，如果多片段，文件名包含片段号
+    html_filepath = segment_artifacts.get('html_filepath')
+    if html_filepath and os.path.exists(html_filepath):
+        print(f"  ♻️ 「{segment_display_name}」日报文件已存在: {html_filepath}")
+    else:
+        print(f"  ⏳ 正在为「{segment_display_name}」保存日报文件...")
+        file_suffix = f"_part_{segment_index + 1}" if segments_count > 1 else ""
+        output_filename_base = f"{talker_name}{file_suffix}"
+
+        html_filepath = save_html(
+            html_content, args.output_dir, output_filename_base, related_link)
+        manifest.mark_segment(talker_name, segment_index, 'saved', html_filepath=html_filepath)
+        print(f"  ✅ 「{segment_display_name}」日报已保存至: {html_filepath}")
+
+    # 初始化变量
+    png_filepath = None
+    html_url = None
+
+    # 将HTML转换为PNG图片
+    if auto_generate_png:
+        png_filepath = segment_artifacts.get('png_filepath')
+        if png_filepath and os.path.exists(png_filepath):
+            print(f"♻️ PNG图片已存在: {png_filepath}")
+        elif defer_png:
+            png_filepath = None
+        else:
+            png_filepath = html_to_png(html_filepath)
+            if png_filepath:
+                # 只有成功的阶段才记入运行清单，失败时续跑会重新执行
+                manifest.mark_segment(talker_name, segment_index, 'rendered', png_filepath=png_filepath)
+                print(f"✅ PNG图片已保存至: {png_filepath}")
+            else:
+                print("❌ PNG图片生成失败，请检查日志")
+
+    # 将HTML发布到托管服务器（前提部署了html托管服务）
+    if auto_generate_url:
+        html_url = segment_artifacts.get('html_url')
+        if html_url:
+            print(f"♻️ URL已在之前的运行中生成: {html_url}")
+        else:
+            # 获取边缘托管地址
+            hosting_address = CHAT_DEMO_CFG.get(
+                'website_hosting_address', "http://localhost:8888")
+
+            # 读取已保存的HTML文件内容（包含footer）
+            with open(html_filepath, 'r', encoding='utf-8') as file:
+                html_content_with_footer = file.read()
+
+            # 使用包含footer的HTML内容上传
+            html_url = upload_html_to_server(html_content_with_footer,
+                                             url_requires_password,
+                                             hosting_address)
+            if html_url:
+                manifest.mark_segment(talker_name, segment_index, 'uploaded', html_url=html_url)
+                print(f"✅ URL已生成: {html_url}")
+            else:
+                print("❌ URL生成失败，请检查日志")
+
+    # 收集当前群日报的信息
+    report_info = {
+        'talker': talker_name,
+        'segment_index': segment_index,
+        'model': report_meta.get('model'),  # 生成该日报的模型
+        'html_filepath': html_filepath,
+        'html_url': html_url,
+        'png_filepath': png_filepath,
+        'png_pending': bool(auto_generate_png and defer_png and not png_filepath),  # 等待与其他片段一起批量渲染
+        'auto_send_to_wechat': talker_config.get('auto_send_to_wechat', CHAT_DEMO_CFG.get('auto_send_to_wechat', False)),
+        'wechat_message_prefix': talker_config.get('wechat_message_prefix', CHAT_DEMO_CFG.get('wechat_message_prefix', "今日群日报已生成：")),
+        'auto_sync_to_feishu': talker_config.get('auto_sync_to_feishu', CHAT_DEMO_CFG.get('auto_sync_to_feishu', False)),
+        'related_link': related_link
+    }
+
+    # 如果需要，在浏览器中打开HTML
+    open_browser = CHAT_DEMO_CFG.get('auto_open_browser', False)
+    if open_browser and html_filepath:
+        import webbrowser
+
+        # 如果发布成功且配置了 URL，则打开 URL
+        if html_url:
+            print(
+                f"  ⏳ 正在为「{segment_display_name}」打开URL...")
+            webbrowser.open(html_url)
+            print(
+                f"  ✅ 已在浏览器中打开「{segment_display_name}」的日报")
+        else:
+          # 如果指定了，在浏览器中打开HTML文件
+            print(
+                f"  ⏳ 正在为「{segment_display_name}」打开浏览器...")
+            webbrowser.open(
+                f"file://{os.path.abspath(html_filepath)}")
+            print(
+                f"  ✅ 已在浏览器中打开「{segment_display_name}」的日报")
+
+    print(f"  --- 「{segment_display_name}」处理完成 ---")
+    return report_info
+
+
+def render_pending_pngs(talker_name, reports_info, manifest):
+    """把群聊中标记为 png_pending 的片段交给浏览器池并行渲染为PNG"""
+    pending = [report for report in reports_info if report.pop('png_pending', False)]
+    if not pending:
+        return
+    print(f"⏳ 正在并行渲染「{talker_name}」的 {len(pending)} 张PNG图片...")
+    png_filepaths = html_to_png_batch([report['html_filepath'] for report in pending])
+    for report, png_filepath in zip(pending, png_filepaths):
+        report['png_filepath'] = png_filepath
+        if png_filepath:
+            manifest.mark_segment(talker_name, report['segment_index'], 'rendered', png_filepath=png_filepath)
+            print(f"✅ PNG图片已保存至: {png_filepath}")
+        else:
+            print(f"❌ 「{talker_name}」片段 {report['segment_index'] + 1} 的PNG图片生成失败，请检查日志")
+
+
+def process_talker(talker_index, talker_config, run_context):
+    """
+    处理单个群聊：获取聊天记录、切分，并依次（或并发）处理每个片段
+
+    返回:
+        list: 该群聊生成的群日报信息列表（按片段顺序），出错时返回已完成的部分
+    """
+    args = run_context['args']
+    reports_info = []
+    # 获取talker名称
+    talker_name = talker_config['name']
+    try:
+        print(f"\n--- 开始处理 「{talker_name}」 ({talker_index + 1}/{run_context['talkers_count']}) ---")
+
+        # 运行清单：--resume 时已获取、已切分的群聊直接复用检查点中的聊天记录和片段
+        manifest = run_context['manifest']
+        talker_stage, talker_artifacts = manifest.talker_state(talker_name)
+        chat_log_segments = None
+        if stage_reached(talker_stage, 'segmented'):
+            chat_log_segments = [manifest.read_checkpoint(path) for path in talker_artifacts['segment_files']]
+            print(f"♻️ 「{talker_name}」已在之前的运行中完成切分，直接复用 {len(chat_log_segments)} 个片段")
+        else:
+            if stage_reached(talker_stage, 'fetched'):
+                full_chat_logs = manifest.read_checkpoint(talker_artifacts['chat_logs_file'])
+                print(f"♻️ 「{talker_name}」的聊天记录已在之前的运行中获取，直接复用")
+            else:
+                # 获取聊天记录
+                print(f"⏳ 正在获取「{talker_name}」的聊天记录...")
+                full_chat_logs = get_chat_logs(
+                    talker_name,
+                    args.days,
+                    args.start_date,
+                    args.end_date,
+                    refresh_cache=args.refresh_chatlog_cache,
+                )
+                if full_chat_logs:
+                    manifest.mark_talker(talker_name, 'fetched', chat_logs_file=manifest.write_checkpoint(
+                        talker_name, 'chat_logs.txt', full_chat_logs))
+
+            if not full_chat_logs:
+                print(f"❌ 未获取到「{talker_name}」的聊天记录，请检查群名称是否正确或时间范围内是否有消息")
+                logger.warning(f"未获取到「{talker_name}」的聊天记录，跳过。")
+                return reports_info
+            print(f"✅ 成功获取「{talker_name}」的完整聊天记录: {len(full_chat_logs)}字符")
+
+        # 获取talker个性化的prompt模板路径
+        prompt_template = run_context['prompt_template']
+        talker_prompt_path = talker_config.get('prompt_template_path', args.prompt_path)
+        # 如果talker配置了自己的prompt模板，则使用它
+        if talker_prompt_path != args.prompt_path:
+            print(f"⏳ 正在加载「{talker_name}」的个性化日报模板...")
+            prompt_template = read_prompt_template(talker_prompt_path)
+            print(f"✅ 「{talker_name}」的个性化模板加载完成")
+
+        # 确定基础Prompt的固定部分内容（聊天记录留空），用于计算token
+        # 与 build_complete_prompt 使用同样的拼接函数，保证结构一致
+        base_prompt_fixed_parts_text = build_prompt_prefix(prompt_template) + build_prompt_suffix("", talker_name)
+
+        if chat_log_segments is None:
+            # 压缩聊天记录：发言人代号、时间差、合并连续发言、缩短媒体占位符，减少Token数和片段数
+            compacted = None
+            if talker_config.get('chatlog_compaction', CHAT_DEMO_CFG.get('chatlog_compaction_enabled', True)):
+                compacted = compact_chat_log(full_chat_logs)
+                if compacted is not None:
+                    token_estimator = get_token_estimator(getattr(run_context['model'], 'model_name', 'default'))
+                    logger.info(f"「{talker_name}」聊天记录已压缩: {format_compaction(compacted, token_estimator)}")
+                    print(f"🗜️ 「{talker_name}」的聊天记录已压缩: {len(full_chat_logs)} → {len(compacted.text)}字符")
+
+            # 切分聊天记录（压缩时按消息行切分，成员表计入固定部分，切分后再为每个片段补上成员表和时间基准）
+            print(f"⏳ 正在为「{talker_name}」的聊天记录按Token数切片...")
+            chat_log_segments = split_chat_logs_into_segments(
+                run_context['model'],
+                base_prompt_fixed_parts_text + (compacted.legend if compacted else ""),
+                compacted.body if compacted else full_chat_logs,
+                run_context['model_input_token_limit'],
+                run_context['tpm_limit']
+            )
+            if compacted is not None:
+                chat_log_segments = compacted.self_contained(chat_log_segments)
+
+            if not chat_log_segments:
+                print(f"❌ 「{talker_name}」的聊天记录切片失败或为空，跳过此群聊。")
+                logger.warning(f"「{talker_name}」的聊天记录未能切分出任何片段，跳过。")
+                return reports_info
+
+            manifest.mark_talker(talker_name, 'segmented', segment_files=[
+                manifest.write_checkpoint(talker_name, f"segment_{segment_index + 1}.txt", chat_segment)
+                for segment_index, chat_segment in enumerate(chat_log_segments)
+            ])
+            print(f"✅ 「{talker_name}」的聊天记录被切分为 {len(chat_log_segments)} 个片段进行处理。")
+
+        segment_executor = run_context['segment_executor']
+
+        # map-reduce 模式：多个片段先分别浓缩为中间摘要，再合并生成一份日报，而不是每个片段各生成一份
+        summary_mode = talker_config.get('summary_mode', CHAT_DEMO_CFG.get('summary_mode', 'per_segment'))
+        if summary_mode == 'map_reduce' and len(chat_log_segments) > 1:
+            print(f"🗜️ 「{talker_name}」使用map-reduce模式: 先浓缩 {len(chat_log_segments)} 个片段，再合并生成一份日报")
+            _, talker_artifacts = manifest.talker_state(talker_name)
+            if talker_artifacts.get('summary_files'):
+                summaries = [manifest.read_checkpoint(path) for path in talker_artifacts['summary_files']]
+                print(f"♻️ 「{talker_name}」的片段摘要已在之前的运行中生成，直接复用")
+            else:
+                if segment_executor is None:
+                    summaries = [summarize_segment_with_gemini(segment_index, chat_segment, len(chat_log_segments),
+                                                               talker_name, run_context)
+                                 for segment_index, chat_segment in enumerate(chat_log_segments)]
+                else:
+                    summary_futures = [
+                        segment_executor.submit(summarize_segment_with_gemini, segment_index, chat_segment,
+                                                len(chat_log_segments), talker_name, run_context)
+                        for segment_index, chat_segment in enumerate(chat_log_segments)
+                    ]
+                    summaries = [future.result() for future in summary_futures]
+                manifest.mark_talker(talker_name, 'segmented', summary_files=[
+                    manifest.write_checkpoint(talker_name, f"summary_{segment_index + 1}.txt", summary)
+                    for segment_index, summary in enumerate(summaries)
+                ])
+            merged_summaries = merge_segment_summaries(summaries)
+            print(f"✅ 「{talker_name}」的 {len(summaries)} 段摘要已合并: {len(merged_summaries)}字符")
+            report_info = process_segment(0, merged_summaries, 1, talker_name, talker_config, prompt_template, run_context)
+            if report_info:
+                reports_info.append(report_info)
+        elif segment_executor is None or len(chat_log_segments) == 1:
+            # 多个片段时PNG在所有片段生成后统一交给浏览器池并行渲染
+            defer_png = len(chat_log_segments) > 1
+            for segment_index, chat_segment in enumerate(chat_log_segments):
+                # 与并发模式一致：某个片段失败不影响其它片段
+                try:
+                    report_info = process_segment(segment_index, chat_segment, len(chat_log_segments),
+                                                  talker_name, talker_config, prompt_template, run_context,
+                                                  defer_png=defer_png)
+                    if report_info:
+                        reports_info.append(report_info)
+                except Exception as e:
+                    print(f"\n❌ 处理「{talker_name}」片段 {segment_index + 1} 时出错: {str(e)}")
+                    logger.error(f"处理「{talker_name}」片段 {segment_index + 1} 时出错: {str(e)}")
+            render_pending_pngs(talker_name, reports_info, manifest)
+        else:
+            segment_futures = [
+                segment_executor.submit(process_segment, segment_index, chat_segment, len(chat_log_segments),
+                                        talker_name, talker_config, prompt_template, run_context, defer_png=True)
+                for segment_index, chat_segment in enumerate(chat_log_segments)
+            ]
+            # 按片段顺序收集结果；某个片段失败不影响其它片段
+            for segment_index, future in enumerate(segment_futures):
+                try:
+                    report_info = future.result()
+                    if report_info:
+                        reports_info.append(report_info)
+                except Exception as e:
+                    print(f"\n❌ 处理「{talker_name}」片段 {segment_index + 1} 时出错: {str(e)}")
+                    logger.error(f"处理「{talker_name}」片段 {segment_index + 1} 时出错: {str(e)}")
+            render_pending_pngs(talker_name, reports_info, manifest)
+    except Exception as e:
+        print(f"\n❌ 处理「{talker_name}」时出错 (在片段处理中或之前): {str(e)}")
+        logger.error(f"处理「{talker_name}」时出错: {str(e)}")
+    # 输出该群聊的Gemini调用重试次数和等待时间
+    get_retry_stats().log_talker(talker_name)
+    return reports_info
+
 
+def main():
     """主函数"""
+    # 先解析命令行参数：--help 或参数错误时直接退出，不检查网络、不创建日志文件
+    args = parse_arguments()
+    setup_logging()
+
+    # 检查海外网络、启动数据服务、连接AI服务、加载日报模板互不依赖，提交到后台同时执行，第一次用到结果时再等待
+    timeline = StartupTimeline()
+    set_proxy_env()  # 代理环境变量需在其他联网阶段开始前设置好
+    timeline.start(PHASE_OVERSEA_CONN, check_oversea_conn)
+    # 手动GUI解密时数据服务阶段会弹出tkinter对话框，必须在主线程执行，稍后再运行
+    chatlog_on_main_thread = CHAT_DEMO_CFG.get('manual_gui_auto_decryption', False)
+    if not chatlog_on_main_thread:
+        timeline.start(PHASE_CHATLOG, run_chatlog_commands)
+    timeline.start(PHASE_PROMPT, read_prompt_template, args.prompt_path)
+
     server_process = None
+    model_router = None
 
     try:
-        # 解析命令行参数
-        args = parse_arguments()
-
         print("-" * 50)
         print("🚀 微信群聊日报生成工具已启动")
 
         # 尝试从配置文件加载配置
         config = load_config_from_json()
 
+        # 检查API密钥
+        if not args.api_key:
+            args.api_key = config.get(
+                'api_key') or os.environ.get('GEMINI_API_KEY')
+            if not args.api_key:
+                raise ValueError(
+                    "必须提供Gemini API密钥，可通过--api-key参数、cfg.py配置文件或GEMINI_API_KEY环境变量设置")
+        timeline.start(PHASE_GEMINI, init_gemini_api, args.api_key, refresh_models=args.refresh_models)
+        print("⏳ 后台启动中: 数据服务、AI服务、日报模板...")
+
         # 获取talkers列表
         talkers = []
         if args.talker:
@@ -1077,220 +1919,88 @@ def main():
             print(f"📅 时间范围: 近 {args.days} 天")
             if args.days > 1:
                 if not args.auto_mode:
+                    from tkinter import messagebox  # 弹窗，用于提示
+
                     messagebox.showinfo("友情提示", f"您的请求天数大于1（为{args.days}天），数据量较多的情况下，有可能日报会分为多个part输出")
                 else:
                     logger.info("自动模式：跳过用户交互:友情提示...，继续执行...")
         print("-" * 50)
 
-        # 检查API密钥
-        if not args.api_key:
-            args.api_key = config.get(
-                'api_key') or os.environ.get('GEMINI_API_KEY')
-            if not args.api_key:
-                raise ValueError(
-                    "必须提供Gemini API密钥，可通过--api-key参数、cfg.py配置文件或GEMINI_API_KEY环境变量设置")
-
-        print("⏳ 启动数据服务中...")
         # 运行chatlog命令
-        server_process = run_chatlog_commands()
-        print("✅ 数据服务已启动")
+        if chatlog_on_main_thread:
+            print("⏳ 启动数据服务中...")
+            server_process = timeline.run(PHASE_CHATLOG, run_chatlog_commands)
+        else:
+            server_process = timeline.join(PHASE_CHATLOG)
+        print(f"✅ 数据服务已启动 (耗时 {timeline.duration(PHASE_CHATLOG):.2f} 秒)")
 
         # 初始化Gemini API
-        print("⏳ 连接AI服务中...")
-        model, model_name, model_input_token_limit, model_output_token_limit, tpm_limit = init_gemini_api(args.api_key)
-        print(f"✅ AI服务连接成功 (模型: {model_name}, 输入限制: {model_input_token_limit} tokens, 输出限制: {model_output_token_limit} tokens, TPM限制: {tpm_limit} tokens/min)")
+        model_router = timeline.join(PHASE_GEMINI)
+        connect_seconds = timeline.duration(PHASE_GEMINI)
+        logger.info(f"连接AI服务耗时: {connect_seconds:.2f} 秒")
+        # 主模型（配置中第一个可用的模型）用于切分聊天记录和计算Token数
+        primary_route = model_router.primary
+        model, model_name = primary_route.model, primary_route.name
+        model_input_token_limit, tpm_limit = primary_route.input_token_limit, primary_route.tpm_limit
+        print(f"✅ AI服务连接成功 (模型: {model_name}, 输入限制: {model_input_token_limit} tokens, 输出限制: {primary_route.output_token_limit} tokens, TPM限制: {tpm_limit} tokens/min, 耗时 {connect_seconds:.2f} 秒)")
+        if len(model_router.routes) > 1:
+            print(f"🔀 多模型路由: {' → '.join(route.name for route in model_router.routes)}（配额用尽或不可用时自动切换）")
 
         # 读取Prompt模板
-        print("⏳ 正在加载日报模板...")
-        prompt_template = read_prompt_template(args.prompt_path)
+        prompt_template = timeline.join(PHASE_PROMPT)
         print("✅ 模板加载完成")
 
-        # 初始化TPM控制所需的状态变量
-        last_request_state = {
-            'start_time': None,  # 上一次请求的开始时间戳
-            'tokens': 0  # 上一次请求的token数
+        # 网络检查只输出诊断信息，但失败时与原来一样终止运行
+        timeline.join(PHASE_OVERSEA_CONN)
+
+        # 每个模型各有一个TPM/RPM滑动窗口限流器（所有并发请求共享）
+        rate_limiter = primary_route.rate_limiter
+
+        # 并发度：同时处理的群聊数，以及同时生成的片段数
+        max_concurrency = max(1, int(config.get('max_concurrency', 1)))
+        if max_concurrency > 1:
+            logger.info(f"并发模式已开启，最大并发数: {max_concurrency}")
+            print(f"⚡ 并发模式: 最多同时处理 {max_concurrency} 个群聊/片段")
+
+        # 运行清单：记录每个群聊/片段完成到的阶段，--resume 时只执行未完成的阶段
+        manifest = RunManifest.open(args.output_dir, resume=args.resume)
+        manifest.set_params(days=args.days, start_date=args.start_date, end_date=args.end_date)
+        if args.resume:
+            print(f"♻️ 续跑模式: 已完成的阶段将直接复用 ({manifest.path})")
+
+        run_context = {
+            'args': args,
+            'model': model,
+            'model_input_token_limit': model_input_token_limit,
+            'tpm_limit': tpm_limit,
+            'rate_limiter': rate_limiter,
+            'model_router': model_router,
+            'prompt_template': prompt_template,
+            'talkers_count': len(talkers),
+            'segment_executor': None,
+            'manifest': manifest,
+            'startup_timeline': timeline,
         }
 
         # 创建一个列表来存储所有群日报的信息
         all_reports_info = []
 
         # 处理每个talker
-        for talker_index, talker_config in enumerate(talkers):
-            try:
-                # 获取talker名称
-                talker_name = talker_config['name']
-                print(f"\n--- 开始处理 「{talker_name}」 ({talker_index + 1}/{len(talkers)}) ---")
-
-                # 获取聊天记录
-                print(f"⏳ 正在获取「{talker_name}」的聊天记录...")
-                full_chat_logs = get_chat_logs(
-                    talker_name,
-                    args.days,
-                    args.start_date,
-                    args.end_date,
-                )
-
-                if not full_chat_logs:
-                    print(f"❌ 未获取到「{talker_name}」的聊天记录，请检查群名称是否正确或时间范围内是否有消息")
-                    logger.warning(f"未获取到「{talker_name}」的聊天记录，跳过。")
-                    continue
-                print(f"✅ 成功获取「{talker_name}」的完整聊天记录: {len(full_chat_logs)}字符")
-
-                # 获取talker个性化的prompt模板路径
-                talker_prompt_path = talker_config.get('prompt_template_path', args.prompt_path)
-                # 如果talker配置了自己的prompt模板，则使用它
-                if talker_prompt_path != args.prompt_path:
-                    print(f"⏳ 正在加载「{talker_name}」的个性化日报模板...")
-                    prompt_template = read_prompt_template(talker_prompt_path)
-                    print(f"✅ 「{talker_name}」的个性化模板加载完成")
-
-                # 确定基础Prompt的固定部分内容，用于计算token
-                # 注意：这里的 chat_logs 参数用一个简短的占位符，或者为空字符串，
-                # 因为我们只关心模板和其他固定文本的token数。
-                # 关键是这里的结构要和 build_complete_prompt 函数内实际拼接时保持一致。
-                base_prompt_fixed_parts_text = f"""你好，此处的txt为我的【群日报生成要求prompt】，另一外一份txt为我的【群聊记录】。
-
-                    请你根据最新的群聊记录，按照prompt要求，生成一份群日报。要求仅返回html，不要返回其他内容。
-                    
-                    【群聊名称】：
-                    {talker_name}
-                    
-                    【群日报生成要求prompt】：
-                    {prompt_template}
-                    
-                    【群聊记录】：
-                    
-                    
-                    谢谢
-                    """
-
-                # 切分聊天记录
-                print(f"⏳ 正在为「{talker_name}」的聊天记录按Token数切片...")
-                chat_log_segments = split_chat_logs_into_segments(
-                    model,
-                    base_prompt_fixed_parts_text,
-                    full_chat_logs,
-                    model_input_token_limit,
-                    tpm_limit
-                )
-
-                if not chat_log_segments:
-                    print(f"❌ 「{talker_name}」的聊天记录切片失败或为空，跳过此群聊。")
-                    logger.warning(f"「{talker_name}」的聊天记录未能切分出任何片段，跳过。")
-                    continue
-
-                print(f"✅ 「{talker_name}」的聊天记录被切分为 {len(chat_log_segments)} 个片段进行处理。")
-
-                for segment_index, chat_segment in enumerate(chat_log_segments):
-                    segment_display_name = f"{talker_name} (片段 {segment_index + 1}/{len(chat_log_segments)})"
-                    print(f"\n  --- 开始处理 「{segment_display_name}」 ---")
-
-                    if not chat_segment.strip():
-                        print(f"⚪ 「{segment_display_name}」内容为空，跳过此片段。")
-                        logger.info(f"「{segment_display_name}」内容为空，跳过。")
-                        continue
-
-                    # 构建完整的Prompt
-                    print(f"  ⏳ 正在为「{segment_display_name}」准备AI分析数据...")
-                    complete_prompt = build_complete_prompt(
-                        prompt_template, chat_segment,  # 使用切分后的片段
-                        talker=talker_name,
-                    )
-                    print(f"  ✅ 「{segment_display_name}」分析数据准备完成 (Prompt长度: {len(complete_prompt)}字符)")
-
-                    # 使用Gemini生成HTML
-                    print(f"  ⏳ 「{segment_display_name}」开始AI分析并生成日报...")
-                    html_content = generate_html_with_gemini(
-                        model,
-                        complete_prompt,
-                        tpm_limit,  # 新增TPM限制参数
-                        last_request_state  # 新增请求状态参数 (会被修改)
-                    )
-
-                    # 获取talker个性化配置，如果没有则使用全局配置
-                    auto_generate_png = talker_config.get('auto_generate_png', CHAT_DEMO_CFG.get('auto_generate_png', False))
-                    auto_generate_url = talker_config.get('auto_generate_url', CHAT_DEMO_CFG.get('auto_generate_url', False))
-                    url_requires_password = talker_config.get('url_requires_password', CHAT_DEMO_CFG.get('url_requires_password', False))
-                    # 获取相关链接配置
-                    related_link = talker_config.get('related_link', None)
-                    
-                    # 保存HTML文件，如果多片段，文件名包含片段号
-                    print(f"  ⏳ 正在为「{segment_display_name}」保存日报文件...")
-                    file_suffix = f"_part_{segment_index + 1}" if len(chat_log_segments) > 1 else ""
-                    output_filename_base = f"{talker_name}{file_suffix}"
-
-                    html_filepath = save_html(
-                        html_content, args.output_dir, output_filename_base, related_link)
-                    print(f"  ✅ 「{segment_display_name}」日报已保存至: {html_filepath}")
-
-                    # 初始化变量
-                    png_filepath = None
-                    html_url = None
-                    
-                    # 将HTML转换为PNG图片
-                    if auto_generate_png:
-                        png_filepath = html_to_png(html_filepath)
-                        if png_filepath:
-                            print(f"✅ PNG图片已保存至: {png_filepath}")
-                        else:
-                            print("❌ PNG图片生成失败，请检查日志")
-
-                    # 将HTML发布到托管服务器（前提部署了html托管服务）
-                    if auto_generate_url:
-                        # 获取边缘托管地址
-                        hosting_address = CHAT_DEMO_CFG.get(
-                            'website_hosting_address', "http://localhost:8888")
-                        
-                        # 读取已保存的HTML文件内容（包含footer）
-                        with open(html_filepath, 'r', encoding='utf-8') as file:
-                            html_content_with_footer = file.read()
-                        
-                        # 使用包含footer的HTML内容上传
-                        html_url = upload_html_to_server(html_content_with_footer,
-                                                         url_requires_password,
-                                                         hosting_address)
-                        if html_url:
-                            print(f"✅ URL已生成: {html_url}")
-                        else:
-                            print("❌ URL生成失败，请检查日志")
-                    
-                    # 收集当前群日报的信息
-                    report_info = {
-                        'talker': talker_name,
-                        'html_filepath': html_filepath,
-                        'html_url': html_url,
-                        'png_filepath': png_filepath,
-                        'auto_send_to_wechat': talker_config.get('auto_send_to_wechat', CHAT_DEMO_CFG.get('auto_send_to_wechat', False)),
-                        'wechat_message_prefix': talker_config.get('wechat_message_prefix', CHAT_DEMO_CFG.get('wechat_message_prefix', "今日群日报已生成：")),
-                        'auto_sync_to_feishu': talker_config.get('auto_sync_to_feishu', CHAT_DEMO_CFG.get('auto_sync_to_feishu', False)),
-                        'related_link': related_link
-                    }
-                    all_reports_info.append(report_info)
-
-                    # 如果需要，在浏览器中打开HTML
-                    open_browser = CHAT_DEMO_CFG.get('auto_open_browser', False)
-                    if open_browser and html_filepath:
-                        # 如果发布成功且配置了 URL，则打开 URL
-                        if html_url:
-                            print(
-                                f"  ⏳ 正在为「{segment_display_name}」打开URL...")
-                            webbrowser.open(html_url)
-                            print(
-                                f"  ✅ 已在浏览器中打开「{segment_display_name}」的日报")
-                        else:
-                          # 如果指定了，在浏览器中打开HTML文件
-                            print(
-                                f"  ⏳ 正在为「{segment_display_name}」打开浏览器...")
-                            webbrowser.open(
-                                f"file://{os.path.abspath(html_filepath)}")
-                            print(
-                                f"  ✅ 已在浏览器中打开「{segment_display_name}」的日报")
-
-                    print(f"  --- 「{segment_display_name}」处理完成 ---")
-            except Exception as e:
-                print(f"\n❌ 处理「{talker_name}」时出错 (在片段处理中或之前): {str(e)}")
-                logger.error(f"处理「{talker_name}」时出错: {str(e)}")
-                continue
+        if max_concurrency == 1:
+            for talker_index, talker_config in enumerate(talkers):
+                all_reports_info.extend(process_talker(talker_index, talker_config, run_context))
+        else:
+            # 群聊与片段使用两个独立的线程池，避免群聊任务等待片段任务时占满线程导致死锁
+            with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='talker') as talker_executor, \
+                    ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='segment') as segment_executor:
+                run_context['segment_executor'] = segment_executor
+                talker_futures = [
+                    talker_executor.submit(process_talker, talker_index, talker_config, run_context)
+                    for talker_index, talker_config in enumerate(talkers)
+                ]
+                # 按群聊原有顺序收集结果，保证汇总顺序与串行模式一致
+                for future in talker_futures:
+                    all_reports_info.extend(future.result())
 
         # 所有群日报处理完成后，保存统一的URL记录文件
         if all_reports_info:
@@ -1310,6 +2020,9 @@ def main():
                 success_count = 0
                 # 筛选需要发送到微信的报告
                 valid_reports = [r for r in all_reports_info if r.get('html_url') and r.get('talker') and r.get('auto_send_to_wechat', False)]
+                # 续跑时跳过已经发送过的群日报
+                valid_reports = [r for r in valid_reports
+                                 if not manifest.segment_state(r['talker'], r['segment_index'])[1].get('wechat_sent')]
                 
                 if not valid_reports:
                     print("没有需要发送到微信的群日报，跳过微信发送步骤。")
@@ -1323,6 +2036,7 @@ def main():
                         print(f"⏳ 正在向群聊 '{talker}' 发送URL...")
                         if send_url_to_wechat_group(talker, url, message_prefix):
                             success_count += 1
+                            manifest.mark_segment(talker, report['segment_index'], 'sent', wechat_sent=True)
                             print(f"✅ 成功向群聊 '{talker}' 发送URL")
                         else:
                             print(f"❌ 向群聊 '{talker}' 发送URL失败")
@@ -1346,12 +2060,17 @@ def main():
                 
                 # 筛选需要同步到飞书的报告
                 feishu_reports = [r for r in all_reports_info if r.get('auto_sync_to_feishu', False)]
+                # 续跑时跳过已经同步过的群日报
+                feishu_reports = [r for r in feishu_reports
+                                  if not manifest.segment_state(r['talker'], r['segment_index'])[1].get('feishu_synced')]
                 
                 if not feishu_reports:
                     print("没有需要同步到飞书的群日报，跳过飞书同步步骤。")
                 else:
                     # 批量发送URL到飞书
                     result = send_urls_to_feishu_batch(feishu_reports)
+                    for report in result.get('succeeded', []):
+                        manifest.mark_segment(report['talker'], report['segment_index'], 'synced', feishu_synced=True)
                     
                     if result['success'] > 0:
                         print(f"✅ 成功同步 {result['success']}/{result['total']} 个URL到飞书多维表格")
@@ -1373,6 +2092,7 @@ def main():
 
     except KeyboardInterrupt:
         print("\n❌ 用户中断处理")
+        print("💡 使用 --resume 重新运行，可跳过已完成的群聊和阶段，从中断处继续")
         logger.info("用户中断处理")
     except Exception as e:
         print(f"\n❌ 处理出错: {str(e)}")
@@ -1380,6 +2100,27 @@ def main():
         sys.exit(1)
 
     finally:
+        # 输出HTTP连接复用统计
+        from http_session import log_http_session_stats
+
+        log_http_session_stats()
+
+        # 关闭浏览器池中的所有浏览器，并输出渲染统计
+        shutdown_browser_pool()
+
+        # 删除本次运行创建的上下文缓存，并输出统计
+        shutdown_context_cache()
+
+        # 输出各模型的请求和失败次数
+        if model_router is not None:
+            model_router.log_stats()
+
+        # 等待仍在执行的启动阶段结束（其他阶段失败时，数据服务可能已在后台启动），并输出启动时间线
+        timeline.shutdown()
+        if server_process is None:
+            server_process = timeline.result_if_done(PHASE_CHATLOG)
+        timeline.log()
+
         # 确保关闭chatlog服务器，如果是我们启动的
         if server_process:
             print("⏳ 正在关闭数据服务...")
@@ -0,0 +1,177 @@
+'''
+内容寻址的文件缓存
+
+功能描述:
+按内容摘要（如SHA256）把文件保存在缓存目录中，命中时通过硬链接（不支持时复制）放到目标路径，
+读取时更新文件的修改时间，据此按"超过保留天数"和"总大小超过上限时淘汰最久未使用"两种规则清理。
+写入先写临时文件再原子替换，多线程、多进程同时写同一个键也不会产生半个文件。
+
+缓存目录结构:
+    <cache_dir>/<键的前两位>/<键><后缀>
+
+使用方法:
+1. cache = DiskFileCache(cache_dir, suffix='.png', max_bytes=200 * 1024 * 1024, max_age_days=30)
+2. cache.materialize(key, dest_path) 命中时放到目标路径并返回True
+3. cache.put_file(key, src_path) / cache.put_bytes(key, data)
+4. cache.evict() 按保留天数和总大小清理
+'''
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+from threading import Lock
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+def sha256_hexdigest(*parts):
+    """计算若干字节串/字符串拼接后的SHA256摘要（各部分之间以\\0分隔）"""
+    digest = hashlib.sha256()
+    for i, part in enumerate(parts):
+        if i:
+            digest.update(b'\0')
+        digest.update(part.encode('utf-8') if isinstance(part, str) else part)
+    return digest.hexdigest()
+
+
+class DiskFileCache:
+    """
+    内容寻址的文件缓存，线程安全
+    """
+
+    def __init__(self, cache_dir, suffix='', max_bytes=None, max_age_days=None):
+        """
+        初始化缓存
+
+        参数:
+            cache_dir (str): 缓存目录
+            suffix (str): 缓存文件的后缀，如 '.png'
+            max_bytes (int): 缓存总大小上限（字节），None表示不限制
+            max_age_days (float): 超过多少天未使用的文件被清理，None表示不限制
+        """
+        self.cache_dir = cache_dir
+        self.suffix = suffix
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+
+    def path_for(self, key):
+        """键对应的缓存文件路径"""
+        return os.path.join(self.cache_dir, key[:2], key + self.suffix)
+
+    def get_path(self, key):
+        """
+        查找缓存文件
+
+        返回:
+            str: 命中时返回缓存文件路径（并更新其使用时间），否则返回None
+        """
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def materialize(self, key, dest_path):
+        """
+        命中时把缓存文件放到目标路径：优先硬链接，跨文件系统等不支持时复制
+
+        返回:
+            bool: 是否命中
+        """
+        path = self.get_path(key)
+        if path is None:
+            return False
+        if os.path.lexists(dest_path):
+            os.remove(dest_path)
+        try:
+            os.link(path, dest_path)
+        except OSError:
+            shutil.copyfile(path, dest_path)
+        return True
+
+    def read_bytes(self, key):
+        """命中时返回缓存文件内容，否则返回None"""
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_atomic(self, key, write):
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return path
+
+    def put_file(self, key, src_path):
+        """把文件复制到缓存中，返回缓存文件路径"""
+        def write(f):
+            with open(src_path, 'rb') as src:
+                shutil.copyfileobj(src, f)
+        return self._write_atomic(key, write)
+
+    def put_bytes(self, key, data):
+        """把字节串写入缓存，返回缓存文件路径"""
+        return self._write_atomic(key, lambda f: f.write(data))
+
+    def evict(self):
+        """
+        清理缓存：先删除超过保留天数的文件，再按最久未使用的顺序删除直到总大小不超过上限
+
+        返回:
+            tuple: (删除的文件数, 释放的字节数)
+        """
+        if not os.path.isdir(self.cache_dir):
+            return 0, 0
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        now = time.time()
+        removed_files = 0
+        removed_bytes = 0
+        total_bytes = sum(size for _, size, _ in entries)
+        for mtime, size, path in sorted(entries):
+            expired = self.max_age_days is not None and now - mtime > self.max_age_days * 86400
+            oversize = self.max_bytes is not None and total_bytes > self.max_bytes
+            if not expired and not oversize:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            removed_files += 1
+            removed_bytes += size
+            total_bytes -= size
+        if removed_files:
+            logger.info(f"缓存清理 {self.cache_dir}: 删除 {removed_files} 个文件, 释放 {removed_bytes / 1024 / 1024:.1f} MB")
+        return removed_files, removed_bytes
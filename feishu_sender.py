@@ -13,7 +13,6 @@
 pip install requests
 '''
 
-import requests
 import json
 import uuid
 from datetime import datetime
@@ -21,6 +20,7 @@ import logging
 
 # 导入令牌管理器
 from feishu_token_manager import FeishuTokenManager
+from http_session import get_http_session
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -101,7 +101,7 @@ def send_url_to_feishu(group_name, url, app_token=None, table_id=None, auth_toke
         })
         
         # 发送POST请求
-        response = requests.request("POST", api_url, headers=headers, data=payload)
+        response = get_http_session().request("POST", api_url, headers=headers, data=payload)
         response_json = response.json() if response.text else {}
         
         # 检查响应状态
@@ -131,11 +131,12 @@ def send_urls_to_feishu_batch(reports_info):
         reports_info (list): 包含群日报信息的列表，每个元素是一个字典，包含群名称和URL
     
     返回:
-        dict: 包含成功和失败数量的字典
+        dict: 包含成功和失败数量的字典，succeeded 为同步成功的报告列表
     """
     try:
         success_count = 0
         failed_count = 0
+        succeeded_reports = []
         
         # 预先获取一次令牌，避免每次调用都获取
         auth_token = token_manager.get_tenant_access_token()
@@ -152,17 +153,20 @@ def send_urls_to_feishu_batch(reports_info):
             
             if send_url_to_feishu(talker, url, auth_token=auth_token):
                 success_count += 1
+                succeeded_reports.append(report)
             else:
                 # 如果失败，尝试不传递auth_token，让函数内部重新获取
                 if send_url_to_feishu(talker, url):
                     success_count += 1
+                    succeeded_reports.append(report)
                 else:
                     failed_count += 1
                 
         result = {
             'total': len(valid_reports),
             'success': success_count,
-            'failed': failed_count
+            'failed': failed_count,
+            'succeeded': succeeded_reports
         }
         
         logger.info(f"飞书同步结果: 总计 {result['total']}, 成功 {result['success']}, 失败 {result['failed']}")
@@ -14,7 +14,6 @@
 pip install requests
 '''
 
-import requests
 import json
 import time
 import logging
@@ -22,6 +21,8 @@ import os
 from datetime import datetime, timedelta
 from threading import Lock
 
+from http_session import get_http_session
+
 # 配置日志
 logger = logging.getLogger(__name__)
 
@@ -109,7 +110,7 @@ class FeishuTokenManager:
                     "app_secret": self.app_secret
                 }
                 
-                response = requests.post(url, headers=headers, data=json.dumps(data))
+                response = get_http_session().post(url, headers=headers, data=json.dumps(data))
                 result = response.json()
                 
                 if response.status_code == 200 and result.get("code") == 0:
@@ -190,7 +191,7 @@ class FeishuTokenManager:
                 "app_secret": self.app_secret
             }
             
-            response = requests.post(url, headers=headers, data=json.dumps(data))
+            response = get_http_session().post(url, headers=headers, data=json.dumps(data))
             result = response.json()
             
             if response.status_code == 200 and result.get("code") == 0:
@@ -231,7 +232,7 @@ class FeishuTokenManager:
                 "app_secret": self.app_secret
             }
             
-            response = requests.post(url, headers=headers, data=json.dumps(data))
+            response = get_http_session().post(url, headers=headers, data=json.dumps(data))
             result = response.json()
             
             if response.status_code == 200 and result.get("code") == 0:
@@ -0,0 +1,159 @@
+'''
+共享HTTP会话工具
+
+功能描述:
+为 chatlog 服务器、网页托管服务和飞书API提供同一个 requests.Session：
+- 按主机复用连接池，保持 keep-alive，避免每次请求都重新建立TCP/TLS连接；
+- 传输层自动重试（仅限 GET/HEAD 等幂等请求），带指数退避，并遵循 Retry-After；
+- 默认声明 gzip/deflate 压缩；
+- 所有请求都有超时，调用方未指定时使用默认超时，避免请求无限挂起；
+- 运行结束时可输出各主机的连接复用统计。
+
+使用方法:
+1. session = get_http_session()
+2. session.get(url) / session.post(url, json=...)
+3. log_http_session_stats() 输出连接复用统计
+4. get_probe_session().get(url) 用于存活探测，失败时立即返回、不重试
+
+依赖安装:
+pip install requests
+'''
+
+import logging
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = (5, 30)  # (连接超时, 读取超时) 秒
+DEFAULT_POOL_MAXSIZE = 10
+PROBE_TIMEOUT = (2, 2)  # 存活探测的超时 (连接, 读取) 秒
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """调用方未指定超时时自动使用默认超时的 HTTPAdapter"""
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def create_http_session(timeout=DEFAULT_TIMEOUT, pool_maxsize=DEFAULT_POOL_MAXSIZE, retries=3, backoff_factor=0.5):
+    """
+    创建带连接池、重试和默认超时的会话
+
+    参数:
+        timeout (tuple): 默认超时 (连接, 读取)
+        pool_maxsize (int): 每个主机连接池的最大连接数
+        retries (int): 传输层最大重试次数
+        backoff_factor (float): 指数退避系数
+
+    返回:
+        requests.Session: 配置好的会话
+    """
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD', 'OPTIONS']),  # POST 不幂等，不在传输层重试
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = TimeoutHTTPAdapter(
+        timeout=timeout,
+        pool_connections=DEFAULT_POOL_MAXSIZE,
+        pool_maxsize=pool_maxsize,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive',
+    })
+    return session
+
+
+_session = None
+_probe_session = None
+_session_lock = Lock()
+
+
+def get_http_session():
+    """获取进程内共享的会话，连接池大小和超时从cfg.py读取"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            try:
+                from cfg import CHAT_DEMO_CFG
+            except ImportError:
+                CHAT_DEMO_CFG = {}
+            _session = create_http_session(
+                timeout=tuple(CHAT_DEMO_CFG.get('http_timeout', DEFAULT_TIMEOUT)),
+                pool_maxsize=max(DEFAULT_POOL_MAXSIZE, int(CHAT_DEMO_CFG.get('max_concurrency', 1)) * 2),
+                retries=CHAT_DEMO_CFG.get('http_retries', 3),
+            )
+        return _session
+
+
+def get_probe_session():
+    """
+    获取用于存活探测（如chatlog服务器是否已启动）的会话：不在传输层重试
+
+    探测由调用方自行轮询，连接被拒绝时应立即返回，而不是按退避重试数秒
+    """
+    global _probe_session
+    with _session_lock:
+        if _probe_session is None:
+            _probe_session = create_http_session(timeout=PROBE_TIMEOUT, pool_maxsize=1, retries=0)
+        return _probe_session
+
+
+def get_http_session_stats():
+    """
+    各主机的连接复用统计
+
+    返回:
+        list: 每个主机一个字典，包含 host、requests（请求数）、connections（新建连接数）
+    """
+    stats = []
+    if _session is None:
+        return stats
+    seen_adapters = set()
+    for adapter in _session.adapters.values():
+        if id(adapter) in seen_adapters:
+            continue
+        seen_adapters.add(id(adapter))
+        # 直连的连接池，以及经过代理（如 check_oversea_conn 设置的环境变量代理）的连接池
+        managers = [adapter.poolmanager] + list(adapter.proxy_manager.values())
+        for manager in managers:
+            for key in list(manager.pools.keys()):
+                pool = manager.pools.get(key)
+                if pool is None:
+                    continue
+                stats.append({
+                    'host': f"{pool.scheme}://{pool.host}:{pool.port}",
+                    'requests': pool.num_requests,
+                    'connections': pool.num_connections,
+                })
+    return stats
+
+
+def log_http_session_stats():
+    """在日志中输出连接复用统计"""
+    for item in get_http_session_stats():
+        reused = max(item['requests'] - item['connections'], 0)
+        logger.info(f"HTTP连接统计 {item['host']}: 请求 {item['requests']} 次, 新建连接 {item['connections']} 个, 复用 {reused} 次")
@@ -0,0 +1,79 @@
+'''
+大模型响应持久化缓存
+
+功能描述:
+以 (模型名称, 生成参数, 完整Prompt的SHA256) 为键，把提取后的HTML保存到 ./temp/llm_cache。
+生成之后的步骤（保存、PNG、上传、微信、飞书）失败后重新运行时，相同的Prompt直接读取缓存，
+不再调用模型，也不消耗Token额度。缓存按总大小上限淘汰最久未使用的条目。
+
+使用方法:
+1. cache = get_llm_response_cache()
+2. key = llm_cache_key(model_name, generation_config, prompt)
+3. html = cache.get_text(key)，未命中返回None
+4. cache.put_text(key, html)
+'''
+
+import json
+import logging
+import os
+from threading import Lock
+
+from disk_cache import DiskFileCache, sha256_hexdigest
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temp', 'llm_cache')
+DEFAULT_MAX_MB = 100
+
+
+def llm_cache_key(model_name, generation_config, prompt):
+    """
+    响应缓存的键
+
+    参数:
+        model_name (str): 模型名称
+        generation_config (dict): 生成参数
+        prompt (str): 完整的Prompt
+
+    返回:
+        str: SHA256摘要
+    """
+    return sha256_hexdigest(model_name, json.dumps(generation_config, sort_keys=True), prompt)
+
+
+class LLMResponseCache(DiskFileCache):
+    """
+    以文本形式读写的模型响应缓存
+    """
+
+    def get_text(self, key):
+        """命中时返回缓存的文本，否则返回None"""
+        data = self.read_bytes(key)
+        return data.decode('utf-8') if data is not None else None
+
+    def put_text(self, key, text):
+        """写入文本，并在超过大小上限时淘汰最久未使用的条目"""
+        self.put_bytes(key, text.encode('utf-8'))
+        self.evict()
+
+
+_cache = None
+_cache_lock = Lock()
+
+
+def get_llm_response_cache():
+    """获取进程内共享的响应缓存，缓存目录和大小上限从cfg.py读取"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            try:
+                from cfg import CHAT_DEMO_CFG
+            except ImportError:
+                CHAT_DEMO_CFG = {}
+            _cache = LLMResponseCache(
+                CHAT_DEMO_CFG.get('llm_cache_dir', DEFAULT_CACHE_DIR),
+                suffix='.html',
+                max_bytes=int(CHAT_DEMO_CFG.get('llm_cache_max_mb', DEFAULT_MAX_MB) * 1024 * 1024),
+            )
+        return _cache
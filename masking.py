@@ -0,0 +1,189 @@
+'''
+数据打码（多关键词单遍替换）
+
+功能描述:
+把 data_masking_rules 中的全部关键词一次性构建成前缀树，再编译为一个正则表达式，
+对文本只扫描一遍即可完成所有替换：
+- 最左最长匹配：同一位置上同时匹配 "小严同学" 和 "小严同学（goDog神走狗神）" 时取较长者，
+  与规则在配置中的先后顺序无关；
+- 扫描开销与规则数量基本无关，几千条昵称规则与几条规则耗时相当；
+- 支持流式处理任意切分的文本块，跨块的关键词同样能正确匹配；
+- 统计每条规则的命中次数。
+
+使用方法:
+1. masker = get_data_masker(CHAT_DEMO_CFG['data_masking_rules'])
+2. masked_text = masker.mask(text)
+   或流式: for masked in masker.mask_stream(chunks, stats): ...
+3. stats.hits 查看每条规则的命中次数
+'''
+
+import logging
+import re
+from collections import Counter
+from functools import lru_cache
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+_TERMINAL = ''  # 前缀树中标记关键词结尾的键（关键词不会包含空字符串）
+
+
+class MaskingStats:
+    """一次打码处理的统计"""
+
+    __slots__ = ('chars_in', 'chars_out', 'hits')
+
+    def __init__(self):
+        self.chars_in = 0
+        self.chars_out = 0
+        self.hits = Counter()
+
+
+def _build_trie(keywords):
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[_TERMINAL] = True
+    return trie
+
+
+def _trie_to_pattern(node):
+    """
+    把前缀树转换为正则表达式
+
+    每个节点的分支按下一个字符区分，同一位置最多只有一个分支能继续匹配；
+    关键词结尾处的后续部分用贪婪的 (?:...)? 包裹，优先尝试更长的关键词，失败时再回退到较短的关键词，
+    因此正则引擎找到的就是最左最长匹配。
+    """
+    branches = [re.escape(char) + _trie_to_pattern(child)
+                for char, child in sorted(node.items()) if char != _TERMINAL]
+    if not branches:
+        return ''
+    pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    if _TERMINAL in node:
+        pattern = '(?:' + pattern + ')?'
+    return pattern
+
+
+class DataMasker:
+    """
+    多关键词打码器，构建后可在多个线程中共享使用
+    """
+
+    def __init__(self, rules):
+        """
+        初始化打码器
+
+        参数:
+            rules (dict): 关键词 -> 替换文本
+        """
+        self.rules = {keyword: replacement for keyword, replacement in rules.items() if keyword}
+        self.max_keyword_len = max((len(keyword) for keyword in self.rules), default=0)
+        self._regex = re.compile(_trie_to_pattern(_build_trie(self.rules))) if self.rules else None
+
+    def _sub(self, text, stats, end=None):
+        """
+        替换 text 中起始位置在 end 之前的所有匹配
+
+        返回:
+            tuple: (替换后的文本, 已处理到的位置)
+        """
+        if end is None:
+            end = len(text)
+        parts = []
+        position = 0
+        for match in self._regex.finditer(text):
+            if match.start() >= end:
+                break
+            keyword = match.group()
+            parts.append(text[position:match.start()])
+            parts.append(self.rules[keyword])
+            position = match.end()
+            if stats is not None:
+                stats.hits[keyword] += 1
+        consumed = max(position, end)
+        parts.append(text[position:consumed])
+        return "".join(parts), consumed
+
+    def mask(self, text, stats=None):
+        """
+        对完整文本打码
+
+        参数:
+            text (str): 待处理文本
+            stats (MaskingStats): 可选，累计处理统计
+
+        返回:
+            str: 打码后的文本
+        """
+        if self._regex is None or not text:
+            masked = text
+        else:
+            masked, _ = self._sub(text, stats)
+        if stats is not None:
+            stats.chars_in += len(text)
+            stats.chars_out += len(masked)
+        return masked
+
+    def mask_stream(self, chunks, stats=None):
+        """
+        对流式文本打码
+
+        每块末尾不足一个最长关键词长度的部分暂不处理，与下一块拼接后再匹配，
+        保证跨块的关键词与整体处理的结果一致。
+
+        参数:
+            chunks (iterable): 文本块
+            stats (MaskingStats): 可选，累计处理统计
+
+        返回:
+            generator: 打码后的文本块
+        """
+        if self._regex is None:
+            for chunk in chunks:
+                yield self.mask(chunk, stats)
+            return
+
+        pending = ''
+        for chunk in chunks:
+            if stats is not None:
+                stats.chars_in += len(chunk)
+            text = pending + chunk
+            # 起始位置在 safe_end 之前的关键词一定完整地包含在 text 中，其匹配结果不会再变化
+            safe_end = len(text) - self.max_keyword_len + 1
+            if safe_end <= 0:
+                pending = text
+                continue
+            masked, consumed = self._sub(text, stats, safe_end)
+            pending = text[consumed:]
+            if masked:
+                if stats is not None:
+                    stats.chars_out += len(masked)
+                yield masked
+        if pending:
+            masked, _ = self._sub(pending, stats)
+            if stats is not None:
+                stats.chars_out += len(masked)
+            yield masked
+
+
+@lru_cache(maxsize=8)
+def _get_data_masker(rule_items):
+    masker = DataMasker(dict(rule_items))
+    logger.debug(f"已构建打码器: {len(masker.rules)} 条规则, 最长关键词 {masker.max_keyword_len} 字符")
+    return masker
+
+
+def get_data_masker(rules):
+    """获取规则集对应的打码器，相同的规则集只构建一次"""
+    return _get_data_masker(tuple(sorted(rules.items())))
+
+
+def format_hits(stats, limit=10):
+    """格式化命中次数最多的规则，用于日志"""
+    items = [f"{keyword}×{count}" for keyword, count in stats.hits.most_common(limit)]
+    if len(stats.hits) > limit:
+        items.append(f"等 {len(stats.hits)} 条")
+    return ", ".join(items) if items else "无命中"
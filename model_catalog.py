@@ -0,0 +1,162 @@
+'''
+Gemini 模型目录的本地缓存
+
+功能描述:
+初始化时需要知道配置的模型是否存在、支持哪些生成方法以及输入/输出Token上限，
+原先每次运行都要调用 genai.list_models() 遍历一遍海外接口的模型目录（分页请求，较慢）。
+本模块把用到的字段（名称、支持的方法、input_token_limit、output_token_limit）保存到本地JSON文件：
+- 缓存未过期: 直接读取，不联网；
+- 缓存已过期: 先使用旧的目录启动，同时在后台线程刷新，下次运行使用新目录；
+- 没有缓存、API Key变化或指定 --refresh-models: 同步获取并写入缓存。
+写入先写临时文件再原子替换。
+
+使用方法:
+1. catalog = ModelCatalog(genai.list_models, cache_path, ttl_sec, api_key)
+2. models = catalog.get(force_refresh=False)  # 模型名称 -> ModelInfo
+3. catalog.generate_models(models) 只保留支持 generateContent 的模型
+'''
+
+import json
+import logging
+import os
+import threading
+import time
+
+from disk_cache import sha256_hexdigest
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+DEFAULT_CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temp', 'model_catalog.json')
+DEFAULT_TTL_SEC = 24 * 3600
+CATALOG_VERSION = 1
+
+
+class ModelInfo:
+    """
+    模型目录中的一项（字段名与 genai.list_models() 返回的模型对象一致）
+    """
+
+    __slots__ = ('name', 'supported_generation_methods', 'input_token_limit', 'output_token_limit')
+
+    def __init__(self, name, supported_generation_methods=(), input_token_limit=None, output_token_limit=None):
+        self.name = name
+        self.supported_generation_methods = list(supported_generation_methods or ())
+        self.input_token_limit = input_token_limit
+        self.output_token_limit = output_token_limit
+
+    @classmethod
+    def from_model(cls, model):
+        return cls(model.name, getattr(model, 'supported_generation_methods', ()),
+                   getattr(model, 'input_token_limit', None), getattr(model, 'output_token_limit', None))
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+
+class ModelCatalog:
+    """
+    带有效期和后台刷新的模型目录缓存
+    """
+
+    def __init__(self, list_models, cache_path=DEFAULT_CATALOG_PATH, ttl_sec=DEFAULT_TTL_SEC, api_key=''):
+        """
+        参数:
+            list_models (callable): 获取模型目录的函数（genai.list_models）
+            cache_path (str): 缓存文件路径
+            ttl_sec (float): 缓存有效期（秒）
+            api_key (str): 当前使用的API Key，不同Key可用的模型可能不同，缓存中只保存其摘要
+        """
+        self.list_models = list_models
+        self.cache_path = cache_path
+        self.ttl_sec = ttl_sec
+        self.key_digest = sha256_hexdigest(api_key or '')[:16]
+        self._refresh_thread = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        读取缓存
+
+        返回:
+            tuple: (模型名称 -> ModelInfo, 获取时间戳)；没有可用的缓存时返回 (None, None)
+        """
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None, None
+        except Exception as e:
+            logger.warning(f"读取模型目录缓存失败: {str(e)}")
+            return None, None
+        if data.get('version') != CATALOG_VERSION or data.get('key_digest') != self.key_digest or not data.get('models'):
+            return None, None
+        models = {item['name']: ModelInfo(**item) for item in data['models']}
+        return models, data.get('fetched_at', 0)
+
+    def fetch(self):
+        """联网获取模型目录并写入缓存"""
+        start = time.perf_counter()
+        models = {model.name: ModelInfo.from_model(model) for model in self.list_models()}
+        logger.info(f"已获取模型目录: {len(models)} 个模型，耗时 {time.perf_counter() - start:.2f} 秒")
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+            tmp_path = f"{self.cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'version': CATALOG_VERSION,
+                    'key_digest': self.key_digest,
+                    'fetched_at': time.time(),
+                    'models': [info.to_dict() for info in models.values()],
+                }, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.cache_path)
+        except Exception as e:
+            logger.warning(f"保存模型目录缓存失败: {str(e)}")
+        return models
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return
+
+            def refresh():
+                try:
+                    self.fetch()
+                except Exception as e:
+                    logger.warning(f"后台刷新模型目录失败，继续使用缓存: {str(e)}")
+
+            self._refresh_thread = threading.Thread(target=refresh, name='model-catalog-refresh', daemon=True)
+            self._refresh_thread.start()
+
+    def wait_refresh(self, timeout=None):
+        """等待后台刷新结束（主要用于测试）"""
+        thread = self._refresh_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def get(self, force_refresh=False):
+        """
+        获取模型目录
+
+        参数:
+            force_refresh (bool): 忽略缓存，同步联网获取
+
+        返回:
+            dict: 模型名称 -> ModelInfo
+        """
+        if not force_refresh:
+            models, fetched_at = self.load()
+            if models is not None:
+                age = time.time() - fetched_at
+                if age > self.ttl_sec:
+                    logger.info(f"模型目录缓存已过期（{age / 3600:.1f} 小时前获取），本次先使用缓存，后台刷新")
+                    self._refresh_in_background()
+                else:
+                    logger.info(f"使用模型目录缓存: {len(models)} 个模型（{age / 3600:.1f} 小时前获取）")
+                return models
+        return self.fetch()
+
+    @staticmethod
+    def generate_models(models):
+        """只保留支持 generateContent 的模型"""
+        return {name: info for name, info in models.items() if 'generateContent' in info.supported_generation_methods}
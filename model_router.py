@@ -0,0 +1,224 @@
+'''
+多模型路由与故障切换
+
+功能描述:
+原先只使用一个写死的模型和它的TPM配置：该模型下线、配额用尽或服务不可用时，整次运行都会失败，
+吞吐量也被限制在单个模型的配额之内。本模块按 cfg.py 中的 gemini_models 列表管理多个模型，
+每个模型有自己的 TPM、RPM、输入/输出Token上限、相对速度和独立的滑动窗口限流器：
+- 选择模型: 按 Prompt Token数过滤放不下的模型，再依次优先选择
+  能满足目标生成时间的、当前窗口额度可以立即发送的、配置中排在前面的模型；
+  主模型的窗口额度用满时，请求会分流到其他模型，总吞吐量不再受单个模型配额限制；
+- 故障切换: 429限流、服务不可用等错误时该模型暂停一段时间（优先使用服务端的重试提示），
+  模型不存在/已下线时本次运行不再使用，之后的请求立即改用下一个可用模型。
+
+使用方法:
+1. router = build_model_router(CHAT_DEMO_CFG['gemini_models'], available_models, genai.GenerativeModel)
+2. route = router.select(prompt_tokens)，使用 route.model 和 route.rate_limiter 发送请求
+3. 失败时: router.report_failure(route, e, error_kind)；router.has_alternative(prompt_tokens) 判断能否立即换模型
+4. router.log_stats() 输出各模型的使用次数
+'''
+
+import logging
+import time
+from threading import Lock
+
+from rate_limiter import SlidingWindowRateLimiter, parse_retry_delay
+from retry_policy import ERROR_PERMANENT, ERROR_RATE_LIMIT, ERROR_TRANSIENT
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+DEFAULT_COOLDOWN_SEC = 60  # 限流且没有重试提示时模型暂停的秒数（一个TPM窗口）
+UNAVAILABLE_COOLDOWN_SEC = 30  # 服务不可用（503等）时模型暂停的秒数
+BASE_OUTPUT_TOKENS_PER_SEC = 100  # 相对速度为1.0的模型每秒大约输出的Token数，用于估算生成时间
+
+
+def _is_model_gone(error):
+    """模型不存在或已下线（换一个模型可以恢复的永久错误）"""
+    message = str(error).lower()
+    return (getattr(error, 'code', None) == 404 or type(error).__name__ == 'NotFound'
+            or ('not found' in message and 'model' in message) or 'deprecated' in message)
+
+
+class ModelRoute:
+    """
+    一个可用于生成的模型及其限制
+    """
+
+    def __init__(self, name, model, tpm_limit, rpm_limit=None, input_token_limit=None, output_token_limit=None,
+                 speed=1.0, rate_limiter=None):
+        """
+        参数:
+            name (str): 模型名称（如 models/gemini-2.0-flash）
+            model: 模型对象（genai.GenerativeModel）
+            tpm_limit (int): 每分钟Token数上限
+            rpm_limit (int): 每分钟请求数上限
+            input_token_limit (int): 单次请求的输入Token上限
+            output_token_limit (int): 单次请求的输出Token上限
+            speed (float): 相对速度，1.0为基准，越大生成越快
+            rate_limiter (SlidingWindowRateLimiter): 该模型的限流器，None时按 tpm/rpm 新建
+        """
+        self.name = name
+        self.model = model
+        self.tpm_limit = tpm_limit
+        self.rpm_limit = rpm_limit
+        self.input_token_limit = input_token_limit
+        self.output_token_limit = output_token_limit
+        self.speed = speed or 1.0
+        self.rate_limiter = rate_limiter or SlidingWindowRateLimiter(tpm_limit, rpm_limit, name=name)
+        self.cooldown_until = 0.0
+        self.disabled = False
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def max_prompt_tokens(self):
+        """单次请求最多可以发送的Prompt Token数（输入上限与TPM中较小的一个）"""
+        limits = [limit for limit in (self.input_token_limit, self.tpm_limit) if limit]
+        return min(limits) if limits else None
+
+    def fits(self, prompt_tokens):
+        return self.max_prompt_tokens is None or prompt_tokens <= self.max_prompt_tokens
+
+    def estimated_seconds(self, output_tokens):
+        """按相对速度估算生成 output_tokens 个Token需要的秒数"""
+        return output_tokens / (BASE_OUTPUT_TOKENS_PER_SEC * self.speed)
+
+    def available(self, now=None):
+        return not self.disabled and (now or time.time()) >= self.cooldown_until
+
+
+class ModelRouter:
+    """
+    在多个模型之间选择和故障切换（线程安全）
+    """
+
+    def __init__(self, routes, latency_target_sec=None, expected_output_tokens=None):
+        """
+        参数:
+            routes (list): ModelRoute 列表，排在前面的优先
+            latency_target_sec (float): 每份日报的目标生成时间（秒），None表示不考虑生成时间
+            expected_output_tokens (int): 估算生成时间时假设的输出Token数
+        """
+        if not routes:
+            raise ValueError("至少需要配置一个可用的模型")
+        self.routes = list(routes)
+        self.latency_target_sec = latency_target_sec
+        self.expected_output_tokens = expected_output_tokens
+        self._lock = Lock()
+
+    @property
+    def primary(self):
+        """配置中的第一个模型（用于切分聊天记录和计算Token数）"""
+        return self.routes[0]
+
+    def _rank(self, route, prompt_tokens, now):
+        """排序键：越小越优先"""
+        too_slow = bool(self.latency_target_sec and self.expected_output_tokens and
+                        route.estimated_seconds(self.expected_output_tokens) > self.latency_target_sec)
+        must_wait = route.rate_limiter.estimate_wait(prompt_tokens) > 0
+        return too_slow, must_wait, self.routes.index(route)
+
+    def candidates(self, prompt_tokens):
+        """当前可用、且放得下 prompt_tokens 的模型，按优先顺序排列"""
+        now = time.time()
+        with self._lock:
+            routes = [route for route in self.routes if route.available(now) and route.fits(prompt_tokens)]
+        return sorted(routes, key=lambda route: self._rank(route, prompt_tokens, now))
+
+    def select(self, prompt_tokens):
+        """
+        为一次请求选择模型
+
+        返回:
+            ModelRoute: 选中的模型；没有可用模型时返回放得下该请求、最早结束暂停的模型（请求会在其限流器中等待）
+        """
+        routes = self.candidates(prompt_tokens)
+        if routes:
+            route = routes[0]
+        else:
+            with self._lock:
+                waiting = [r for r in self.routes if not r.disabled and r.fits(prompt_tokens)] or \
+                          [r for r in self.routes if not r.disabled] or self.routes
+                route = min(waiting, key=lambda r: r.cooldown_until)
+        with self._lock:
+            route.requests += 1
+        if route is not self.primary:
+            logger.info(f"本次请求使用模型 {route.name}（Prompt约 {prompt_tokens} tokens）")
+        return route
+
+    def has_alternative(self, prompt_tokens):
+        """是否有可以立即使用的模型"""
+        return bool(self.candidates(prompt_tokens))
+
+    def report_failure(self, route, error, error_kind):
+        """
+        记录模型调用失败：限流或服务不可用时暂停该模型，模型不存在时本次运行不再使用
+
+        返回:
+            bool: 该模型是否被暂停或停用（换模型可能恢复）
+        """
+        with self._lock:
+            route.failures += 1
+            if error_kind == ERROR_RATE_LIMIT:
+                cooldown = parse_retry_delay(error) or DEFAULT_COOLDOWN_SEC
+            elif error_kind == ERROR_TRANSIENT:
+                cooldown = UNAVAILABLE_COOLDOWN_SEC
+            elif error_kind == ERROR_PERMANENT and _is_model_gone(error):
+                route.disabled = True
+                logger.warning(f"模型 {route.name} 不存在或已下线，本次运行不再使用: {str(error)}")
+                return len(self.routes) > 1
+            else:
+                return False
+            route.cooldown_until = max(route.cooldown_until, time.time() + cooldown)
+        if len(self.routes) > 1:
+            logger.warning(f"模型 {route.name} 暂停 {cooldown:.0f} 秒（{error_kind}）")
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {route.name: {'requests': route.requests, 'failures': route.failures, 'disabled': route.disabled}
+                    for route in self.routes}
+
+    def log_stats(self):
+        for name, stats in self.stats().items():
+            if stats['requests'] or stats['failures']:
+                logger.info(f"模型 {name}: 请求 {stats['requests']} 次, 失败 {stats['failures']} 次"
+                            f"{'，已停用' if stats['disabled'] else ''}")
+
+
+def build_model_router(model_configs, available_models, model_factory, latency_target_sec=None,
+                       expected_output_tokens=None):
+    """
+    按配置创建模型路由
+
+    参数:
+        model_configs (list): cfg.py 的 gemini_models，每项包含 name、tpm、rpm，可选 input_token_limit、
+                              output_token_limit（默认使用服务端返回的上限）和 speed
+        available_models (dict): 模型名称 -> 服务端返回的模型信息（含 input_token_limit / output_token_limit）
+        model_factory (callable): 根据模型名称创建模型对象
+        latency_target_sec (float): 每份日报的目标生成时间（秒）
+        expected_output_tokens (int): 估算生成时间时假设的输出Token数
+
+    返回:
+        ModelRouter: 模型路由；配置的模型都不可用时返回None
+    """
+    routes = []
+    for config in model_configs:
+        name = config['name']
+        info = available_models.get(name)
+        if info is None:
+            logger.warning(f"配置的模型 {name} 未找到或不支持generateContent，跳过")
+            continue
+        routes.append(ModelRoute(
+            name,
+            model_factory(name),
+            tpm_limit=config.get('tpm'),
+            rpm_limit=config.get('rpm'),
+            input_token_limit=config.get('input_token_limit') or getattr(info, 'input_token_limit', None),
+            output_token_limit=config.get('output_token_limit') or getattr(info, 'output_token_limit', None),
+            speed=config.get('speed', 1.0),
+        ))
+    if not routes:
+        return None
+    return ModelRouter(routes, latency_target_sec=latency_target_sec, expected_output_tokens=expected_output_tokens)
@@ -0,0 +1,213 @@
+'''
+网页就绪判断、整页截图与渲染缓存
+
+功能描述:
+- 就绪判断：不再固定等待若干秒，而是依次等待 document.readyState 为 complete、
+  document.fonts.ready（网页字体加载完成）、图片加载完成以及网络空闲
+  （一段时间内没有新的资源请求完成），最后再等两帧让图表完成绘制；简单页面几乎无需等待。
+- 整页截图：通过 DevTools 协议读取页面实际尺寸并直接截取整页，不再调整窗口高度；
+  页面高度超过单次截图上限时分块截图，并用 Pillow 拼接为一张长图。
+- 渲染缓存：以最终HTML内容和视口等截图参数的SHA256为键缓存PNG，重复运行时相同的HTML直接复用。
+
+使用方法:
+1. wait_for_page_ready(driver)
+2. capture_full_page(driver, png_filepath)
+3. cache = get_render_cache(output_dir); key = render_cache_key(html_bytes, settings)
+
+依赖安装:
+pip install selenium
+pip install Pillow  # 可选，用于拼接超长页面的分块截图
+'''
+
+import base64
+import io
+import json
+import logging
+import math
+import os
+import time
+from threading import Lock
+
+from disk_cache import DiskFileCache, sha256_hexdigest
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+DEFAULT_READY_TIMEOUT_SEC = 15
+DEFAULT_NETWORK_IDLE_MS = 500
+DEFAULT_MAX_CAPTURE_HEIGHT = 16000  # Chrome 单次截图的高度上限约为16384像素
+RENDER_CACHE_VERSION = 1  # 截图方式变化时递增，使旧的缓存失效
+
+# 在页面内等待就绪信号，完成后回调 selenium 传入的 done
+_WAIT_READY_SCRIPT = '''
+const idleMs = arguments[0];
+const done = arguments[arguments.length - 1];
+const waitLoad = () => document.readyState === 'complete'
+    ? Promise.resolve()
+    : new Promise(resolve => window.addEventListener('load', resolve, {once: true}));
+const waitFonts = () => (document.fonts && document.fonts.ready) ? document.fonts.ready : Promise.resolve();
+const waitImages = () => Promise.all(Array.from(document.images)
+    .filter(img => !img.complete)
+    .map(img => new Promise(resolve => { img.onload = img.onerror = resolve; })));
+const waitNetworkIdle = () => new Promise(resolve => {
+    let count = performance.getEntriesByType('resource').length;
+    let lastChange = performance.now();
+    const check = () => {
+        const current = performance.getEntriesByType('resource').length;
+        if (current !== count) {
+            count = current;
+            lastChange = performance.now();
+        }
+        if (performance.now() - lastChange >= idleMs) {
+            resolve();
+        } else {
+            setTimeout(check, 50);
+        }
+    };
+    check();
+});
+const waitFrames = () => new Promise(resolve => requestAnimationFrame(() => requestAnimationFrame(resolve)));
+waitLoad()
+    .then(waitFonts)
+    .then(waitImages)
+    .then(waitNetworkIdle)
+    .then(waitFrames)
+    .then(() => done(true), error => done(String(error)));
+'''
+
+
+def wait_for_page_ready(driver, timeout=DEFAULT_READY_TIMEOUT_SEC, network_idle_ms=DEFAULT_NETWORK_IDLE_MS):
+    """
+    等待页面加载、字体、图片和网络请求都完成
+
+    参数:
+        driver (WebDriver): 已打开页面的浏览器实例
+        timeout (float): 最长等待秒数，超时后记录警告并继续截图
+        network_idle_ms (int): 多长时间没有新的资源请求完成视为网络空闲（毫秒）
+
+    返回:
+        float: 实际等待的秒数
+    """
+    start = time.time()
+    driver.set_script_timeout(timeout)
+    try:
+        result = driver.execute_async_script(_WAIT_READY_SCRIPT, network_idle_ms)
+        if result is not True:
+            logger.warning(f"等待页面就绪时出错，将直接截图: {result}")
+    except Exception as e:
+        logger.warning(f"等待页面就绪超时（{timeout}秒），将直接截图: {str(e)}")
+    elapsed = time.time() - start
+    logger.debug(f"页面就绪耗时 {elapsed:.2f} 秒")
+    return elapsed
+
+
+def _capture_clip(driver, x, y, width, height):
+    """截取页面中的指定区域，返回PNG字节"""
+    result = driver.execute_cdp_cmd('Page.captureScreenshot', {
+        'format': 'png',
+        'captureBeyondViewport': True,
+        'clip': {'x': x, 'y': y, 'width': width, 'height': height, 'scale': 1},
+    })
+    return base64.b64decode(result['data'])
+
+
+def _stitch_tiles(tiles, width, height):
+    """用 Pillow 把分块截图自上而下拼接成一张图，返回PNG字节"""
+    from PIL import Image
+
+    canvas = Image.new('RGB', (width, height), 'white')
+    offset = 0
+    for tile_bytes in tiles:
+        with Image.open(io.BytesIO(tile_bytes)) as tile:
+            canvas.paste(tile, (0, offset))
+            offset += tile.height
+    output = io.BytesIO()
+    canvas.save(output, format='PNG')
+    return output.getvalue()
+
+
+def capture_full_page(driver, png_filepath, max_capture_height=DEFAULT_MAX_CAPTURE_HEIGHT):
+    """
+    通过 DevTools 协议截取整个页面
+
+    参数:
+        driver (WebDriver): 已就绪的浏览器实例（Chrome）
+        png_filepath (str): PNG保存路径
+        max_capture_height (int): 单次截图的最大高度，超过后分块截图再拼接
+
+    返回:
+        tuple: (宽度, 高度, 分块数)
+    """
+    metrics = driver.execute_cdp_cmd('Page.getLayoutMetrics', {})
+    content_size = metrics.get('cssContentSize') or metrics['contentSize']
+    viewport = metrics.get('cssLayoutViewport') or metrics['layoutViewport']
+    width = int(math.ceil(max(content_size['width'], viewport['clientWidth'])))
+    height = int(math.ceil(content_size['height']))
+
+    tile_count = max(1, math.ceil(height / max_capture_height))
+    if tile_count == 1:
+        png_bytes = _capture_clip(driver, 0, 0, width, height)
+    else:
+        try:
+            import PIL  # noqa: F401
+        except ImportError:
+            logger.warning(f"页面高度 {height}px 超过单次截图上限 {max_capture_height}px，"
+                           f"未安装Pillow无法拼接，只截取前 {max_capture_height}px（pip install Pillow）")
+            height = max_capture_height
+            tile_count = 1
+            png_bytes = _capture_clip(driver, 0, 0, width, height)
+        else:
+            tiles = []
+            for index in range(tile_count):
+                y = index * max_capture_height
+                tiles.append(_capture_clip(driver, 0, y, width, min(max_capture_height, height - y)))
+            png_bytes = _stitch_tiles(tiles, width, height)
+            logger.info(f"页面高度 {height}px，已分 {tile_count} 块截图并拼接")
+
+    with open(png_filepath, 'wb') as f:
+        f.write(png_bytes)
+    return width, height, tile_count
+
+
+def render_cache_key(html_bytes, settings):
+    """
+    渲染缓存的键
+
+    参数:
+        html_bytes (bytes): 最终的HTML文件内容
+        settings (dict): 影响截图结果的参数（视口大小、截图高度上限等）
+
+    返回:
+        str: SHA256摘要
+    """
+    settings = dict(settings, version=RENDER_CACHE_VERSION)
+    return sha256_hexdigest(html_bytes, json.dumps(settings, sort_keys=True))
+
+
+_render_caches = {}
+_render_caches_lock = Lock()
+
+
+def get_render_cache(output_dir, max_mb=200, max_age_days=30):
+    """
+    获取输出目录下的PNG渲染缓存，每个输出目录只创建一次，创建时按保留天数和总大小清理一次
+
+    参数:
+        output_dir (str): 输出目录，缓存位于其下的 .render_cache
+        max_mb (float): 缓存总大小上限（MB）
+        max_age_days (float): 超过多少天未使用的PNG被清理
+
+    返回:
+        DiskFileCache: 渲染缓存
+    """
+    cache_dir = os.path.join(os.path.abspath(output_dir), '.render_cache')
+    with _render_caches_lock:
+        cache = _render_caches.get(cache_dir)
+        if cache is None:
+            cache = DiskFileCache(cache_dir, suffix='.png', max_bytes=int(max_mb * 1024 * 1024), max_age_days=max_age_days)
+            try:
+                cache.evict()
+            except Exception as e:
+                logger.warning(f"清理PNG渲染缓存失败: {str(e)}")
+            _render_caches[cache_dir] = cache
+        return cache
@@ -0,0 +1,289 @@
+'''
+Prompt模板编译
+
+功能描述:
+prompt/ 下的模板（9KB~89KB）原样发送时，Markdown装饰、重复的要求、示例HTML中的缩进和注释都会占用Token，
+并且每个群聊的每个片段都要重复发送一次。编译步骤在不改变要求含义的前提下压缩模板：
+- 规范空白：去掉行尾空白、只有空白的行、连续空行和Markdown分隔线；
+- 压缩示例代码：HTML/CSS/JS 代码去掉行首缩进和空行（<pre>/<textarea> 内保持原样）；
+- 去重：内容完全相同的章节（标题+正文）以及较长的重复段落只保留第一次出现；
+- 可选：去掉HTML注释 <!-- --> 和HTML/CSS/JS代码中的 /* */ 注释。模板中的注释多是写给模型的填写说明
+  （如"保留3-5个话题"、可用的颜色），去掉会改变要求，默认关闭；
+- 可选：去掉"示例/案例代码"标题下的示例代码块（会影响生成风格，默认关闭）。
+编译结果缓存在模板所在目录的 .compiled/ 下，以源文件内容和编译选项的摘要命名，模板修改后自动重新编译。
+
+使用方法:
+1. result = compile_prompt_template(template_path)
+   result['text'] 为编译后的模板，result['original_tokens'] / result['compiled_tokens'] 为估算的Token数
+2. 命令行查看各模板的压缩效果:
+   python prompt_compiler.py [模板路径或目录 ...] [--strip-comments] [--strip-examples]
+'''
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+
+from token_estimator import get_token_estimator
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+COMPILER_VERSION = 2  # 编译规则变化时递增，使旧的缓存失效
+MIN_DEDUPE_CHARS = 20  # 不足该长度的段落（如短标题、列表项）不参与去重
+CODE_LANGS = ('html', 'htm', 'css', 'js', 'javascript', 'vue', 'svg', 'xml')
+TEMPLATE_EXTENSIONS = ('.txt', '.md', '.html', '.htm')
+
+_FENCE_RE = re.compile(r'^```[ \t]*([\w+-]*)[^\n]*\n(.*?)^```[ \t]*$', re.MULTILINE | re.DOTALL)
+_RAW_HTML_RE = re.compile(r'^[ \t]*(?:<!DOCTYPE html|<html\b).*?</html>[ \t]*$', re.MULTILINE | re.DOTALL | re.IGNORECASE)
+_HTML_COMMENT_RE = re.compile(r'<!--(?!\[if).*?-->', re.DOTALL)
+_BLOCK_COMMENT_RE = re.compile(r'/\*.*?\*/', re.DOTALL)
+_HR_RE = re.compile(r'^\s*(?:-{3,}|\*{3,}|_{3,})\s*$')
+_HEADING_RE = re.compile(r'^#{1,6}\s')
+_EXAMPLE_HEADING_RE = re.compile(r'示例|案例|样例|范例|example|sample', re.IGNORECASE)
+_PRESERVE_RE = re.compile(r'(<(pre|textarea)\b.*?</\2>)', re.DOTALL | re.IGNORECASE)
+
+
+def _split_raw_html(text):
+    """把正文中没有用 ``` 包裹、直接粘贴的完整HTML文档拆分出来"""
+    parts = []
+    position = 0
+    for match in _RAW_HTML_RE.finditer(text):
+        if match.start() > position:
+            parts.append(('prose', '', text[position:match.start()]))
+        parts.append(('raw', 'html', match.group(0)))
+        position = match.end()
+    if position < len(text):
+        parts.append(('prose', '', text[position:]))
+    return parts
+
+
+def _split_fenced(text):
+    """
+    把Markdown文本拆分为正文、代码块和直接粘贴的HTML文档
+
+    返回:
+        list: (类型, 代码语言, 内容) 列表，类型为 'prose'、'fenced' 或 'raw'
+    """
+    parts = []
+    position = 0
+    for match in _FENCE_RE.finditer(text):
+        if match.start() > position:
+            parts.extend(_split_raw_html(text[position:match.start()]))
+        parts.append(('fenced', match.group(1).lower(), match.group(2)))
+        position = match.end()
+    if position < len(text):
+        parts.extend(_split_raw_html(text[position:]))
+    return parts
+
+
+def _normalize_prose(text, strip_comments=False):
+    """规范正文空白，去掉分隔线（strip_comments 时同时去掉HTML注释）"""
+    if strip_comments:
+        text = _HTML_COMMENT_RE.sub('', text)
+    lines = []
+    for line in text.splitlines():
+        line = line.rstrip()
+        if _HR_RE.match(line):
+            continue
+        if not line and lines and not lines[-1]:
+            continue
+        lines.append(line)
+    return "\n".join(lines).strip('\n')
+
+
+def _compact_code(code, lang, strip_comments=False):
+    """压缩HTML/CSS/JS代码：去掉行首缩进和空行（strip_comments 时同时去掉注释）；其他语言只去掉行尾空白"""
+    if lang not in CODE_LANGS:
+        return "\n".join(line.rstrip() for line in code.splitlines()).strip('\n')
+    if strip_comments:
+        code = _HTML_COMMENT_RE.sub('', code)
+        code = _BLOCK_COMMENT_RE.sub('', code)
+    compacted = []
+    # <pre>/<textarea> 中的空白有意义，保持原样
+    for i, piece in enumerate(_PRESERVE_RE.split(code)):
+        if i % 3 == 2:
+            continue  # split 返回的标签名分组
+        if i % 3 == 1:
+            compacted.append(piece)
+            continue
+        compacted.append("\n".join(line.strip() for line in piece.splitlines() if line.strip()))
+    return "".join(compacted).strip('\n')
+
+
+def _dedupe_prose(text, seen_sections, seen_paragraphs):
+    """去掉与前文完全相同的章节和较长段落"""
+    # 按标题切分章节，标题和正文都相同的章节只保留第一次出现
+    sections = []
+    current = []
+    for line in text.split('\n'):
+        if _HEADING_RE.match(line) and current:
+            sections.append(current)
+            current = []
+        current.append(line)
+    if current:
+        sections.append(current)
+
+    kept_lines = []
+    for section in sections:
+        key = re.sub(r'\s+', ' ', "\n".join(section)).strip()
+        if _HEADING_RE.match(section[0]) and len(section) > 1 and key in seen_sections:
+            continue
+        seen_sections.add(key)
+        kept_lines.extend(section)
+
+    # 较长的重复段落只保留第一次出现
+    paragraphs = "\n".join(kept_lines).split('\n\n')
+    kept_paragraphs = []
+    for paragraph in paragraphs:
+        key = re.sub(r'\s+', ' ', paragraph).strip()
+        if len(key) >= MIN_DEDUPE_CHARS and key in seen_paragraphs:
+            continue
+        seen_paragraphs.add(key)
+        kept_paragraphs.append(paragraph)
+    return "\n\n".join(kept_paragraphs)
+
+
+def compile_prompt_text(text, is_html=False, strip_examples=False, strip_comments=False):
+    """
+    编译模板文本
+
+    参数:
+        text (str): 模板原文
+        is_html (bool): 整个模板是否为HTML（如 .html 模板）
+        strip_examples (bool): 是否去掉"示例/案例"标题下的示例代码块
+        strip_comments (bool): 是否去掉HTML/CSS/JS注释（注释中常有写给模型的说明，默认保留）
+
+    返回:
+        str: 编译后的模板
+    """
+    if is_html:
+        return _compact_code(text, 'html', strip_comments)
+
+    seen_sections = set()
+    seen_paragraphs = set()
+    output = []
+    for kind, lang, content in _split_fenced(text):
+        if kind == 'prose':
+            prose = _dedupe_prose(_normalize_prose(content, strip_comments), seen_sections, seen_paragraphs)
+            if prose:
+                output.append(prose)
+            continue
+        if strip_examples and output:
+            last_line = output[-1].rstrip().rsplit('\n', 1)[-1]
+            if _HEADING_RE.match(last_line) and _EXAMPLE_HEADING_RE.search(last_line):
+                output.append("（示例代码已省略）")
+                continue
+        code = _compact_code(content, lang, strip_comments)
+        output.append(f"```{lang}\n{code}\n```" if kind == 'fenced' else code)
+    return "\n".join(output)
+
+
+def _cache_path(template_path, source_bytes, strip_examples, strip_comments):
+    options = json.dumps({'version': COMPILER_VERSION, 'strip_examples': strip_examples,
+                          'strip_comments': strip_comments}, sort_keys=True)
+    digest = hashlib.sha256(source_bytes + b'\0' + options.encode('utf-8')).hexdigest()[:16]
+    directory, filename = os.path.split(os.path.abspath(template_path))
+    return os.path.join(directory, '.compiled', f"{filename}.{digest}.txt")
+
+
+def compile_prompt_template(template_path, strip_examples=False, model_name='default', use_cache=True,
+                            strip_comments=False):
+    """
+    编译模板文件，优先读取模板目录下 .compiled/ 中的缓存
+
+    参数:
+        template_path (str): 模板文件路径
+        strip_examples (bool): 是否去掉示例代码块
+        model_name (str): 用于估算Token数的模型名称
+        use_cache (bool): 是否读写编译缓存
+        strip_comments (bool): 是否去掉HTML/CSS/JS注释
+
+    返回:
+        dict: text（编译后的模板）、original_chars、compiled_chars、original_tokens、compiled_tokens、from_cache
+    """
+    with open(template_path, 'rb') as f:
+        source_bytes = f.read()
+    source_text = source_bytes.decode('utf-8')
+    cache_path = _cache_path(template_path, source_bytes, strip_examples, strip_comments)
+
+    compiled_text = None
+    from_cache = False
+    if use_cache and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r', encoding='utf-8', newline='') as f:
+                compiled_text = f.read()
+            from_cache = True
+        except OSError as e:
+            logger.warning(f"读取模板编译缓存失败，将重新编译: {str(e)}")
+
+    if compiled_text is None:
+        is_html = os.path.splitext(template_path)[1].lower() in ('.html', '.htm')
+        compiled_text = compile_prompt_text(source_text, is_html=is_html, strip_examples=strip_examples,
+                                            strip_comments=strip_comments)
+        if use_cache:
+            try:
+                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                tmp_path = cache_path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+                    f.write(compiled_text)
+                os.replace(tmp_path, cache_path)
+            except OSError as e:
+                logger.warning(f"写入模板编译缓存失败: {str(e)}")
+
+    estimator = get_token_estimator(model_name)
+    return {
+        'text': compiled_text,
+        'original_chars': len(source_text),
+        'compiled_chars': len(compiled_text),
+        'original_tokens': estimator.estimate(source_text),
+        'compiled_tokens': estimator.estimate(compiled_text),
+        'from_cache': from_cache,
+    }
+
+
+def format_savings(result):
+    """格式化编译前后的Token数对比，用于日志"""
+    saved = result['original_tokens'] - result['compiled_tokens']
+    ratio = saved / result['original_tokens'] * 100 if result['original_tokens'] else 0.0
+    return (f"{result['original_chars']}→{result['compiled_chars']}字符, "
+            f"约{result['original_tokens']}→{result['compiled_tokens']} tokens（节省 {ratio:.1f}%）")
+
+
+def _iter_template_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs[:] = sorted(d for d in dirs if d != '.compiled')
+                for name in sorted(files):
+                    if name.lower().endswith(TEMPLATE_EXTENSIONS):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='编译Prompt模板并报告Token节省情况')
+    parser.add_argument('paths', nargs='*', default=[os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompt')],
+                        help='模板文件或目录，默认为 prompt/')
+    parser.add_argument('--strip-examples', action='store_true', help='去掉示例代码块')
+    parser.add_argument('--strip-comments', action='store_true', help='去掉HTML/CSS/JS注释（注释中常有写给模型的说明）')
+    args = parser.parse_args()
+
+    total_original = 0
+    total_compiled = 0
+    for template_path in _iter_template_paths(args.paths):
+        result = compile_prompt_template(template_path, strip_examples=args.strip_examples, use_cache=False,
+                                         strip_comments=args.strip_comments)
+        total_original += result['original_tokens']
+        total_compiled += result['compiled_tokens']
+        print(f"{format_savings(result)}  {os.path.relpath(template_path)}")
+    if total_original:
+        print(f"合计: 约{total_original}→{total_compiled} tokens（节省 {(total_original - total_compiled) / total_original * 100:.1f}%）")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,211 @@
+'''
+滑动窗口限流器（TPM / RPM）
+
+功能描述:
+记录最近一个窗口（默认60秒）内每个请求的时间和Token数，发送新请求前精确计算需要等待的时间：
+窗口内的Token数加上本次请求不超过TPM、请求数不超过RPM时立即放行，否则只等到最早的请求滑出窗口为止。
+请求完成后可以补记输出Token数；遇到429时可按服务端给出的重试时间暂停所有请求。
+所有方法都是线程安全的。
+
+使用方法:
+1. limiter = SlidingWindowRateLimiter(tpm_limit=250000, rpm_limit=10)
+2. reservation = limiter.acquire(prompt_tokens)  # 阻塞直到额度允许
+3. limiter.record_output(reservation, output_tokens)
+4. 遇到429: limiter.penalize(parse_retry_delay(e))
+5. limiter.usage() 查看当前窗口用量
+'''
+
+import logging
+import re
+import time
+from collections import deque
+from threading import Condition
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW_SEC = 60
+
+# 服务端重试提示的几种常见写法
+_RETRY_DELAY_PATTERNS = (
+    re.compile(r'retry_delay\s*\{\s*seconds:\s*(\d+)'),  # gRPC RetryInfo
+    re.compile(r'"retryDelay"\s*:\s*"([\d.]+)s"'),  # REST RetryInfo
+    re.compile(r'retry in ([\d.]+)\s*s', re.IGNORECASE),  # 错误信息中的提示
+)
+
+
+def is_rate_limit_error(error):
+    """
+    判断异常是否为429限流错误
+
+    只看状态码、异常类型和 RESOURCE_EXHAUSTED 状态名；不匹配消息中的 "429"、"quota" 等片段，
+    避免把 "1429 tokens" 之类与限流无关的错误误判为限流
+    """
+    if getattr(error, 'code', None) == 429 or getattr(error, 'status_code', None) == 429:
+        return True
+    if {cls.__name__ for cls in type(error).__mro__} & {'ResourceExhausted', 'TooManyRequests'}:
+        return True
+    return 'RESOURCE_EXHAUSTED' in str(error)
+
+
+def parse_retry_delay(error):
+    """
+    从异常中解析服务端建议的重试等待时间
+
+    返回:
+        float: 等待秒数，未找到时返回None
+    """
+    retry_after = getattr(error, 'retry_after', None)
+    if isinstance(retry_after, (int, float)) and retry_after > 0:
+        return float(retry_after)
+    message = str(error)
+    for pattern in _RETRY_DELAY_PATTERNS:
+        match = pattern.search(message)
+        if match:
+            return float(match.group(1))
+    return None
+
+
+class Reservation:
+    """一次请求在窗口中占用的额度"""
+
+    __slots__ = ('timestamp', 'tokens')
+
+    def __init__(self, timestamp, tokens):
+        self.timestamp = timestamp
+        self.tokens = tokens
+
+
+class SlidingWindowRateLimiter:
+    """
+    滑动窗口Token/请求数限流器
+    """
+
+    def __init__(self, tpm_limit, rpm_limit=None, window_sec=DEFAULT_WINDOW_SEC, name='default'):
+        """
+        初始化限流器
+
+        参数:
+            tpm_limit (int): 每个窗口允许的Token数，None表示不限制
+            rpm_limit (int): 每个窗口允许的请求数，None表示不限制
+            window_sec (float): 窗口长度（秒）
+            name (str): 名称，用于日志
+        """
+        self.tpm_limit = tpm_limit
+        self.rpm_limit = rpm_limit
+        self.window_sec = window_sec
+        self.name = name
+        self._events = deque()
+        self._window_tokens = 0
+        self._blocked_until = 0.0
+        self._cond = Condition()
+
+    def _expire(self, now):
+        """移除已滑出窗口的请求（调用方需持有锁）"""
+        while self._events and self._events[0].timestamp <= now - self.window_sec:
+            self._window_tokens -= self._events.popleft().tokens
+
+    def _wait_time(self, tokens, now):
+        """计算本次请求还需要等待的秒数，0表示可以立即发送（调用方需持有锁）"""
+        self._expire(now)
+        wait = max(0.0, self._blocked_until - now)
+
+        if self.rpm_limit and len(self._events) >= self.rpm_limit:
+            oldest = self._events[len(self._events) - self.rpm_limit]
+            wait = max(wait, oldest.timestamp + self.window_sec - now)
+
+        if self.tpm_limit and self._events and self._window_tokens + tokens > self.tpm_limit:
+            # 找到需要滑出窗口的最少请求，使剩余Token数加上本次请求不超过TPM
+            # （单个请求本身超过TPM时，只要窗口为空就放行，否则会永远等待）
+            released = 0
+            for event in self._events:
+                released += event.tokens
+                if self._window_tokens - released + tokens <= self.tpm_limit:
+                    break
+            wait = max(wait, event.timestamp + self.window_sec - now)
+        return wait
+
+    def acquire(self, tokens, timeout=None):
+        """
+        阻塞直到窗口额度允许发送本次请求，并占用额度
+
+        参数:
+            tokens (int): 本次请求的Token数（通常为Prompt Token数）
+            timeout (float): 最长等待秒数，None表示一直等待
+
+        返回:
+            Reservation: 本次请求占用的额度，可用于补记输出Token数
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        announced = False
+        with self._cond:
+            while True:
+                now = time.time()
+                wait = self._wait_time(tokens, now)
+                if wait <= 0:
+                    return self._reserve(tokens, now)
+                if deadline is not None and now + wait > deadline:
+                    raise TimeoutError(f"限流器 {self.name} 等待超时（需要再等待 {wait:.2f} 秒）")
+                if not announced:
+                    logger.warning(f"限流器 {self.name}: 窗口用量 {self._window_tokens}+{tokens}/{self.tpm_limit} tokens, "
+                                   f"{len(self._events)}/{self.rpm_limit} 请求，等待 {wait:.2f} 秒...")
+                    print(f"⏳ 为满足TPM/RPM限制，程序将暂停 {wait:.2f} 秒...")
+                    announced = True
+                self._cond.wait(wait)
+
+    def estimate_wait(self, tokens):
+        """发送本次请求前还需要等待的秒数（不占用额度），0表示可以立即发送"""
+        with self._cond:
+            return self._wait_time(tokens, time.time())
+
+    def _reserve(self, tokens, now):
+        """占用额度（调用方需持有锁）"""
+        reservation = Reservation(now, tokens)
+        self._events.append(reservation)
+        self._window_tokens += tokens
+        return reservation
+
+    def record_output(self, reservation, output_tokens):
+        """请求完成后补记输出Token数"""
+        if not output_tokens or output_tokens <= 0:
+            return
+        with self._cond:
+            reservation.tokens += output_tokens
+            # 已滑出窗口的请求不再计入
+            if reservation in self._events:
+                self._window_tokens += output_tokens
+
+    def penalize(self, delay_sec):
+        """按服务端的重试提示，暂停所有请求 delay_sec 秒"""
+        if not delay_sec or delay_sec <= 0:
+            return
+        with self._cond:
+            self._blocked_until = max(self._blocked_until, time.time() + delay_sec)
+            logger.warning(f"限流器 {self.name}: 服务端要求 {delay_sec:.1f} 秒后重试，期间暂停所有请求")
+            self._cond.notify_all()
+
+    def usage(self):
+        """
+        当前窗口用量
+
+        返回:
+            dict: tokens、requests、tpm_limit、rpm_limit、blocked_sec
+        """
+        with self._cond:
+            now = time.time()
+            self._expire(now)
+            return {
+                'tokens': self._window_tokens,
+                'requests': len(self._events),
+                'tpm_limit': self.tpm_limit,
+                'rpm_limit': self.rpm_limit,
+                'blocked_sec': max(0.0, self._blocked_until - now),
+            }
+
+    def format_usage(self):
+        """格式化的窗口用量，用于日志"""
+        usage = self.usage()
+        text = f"{usage['tokens']}/{usage['tpm_limit']} tokens, {usage['requests']}/{usage['rpm_limit']} 请求"
+        if usage['blocked_sec'] > 0:
+            text += f", 暂停剩余 {usage['blocked_sec']:.1f} 秒"
+        return text
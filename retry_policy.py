@@ -0,0 +1,265 @@
+'''
+Gemini 调用的重试策略
+
+功能描述:
+原先所有失败都固定等待 gemini_retry_delay_sec（60秒）后重试：偶发的503白白等一分钟，
+配额用尽的429反而可能重试得太早，安全拦截或无法提取HTML这类重试也没用的错误还会重复发送整份Prompt。
+本模块先把异常分为四类，再决定是否重试、等待多久：
+- rate_limit: 429 / RESOURCE_EXHAUSTED，优先按服务端给出的重试时间等待，否则从较长的基础时间开始指数退避；
+- transient: 网络错误、超时、500/502/503/504 等，从很短的基础时间开始指数退避；
+- permanent: 参数错误、鉴权失败、模型不存在、Prompt被安全策略拦截等，不重试；
+- content: 回复被安全策略截断、无法从回复中提取HTML等，换一次采样可能成功，只重试少数几次。
+等待时间 = min(上限, 基础时间 × 2^(第几次-1))，再在 [一半, 全部] 之间随机抖动，避免并发请求同时重试；
+每份日报（一次生成调用）另有总时间预算，超出预算时不再重试。
+重试次数和等待时间按群聊汇总，群聊处理完成后输出到日志。
+
+使用方法:
+1. policy = new_retry_policy(talker_name)
+2. 调用失败时: delay = policy.next_delay(e)；返回None表示不再重试，否则等待 delay 秒后重试
+3. get_retry_stats().log_talker(talker_name) 输出该群聊的重试统计
+'''
+
+import logging
+import random
+import time
+from threading import Lock
+
+from rate_limiter import is_rate_limit_error, parse_retry_delay
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+ERROR_RATE_LIMIT = 'rate_limit'
+ERROR_TRANSIENT = 'transient'
+ERROR_PERMANENT = 'permanent'
+ERROR_CONTENT = 'content'
+
+ERROR_LABELS = {
+    ERROR_RATE_LIMIT: '限流',
+    ERROR_TRANSIENT: '临时错误',
+    ERROR_PERMANENT: '永久错误',
+    ERROR_CONTENT: '内容错误',
+}
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BASE_DELAY_SEC = 2
+DEFAULT_MAX_DELAY_SEC = 60
+DEFAULT_RATE_LIMIT_DELAY_SEC = 30
+DEFAULT_CONTENT_ATTEMPTS = 2
+DEFAULT_BUDGET_SEC = 900
+
+# google.api_core.exceptions 中的异常类名（按类名判断，不需要导入该包）
+_TRANSIENT_TYPES = {
+    'ServiceUnavailable', 'InternalServerError', 'BadGateway', 'GatewayTimeout', 'DeadlineExceeded',
+    'Aborted', 'Unknown', 'ServerError', 'RetryError',
+    'ConnectionError', 'ConnectTimeout', 'ReadTimeout', 'Timeout', 'ChunkedEncodingError',
+    'TimeoutError', 'ConnectionResetError', 'ConnectionAbortedError', 'BrokenPipeError',
+    'IncompleteRead', 'RemoteDisconnected', 'ProtocolError', 'SSLError',
+}
+_PERMANENT_TYPES = {
+    'InvalidArgument', 'BadRequest', 'Unauthenticated', 'Unauthorized', 'PermissionDenied', 'Forbidden',
+    'NotFound', 'FailedPrecondition', 'MethodNotImplemented', 'OutOfRange', 'DefaultCredentialsError',
+    'BlockedPromptException', 'TypeError', 'AttributeError', 'NameError', 'KeyError',
+}
+_CONTENT_TYPES = {'StopCandidateException', 'IncompleteIterationError', 'BrokenResponseError', 'HtmlExtractionError'}
+_PERMANENT_CODES = {400, 401, 403, 404, 405, 411, 413, 501}
+_TRANSIENT_CODES = {408, 409, 500, 502, 503, 504}
+_TRANSIENT_MARKERS = ('503', '502', '504', '500 ', 'UNAVAILABLE', 'overloaded', 'DEADLINE_EXCEEDED', 'timed out',
+                      'timeout', 'Connection reset', 'Connection aborted', 'INTERNAL')
+_PERMANENT_MARKERS = ('API_KEY_INVALID', 'API key not valid', 'PERMISSION_DENIED', 'INVALID_ARGUMENT',
+                      'User location is not supported', 'block_reason')
+
+
+def classify_error(error):
+    """
+    判断异常属于哪一类
+
+    返回:
+        str: ERROR_RATE_LIMIT / ERROR_TRANSIENT / ERROR_PERMANENT / ERROR_CONTENT
+    """
+    if is_rate_limit_error(error):
+        return ERROR_RATE_LIMIT
+    names = {cls.__name__ for cls in type(error).__mro__}
+    if names & _CONTENT_TYPES:
+        return ERROR_CONTENT
+    code = getattr(error, 'code', None)
+    if isinstance(code, int) and code in _PERMANENT_CODES or names & _PERMANENT_TYPES:
+        return ERROR_PERMANENT
+    if isinstance(code, int) and code in _TRANSIENT_CODES or names & _TRANSIENT_TYPES:
+        return ERROR_TRANSIENT
+    message = str(error)
+    if any(marker in message for marker in _PERMANENT_MARKERS):
+        return ERROR_PERMANENT
+    if any(marker in message for marker in _TRANSIENT_MARKERS):
+        return ERROR_TRANSIENT
+    # 无法判断时按临时错误处理，保持原先"失败就重试"的行为
+    return ERROR_TRANSIENT
+
+
+class RetryStats:
+    """
+    按群聊汇总的重试次数和等待时间（线程安全）
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._talkers = {}
+
+    def record(self, name, kind, delay_sec):
+        """记录一次失败；delay_sec 为None表示不再重试（放弃）"""
+        with self._lock:
+            stats = self._talkers.setdefault(name, {'retries': 0, 'wait_sec': 0.0, 'gave_up': 0, 'kinds': {}})
+            stats['kinds'][kind] = stats['kinds'].get(kind, 0) + 1
+            if delay_sec is None:
+                stats['gave_up'] += 1
+            else:
+                stats['retries'] += 1
+                stats['wait_sec'] += delay_sec
+
+    def get(self, name):
+        """某个群聊的统计，没有失败时返回None"""
+        with self._lock:
+            stats = self._talkers.get(name)
+            return None if stats is None else {**stats, 'kinds': dict(stats['kinds'])}
+
+    def format(self, name):
+        stats = self.get(name)
+        if stats is None:
+            return "无失败"
+        kinds = ", ".join(f"{ERROR_LABELS.get(kind, kind)} {count} 次" for kind, count in stats['kinds'].items())
+        return (f"重试 {stats['retries']} 次, 等待共 {stats['wait_sec']:.1f} 秒, 放弃 {stats['gave_up']} 次"
+                f"（失败类型: {kinds}）")
+
+    def log_talker(self, name):
+        """群聊有失败时输出其重试统计"""
+        if self.get(name) is not None:
+            logger.info(f"「{name}」Gemini调用重试统计: {self.format(name)}")
+
+
+class RetryPolicy:
+    """
+    一次生成调用（一份日报）的重试策略：记录已重试次数和已用时间，计算下次重试前的等待时间
+    """
+
+    def __init__(self, name='default', max_attempts=DEFAULT_MAX_ATTEMPTS, base_delay=DEFAULT_BASE_DELAY_SEC,
+                 max_delay=DEFAULT_MAX_DELAY_SEC, rate_limit_delay=DEFAULT_RATE_LIMIT_DELAY_SEC,
+                 content_attempts=DEFAULT_CONTENT_ATTEMPTS, budget_sec=DEFAULT_BUDGET_SEC, stats=None, rng=None):
+        """
+        参数:
+            name (str): 群聊名称，用于日志和统计
+            max_attempts (int): 最多尝试次数（含第一次）
+            base_delay (float): 临时错误的基础等待秒数
+            max_delay (float): 单次等待的上限（秒），服务端的重试提示不受此限制
+            rate_limit_delay (float): 限流错误没有重试提示时的基础等待秒数
+            content_attempts (int): 内容错误最多尝试次数（含第一次）
+            budget_sec (float): 从第一次尝试开始的总时间预算（秒），None表示不限制
+            stats (RetryStats): 汇总统计，None表示不汇总
+            rng (random.Random): 随机数生成器（抖动）
+        """
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_limit_delay = rate_limit_delay
+        self.content_attempts = content_attempts
+        self.budget_sec = budget_sec
+        self.stats = stats
+        self.rng = rng or random
+        self.attempts = 0
+        self.kind_attempts = {}
+        self.wait_sec = 0.0
+        self.last_kind = None
+        self.last_server_delay = None
+        self._started = time.monotonic()
+
+    def elapsed(self):
+        return time.monotonic() - self._started
+
+    def _backoff(self, base, attempt):
+        delay = min(self.max_delay, base * (2 ** (attempt - 1)))
+        return self.rng.uniform(delay / 2, delay)
+
+    def next_delay(self, error, kind=None, failover=False):
+        """
+        记录一次失败，计算重试前的等待时间
+
+        参数:
+            error (Exception): 本次失败的异常
+            kind (str): 调用方已确定的错误类型，None表示按 classify_error 判断
+            failover (bool): 下次尝试会改用另一个模型：不等待，永久错误（如模型已下线）也可以重试
+
+        返回:
+            float: 等待秒数；None表示不应再重试
+        """
+        kind = kind or classify_error(error)
+        self.attempts += 1
+        self.kind_attempts[kind] = self.kind_attempts.get(kind, 0) + 1
+        self.last_kind = kind
+        self.last_server_delay = parse_retry_delay(error) if kind == ERROR_RATE_LIMIT else None
+
+        delay, reason = None, None
+        if kind == ERROR_PERMANENT and not failover:
+            reason = "错误不可重试"
+        elif self.attempts >= self.max_attempts:
+            reason = f"已达到最大尝试次数 ({self.max_attempts})"
+        elif kind == ERROR_CONTENT and self.kind_attempts[kind] >= self.content_attempts:
+            reason = f"内容错误已尝试 {self.kind_attempts[kind]} 次"
+        elif failover:
+            delay = 0.0
+        elif kind == ERROR_RATE_LIMIT:
+            if self.last_server_delay:
+                # 按服务端提示等待，只加少量抖动
+                delay = self.last_server_delay + self.rng.uniform(0, min(5.0, self.last_server_delay * 0.1))
+            else:
+                delay = self._backoff(self.rate_limit_delay, self.kind_attempts[kind])
+        elif kind == ERROR_CONTENT:
+            delay = self._backoff(self.base_delay, 1)
+        else:
+            delay = self._backoff(self.base_delay, self.kind_attempts[kind])
+
+        if delay is not None and self.budget_sec is not None and self.elapsed() + delay > self.budget_sec:
+            reason = f"超出时间预算 ({self.elapsed():.0f}+{delay:.0f} > {self.budget_sec} 秒)"
+            delay = None
+
+        if delay is None:
+            logger.error(f"「{self.name}」{ERROR_LABELS.get(kind, kind)}，不再重试: {reason}")
+        elif failover:
+            logger.info(f"「{self.name}」{ERROR_LABELS.get(kind, kind)}，改用其他模型立即进行第 {self.attempts + 1} 次尝试")
+        else:
+            self.wait_sec += delay
+            logger.info(f"「{self.name}」{ERROR_LABELS.get(kind, kind)}，{delay:.1f} 秒后进行第 {self.attempts + 1} 次尝试"
+                        f"（本次调用已等待 {self.wait_sec:.1f} 秒）")
+        if self.stats is not None:
+            self.stats.record(self.name, kind, delay)
+        return delay
+
+
+_stats = RetryStats()
+
+
+def get_retry_stats():
+    """获取进程内共享的重试统计"""
+    return _stats
+
+
+def new_retry_policy(name='default'):
+    """
+    创建一次生成调用的重试策略，参数从cfg.py读取
+
+    参数:
+        name (str): 群聊名称
+    """
+    try:
+        from cfg import CHAT_DEMO_CFG
+    except ImportError:
+        CHAT_DEMO_CFG = {}
+    return RetryPolicy(
+        name=name,
+        max_attempts=CHAT_DEMO_CFG.get('gemini_retry_attempts', DEFAULT_MAX_ATTEMPTS),
+        base_delay=CHAT_DEMO_CFG.get('gemini_retry_base_delay_sec', DEFAULT_BASE_DELAY_SEC),
+        max_delay=CHAT_DEMO_CFG.get('gemini_retry_delay_sec', DEFAULT_MAX_DELAY_SEC),
+        rate_limit_delay=CHAT_DEMO_CFG.get('gemini_retry_rate_limit_delay_sec', DEFAULT_RATE_LIMIT_DELAY_SEC),
+        content_attempts=CHAT_DEMO_CFG.get('gemini_retry_content_attempts', DEFAULT_CONTENT_ATTEMPTS),
+        budget_sec=CHAT_DEMO_CFG.get('gemini_retry_budget_sec', DEFAULT_BUDGET_SEC),
+        stats=_stats,
+    )
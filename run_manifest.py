@@ -0,0 +1,201 @@
+'''
+运行清单（断点续跑）
+
+功能描述:
+在 output/<日期>/run_manifest.json 中记录本次运行每个群聊、每个片段完成到了哪个阶段以及对应的产物：
+    fetched（已获取聊天记录）→ segmented（已切分）→ generated（已生成）→ saved（已保存HTML）
+    → rendered（已生成PNG）→ uploaded（已发布URL）→ sent（已发送微信）→ synced（已同步飞书）
+聊天记录、切分后的片段和模型生成的HTML保存在 output/<日期>/.checkpoint/ 下，
+使用 --resume 重新运行时只执行未完成的阶段，已完成的群聊和片段直接复用之前的产物；
+生成过程中被中断时，已经流式接收到的部分内容也会保存下来。
+
+使用方法:
+1. manifest = RunManifest.open(output_dir, resume=True)
+2. manifest.mark_segment(talker_name, segment_index, 'saved', html_filepath=...)
+3. manifest.segment_reached(talker_name, segment_index, 'saved')
+'''
+
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+from threading import Lock
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+STAGES = ('fetched', 'segmented', 'generated', 'saved', 'rendered', 'uploaded', 'sent', 'synced')
+MANIFEST_FILENAME = 'run_manifest.json'
+
+
+def stage_reached(current_stage, stage):
+    """current_stage 是否已经达到（含）stage"""
+    if current_stage not in STAGES:
+        return False
+    return STAGES.index(current_stage) >= STAGES.index(stage)
+
+
+class RunManifest:
+    """
+    运行清单，线程安全，每次更新都原子地写回磁盘
+    """
+
+    def __init__(self, run_dir, data=None):
+        """
+        初始化运行清单
+
+        参数:
+            run_dir (str): 本次运行的输出目录 output/<日期>
+            data (dict): 已有的清单内容，None表示新建
+        """
+        self.run_dir = run_dir
+        self.path = os.path.join(run_dir, MANIFEST_FILENAME)
+        self.checkpoint_dir = os.path.join(run_dir, '.checkpoint')
+        self._lock = Lock()
+        self._data = data or {
+            'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'params': {},
+            'talkers': {},
+        }
+
+    @classmethod
+    def open(cls, output_dir, resume=False, date=None):
+        """
+        打开当天的运行清单
+
+        参数:
+            output_dir (str): 输出根目录
+            resume (bool): 是否继续之前的运行；为False时新建清单（覆盖旧清单）
+            date (str): 日期目录名，默认今天
+
+        返回:
+            RunManifest: 运行清单
+        """
+        run_dir = os.path.join(output_dir, date or datetime.now().strftime('%Y-%m-%d'))
+        os.makedirs(run_dir, exist_ok=True)
+        manifest_path = os.path.join(run_dir, MANIFEST_FILENAME)
+        if resume:
+            if os.path.exists(manifest_path):
+                try:
+                    with open(manifest_path, 'r', encoding='utf-8') as f:
+                        manifest = cls(run_dir, json.load(f))
+                    logger.info(f"已加载运行清单，将继续未完成的阶段: {manifest_path}")
+                    return manifest
+                except Exception as e:
+                    logger.warning(f"读取运行清单失败，将重新开始: {str(e)}")
+            else:
+                logger.info(f"未找到运行清单，将重新开始: {manifest_path}")
+        manifest = cls(run_dir)
+        manifest._save()
+        return manifest
+
+    def _save(self):
+        """写回磁盘（调用方需持有锁，或在构造阶段调用）"""
+        self._data['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        tmp_file = self.path + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self._data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.path)
+
+    def _talker(self, talker_name):
+        return self._data['talkers'].setdefault(talker_name, {'stage': None, 'artifacts': {}, 'segments': {}})
+
+    def _segment(self, talker_name, segment_index):
+        return self._talker(talker_name)['segments'].setdefault(
+            str(segment_index), {'stage': None, 'artifacts': {}})
+
+    def set_params(self, **params):
+        """记录运行参数（时间范围等），续跑时用于提示参数是否变化"""
+        with self._lock:
+            previous = self._data.get('params') or {}
+            changed = {key: (previous.get(key), value) for key, value in params.items()
+                       if key in previous and previous.get(key) != value}
+            if changed:
+                logger.warning(f"运行参数与运行清单中记录的不同，已完成的阶段仍会被复用: {changed}")
+            self._data['params'] = dict(previous, **params)
+            self._save()
+
+    def checkpoint_path(self, talker_name, filename):
+        """群聊的检查点文件路径（目录名使用群名称摘要，避免特殊字符）"""
+        digest = hashlib.sha1(talker_name.encode('utf-8')).hexdigest()[:16]
+        talker_dir = os.path.join(self.checkpoint_dir, digest)
+        os.makedirs(talker_dir, exist_ok=True)
+        return os.path.join(talker_dir, filename)
+
+    def write_checkpoint(self, talker_name, filename, text):
+        """把文本写入群聊的检查点文件，返回文件路径"""
+        path = self.checkpoint_path(talker_name, filename)
+        tmp_file = path + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+        os.replace(tmp_file, path)
+        return path
+
+    @staticmethod
+    def read_checkpoint(path):
+        """读取检查点文件"""
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            return f.read()
+
+    def mark_talker(self, talker_name, stage, **artifacts):
+        """记录群聊完成的阶段及产物"""
+        with self._lock:
+            talker = self._talker(talker_name)
+            talker['stage'] = stage
+            talker['artifacts'].update(artifacts)
+            self._save()
+
+    def mark_segment(self, talker_name, segment_index, stage, **artifacts):
+        """记录片段完成的阶段及产物（阶段只前进不后退）"""
+        with self._lock:
+            segment = self._segment(talker_name, segment_index)
+            if not stage_reached(segment['stage'], stage):
+                segment['stage'] = stage
+            segment['artifacts'].update(artifacts)
+            self._save()
+
+    def talker_state(self, talker_name):
+        """
+        群聊的阶段及产物
+
+        返回:
+            tuple: (阶段, 产物字典)，没有记录时阶段为None
+        """
+        with self._lock:
+            talker = self._data['talkers'].get(talker_name)
+            if talker is None:
+                return None, {}
+            return talker['stage'], dict(talker['artifacts'])
+
+    def segment_state(self, talker_name, segment_index):
+        """
+        片段的阶段及产物
+
+        返回:
+            tuple: (阶段, 产物字典)，没有记录时阶段为None
+        """
+        with self._lock:
+            talker = self._data['talkers'].get(talker_name)
+            segment = talker['segments'].get(str(segment_index)) if talker else None
+            if segment is None:
+                return None, {}
+            return segment['stage'], dict(segment['artifacts'])
+
+    def segment_reached(self, talker_name, segment_index, stage):
+        """片段是否已经完成（含）stage 阶段"""
+        return stage_reached(self.segment_state(talker_name, segment_index)[0], stage)
+
+    def summary(self):
+        """
+        各阶段的片段数统计
+
+        返回:
+            dict: 阶段 -> 片段数
+        """
+        with self._lock:
+            counts = {}
+            for talker in self._data['talkers'].values():
+                for segment in talker['segments'].values():
+                    counts[segment['stage']] = counts.get(segment['stage'], 0) + 1
+            return counts
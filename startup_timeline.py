@@ -0,0 +1,178 @@
+'''
+并行启动阶段与启动时间线
+
+功能描述:
+启动时的几个阶段（检查海外网络、启动chatlog数据服务、连接AI服务、加载日报模板）互不依赖，
+原先在 main() 中依次执行，启动耗时是各阶段之和。本模块把这些阶段提交到线程池中同时执行，
+返回 Future，在第一次用到结果时再等待（join），启动耗时接近最慢的一个阶段。
+同时记录每个阶段的开始/结束时间和等待时间，以及到第一次请求AI的时间，运行结束时输出时间线。
+需要在主线程执行的阶段（如弹出tkinter对话框）可以用 run() 在当前线程执行并同样计入时间线。
+
+使用方法:
+1. timeline = StartupTimeline()
+2. future = timeline.start('连接AI服务', init_gemini_api, api_key)  # 后台执行
+3. result = timeline.join('连接AI服务')  # 第一次用到时等待，阶段中的异常在此处抛出
+4. timeline.mark('首次请求AI')  # 只记录第一次
+5. timeline.log()  # 输出时间线；timeline.shutdown() 关闭线程池
+'''
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class StartupPhase:
+    """一个启动阶段的时间记录（相对时间线起点的秒数）"""
+
+    __slots__ = ('name', 'started', 'finished', 'waited', 'failed', 'future')
+
+    def __init__(self, name):
+        self.name = name
+        self.started = None
+        self.finished = None
+        self.waited = 0.0  # 主线程等待该阶段完成的秒数
+        self.failed = False
+        self.future = None
+
+    @property
+    def duration(self):
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+
+class StartupTimeline:
+    """
+    并行执行启动阶段，并记录启动时间线（线程安全）
+    """
+
+    def __init__(self, max_workers=4):
+        """
+        参数:
+            max_workers (int): 同时执行的后台阶段数
+        """
+        self.origin = time.perf_counter()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='startup')
+        self._phases = {}
+        self._marks = {}
+        self._lock = threading.Lock()
+
+    def elapsed(self):
+        """距时间线起点的秒数"""
+        return time.perf_counter() - self.origin
+
+    def _phase(self, name):
+        with self._lock:
+            phase = self._phases.get(name)
+            if phase is None:
+                phase = self._phases[name] = StartupPhase(name)
+            return phase
+
+    def _call(self, phase, func, args, kwargs):
+        phase.started = self.elapsed()
+        try:
+            return func(*args, **kwargs)
+        except BaseException:
+            phase.failed = True
+            raise
+        finally:
+            phase.finished = self.elapsed()
+
+    def start(self, name, func, *args, **kwargs):
+        """
+        在后台线程中执行一个阶段
+
+        返回:
+            Future: 阶段的执行结果
+        """
+        phase = self._phase(name)
+        phase.future = self._executor.submit(self._call, phase, func, args, kwargs)
+        return phase.future
+
+    def run(self, name, func, *args, **kwargs):
+        """在当前线程中执行一个阶段（用于必须在主线程执行的阶段），返回其结果"""
+        return self._call(self._phase(name), func, args, kwargs)
+
+    def join(self, name, timeout=None):
+        """
+        等待后台阶段完成并返回其结果，阶段中的异常在此处重新抛出
+
+        参数:
+            name (str): 阶段名称
+            timeout (float): 最长等待秒数，None表示一直等待
+        """
+        phase = self._phase(name)
+        if phase.future is None:
+            raise KeyError(f"启动阶段 {name} 未开始")
+        wait_start = time.perf_counter()
+        try:
+            return phase.future.result(timeout)
+        finally:
+            phase.waited += time.perf_counter() - wait_start
+
+    def duration(self, name):
+        """阶段的耗时（秒），未完成时返回None"""
+        phase = self._phases.get(name)
+        return phase.duration if phase is not None else None
+
+    def result_if_done(self, name):
+        """阶段已成功完成时返回其结果，否则返回None（不等待，用于清理资源）"""
+        phase = self._phases.get(name)
+        if phase is None or phase.future is None or not phase.future.done() or phase.future.exception():
+            return None
+        return phase.future.result()
+
+    def mark(self, name):
+        """
+        记录一个时间点（同名时间点只记录第一次）
+
+        返回:
+            bool: 本次是否为第一次记录
+        """
+        with self._lock:
+            if name in self._marks:
+                return False
+            self._marks[name] = self.elapsed()
+            return True
+
+    def shutdown(self, wait=True):
+        """关闭线程池；wait=False 时不等待仍在执行的阶段"""
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def format(self):
+        """
+        格式化的启动时间线
+
+        返回:
+            list: 每行一个阶段或时间点
+        """
+        with self._lock:
+            phases = sorted(self._phases.values(), key=lambda p: (p.started is None, p.started or 0.0))
+            marks = sorted(self._marks.items(), key=lambda item: item[1])
+        lines = []
+        serial_total = 0.0
+        for phase in phases:
+            if phase.duration is None:
+                lines.append(f"{phase.name}: 未完成")
+                continue
+            serial_total += phase.duration
+            status = '，失败' if phase.failed else ''
+            lines.append(f"{phase.name}: {phase.started:.2f}s → {phase.finished:.2f}s "
+                         f"（耗时 {phase.duration:.2f} 秒，主线程等待 {phase.waited:.2f} 秒{status}）")
+        finished = [phase.finished for phase in phases if phase.finished is not None]
+        if finished:
+            lines.append(f"启动阶段合计: {max(finished):.2f} 秒（依次执行约需 {serial_total:.2f} 秒）")
+        for name, at in marks:
+            lines.append(f"{name}: {at:.2f}s")
+        return lines
+
+    def log(self):
+        """输出启动时间线"""
+        lines = self.format()
+        if not lines:
+            return
+        logger.info("启动时间线:\n  " + "\n  ".join(lines))
@@ -0,0 +1,336 @@
+'''
+流式响应的累积、HTML增量提取与进度显示
+
+功能描述:
+模型流式返回的回复可能长达数十万字符（6万Token以上），逐块处理时：
+- StreamAccumulator: 把文本块追加到列表，需要完整文本时才拼接一次（结果会缓存），避免字符串反复拼接；
+- HtmlStreamExtractor: 状态机，随文本块到达识别开头的 "<"、```html 代码块或 <html>…</html> 的起止位置，
+  每块只扫描新到达的内容（加上很短的跨块尾巴），并产出已经确认属于HTML的部分；
+  结束后按记录的位置切片一次得到HTML，规则与原先的 extract_html_from_response 一致：
+      1. 去掉首尾空白后以 "<" 开头：整个回复就是HTML；
+      2. 存在 ```html 且其后还有 ```：取两者之间的内容并去掉首尾空白；
+      3. 存在 <html 和 </html>：取第一个 <html 到第一个 </html> 结束；
+- ThrottledProgress: 进度条计数每块累加，但描述文字和刷新最多每隔 min_interval 秒一次；
+- HtmlStreamWriter: 把产出的HTML边接收边写入临时文件，生成中途失败时已生成的部分不会丢失；
+- stitch_continuation: 把续写请求的输出接到中断前的HTML后面（去掉代码块标记和重复部分）。
+
+使用方法:
+1. accumulator = StreamAccumulator(); extractor = HtmlStreamExtractor()
+2. 每个文本块: accumulator.append(chunk); html_piece = extractor.feed(chunk)
+3. text = accumulator.text(); html = extractor.result(text)，未找到HTML时返回None（由调用方抛出 HtmlExtractionError）
+4. writer = HtmlStreamWriter(path); writer.write(html_piece, extractor.restarts); 完成后 writer.commit(html)
+'''
+
+import os
+import time
+
+FENCE_START = '```html'
+FENCE_END = '```'
+TAG_START = '<html'
+TAG_END = '</html>'
+_TAIL_CHARS = max(len(FENCE_START), len(TAG_END)) - 1  # 跨块匹配时需要保留的尾部字符数
+MIN_STITCH_OVERLAP = 8  # 续写内容与已生成内容重复至少这么多字符时才去重，避免误删巧合相同的短片段
+MAX_STITCH_OVERLAP = 2000
+
+
+class HtmlExtractionError(ValueError):
+    """无法从模型回复中提取HTML（换一次采样可能成功，重试策略按内容错误处理）"""
+
+
+class StreamAccumulator:
+    """
+    文本块累加器：追加为均摊O(1)，拼接只在需要完整文本时进行一次
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._text = ''
+        self.length = 0
+
+    def append(self, chunk):
+        """追加一个文本块"""
+        if chunk:
+            self._chunks.append(chunk)
+            self.length += len(chunk)
+
+    def text(self):
+        """当前完整文本（拼接结果会缓存，之后只拼接新追加的部分）"""
+        if self._chunks:
+            self._text = self._text + ''.join(self._chunks) if self._text else ''.join(self._chunks)
+            self._chunks = []
+        return self._text
+
+    def __len__(self):
+        return self.length
+
+
+class HtmlStreamExtractor:
+    """
+    随流式文本块增量识别HTML的状态机
+
+    状态:
+        detect: 还没有遇到非空白字符
+        raw: 回复以 "<" 开头，整个回复都是HTML
+        search: 查找 ```html 或 <html
+        fence: 位于 ```html 代码块中，查找结束的 ```
+        tag: 位于 <html> 中，查找 </html>（之后若出现 ```html 代码块，以代码块为准）
+        done: HTML已经结束
+    """
+
+    def __init__(self):
+        self.state = 'detect'
+        self.length = 0  # 已接收的字符数
+        self._tail = ''  # 上一块末尾的若干字符，用于匹配跨块的标记
+        self.fence_start = None  # ```html 的位置
+        self.fence_end = None  # 结束 ``` 的位置
+        self.tag_start = None  # 第一个 <html 的位置
+        self.tag_end = None  # 第一个 </html> 的位置
+        self._pending = ''  # 代码块中暂不确定的结尾（空白和反引号），可能属于结束标记或需要去掉的空白
+        self._emitted = False
+        self.restarts = 0  # 已产出的内容作废、从头重新产出的次数
+
+    def _find(self, pattern, window, window_start, min_position=0):
+        index = window.find(pattern, max(0, min_position - window_start))
+        return None if index < 0 else window_start + index
+
+    def feed(self, chunk):
+        """
+        处理一个文本块
+
+        返回:
+            str: 本块新确认属于HTML的内容（可能为空字符串）；按顺序拼接后即为流式提取的HTML。
+                 restarts 增加时，之前产出的内容作废，本次返回的是新的开头；
+                 代码块直到结束都没有闭合时，最终结果以 result() 为准
+        """
+        if not chunk:
+            return ''
+        chunk_start = self.length
+        self.length += len(chunk)
+        window = self._tail + chunk
+        window_start = chunk_start - len(self._tail)
+        self._tail = window[-_TAIL_CHARS:]
+
+        if self.state == 'detect':
+            stripped = chunk.lstrip()
+            if not stripped:
+                self._pending += chunk
+                return ''
+            if stripped.startswith('<'):
+                self.state = 'raw'
+                piece, self._pending = self._pending + chunk, ''
+                return piece
+            self._pending = ''
+            self.state = 'search'
+
+        if self.state == 'raw':
+            return chunk
+
+        # 记录各标记第一次出现的位置
+        if self.tag_start is None:
+            self.tag_start = self._find(TAG_START, window, window_start)
+        if self.tag_end is None:
+            self.tag_end = self._find(TAG_END, window, window_start)
+        if self.fence_start is None:
+            self.fence_start = self._find(FENCE_START, window, window_start)
+            if self.fence_start is not None:
+                if self.state in ('tag', 'done'):
+                    # 之前按 <html> 产出的内容作废，以代码块为准
+                    self.restarts += 1
+                self.state = 'fence'
+                self._pending = ''
+                self._emitted = False
+                # 代码块从 ```html 之后开始，只处理本块中位于其后的内容
+                chunk = chunk[max(0, self.fence_start + len(FENCE_START) - chunk_start):]
+                chunk_start = self.fence_start + len(FENCE_START)
+        if self.state == 'fence' and self.fence_end is None:
+            self.fence_end = self._find(FENCE_END, window, window_start, self.fence_start + len(FENCE_START))
+
+        if self.state == 'fence':
+            if self.fence_end is not None:
+                # 结束标记可能从暂存的结尾开始，按绝对位置截取
+                content = (self._pending + chunk)[:max(0, self.fence_end - (chunk_start - len(self._pending)))]
+                self._pending = ''
+                self.state = 'done'
+                content = content.rstrip()
+                return content if self._emitted else content.lstrip()
+            self._pending += chunk
+            cut = len(self._pending)
+            while cut and (self._pending[cut - 1].isspace() or self._pending[cut - 1] == '`'):
+                cut -= 1
+            piece, self._pending = self._pending[:cut], self._pending[cut:]
+            if not self._emitted:
+                piece = piece.lstrip()
+                if not piece:
+                    return ''
+                self._emitted = True
+            return piece
+
+        if self.state == 'search' and self.tag_start is not None:
+            self.state = 'tag'
+            # <html 可能跨块，从窗口中截取
+            chunk = window[self.tag_start - window_start:]
+            chunk_start = self.tag_start
+        if self.state == 'tag':
+            if self.tag_end is not None:
+                self.state = 'done'
+                if self.tag_end < self.tag_start:
+                    return ''  # </html> 出现在 <html 之前，不是有效的HTML
+                return chunk[:max(0, self.tag_end + len(TAG_END) - chunk_start)]
+            return chunk
+        return ''
+
+    def result(self, text):
+        """
+        根据记录的位置从完整回复中切出HTML
+
+        参数:
+            text (str): 完整回复（即 feed 过的所有文本块拼接）
+
+        返回:
+            str: HTML内容；找不到HTML时返回None
+        """
+        if self.state == 'raw':
+            return text
+        if self.fence_start is not None and self.fence_end is not None:
+            return text[self.fence_start + len(FENCE_START):self.fence_end].strip()
+        if self.tag_start is not None and self.tag_end is not None:
+            return text[self.tag_start:self.tag_end + len(TAG_END)]
+        return None
+
+
+class ThrottledProgress:
+    """
+    限制刷新频率的进度显示：字符数每块累加，描述文字和进度条最多每 min_interval 秒刷新一次
+    """
+
+    def __init__(self, progress_bar, min_interval=0.5):
+        """
+        参数:
+            progress_bar (tqdm.tqdm): 进度条
+            min_interval (float): 两次刷新之间的最短间隔（秒）
+        """
+        self.progress_bar = progress_bar
+        self.min_interval = min_interval
+        self._pending = 0
+        self._last_refresh = 0.0
+        self._last_chunk = ''
+
+    def advance(self, chunk):
+        """记录新接收的文本块，到达刷新间隔时更新进度条"""
+        self._pending += len(chunk)
+        self._last_chunk = chunk
+        now = time.monotonic()
+        if now - self._last_refresh < self.min_interval:
+            return
+        self._last_refresh = now
+        self.flush()
+
+    def flush(self):
+        """把累积的计数和最新内容刷新到进度条"""
+        if self._last_chunk:
+            # 显示最近添加的文本片段，但避免输出HTML标签
+            readable_chunk = self._last_chunk[:30].replace('<', '＜').replace('>', '＞').replace('\n', ' ')
+            self.progress_bar.set_description(f"最新内容: {readable_chunk}...", refresh=False)
+            self._last_chunk = ''
+        if self._pending:
+            self.progress_bar.update(self._pending)
+            self._pending = 0
+
+    def close(self):
+        """刷新剩余计数并关闭进度条"""
+        self.flush()
+        self.progress_bar.close()
+
+
+class HtmlStreamWriter:
+    """
+    把流式提取出的HTML边接收边写入临时文件，同时在内存中保留已确认的内容（用于中断后的续写）
+    """
+
+    def __init__(self, path=None):
+        """
+        参数:
+            path (str): 临时文件路径，None表示只保留在内存中
+        """
+        self.path = path
+        self._parts = []
+        self._restarts = 0
+        self._file = open(path, 'w', encoding='utf-8', newline='') if path else None
+
+    def write(self, piece, restarts=None):
+        """
+        追加一段HTML
+
+        参数:
+            piece (str): 新内容
+            restarts (int): HtmlStreamExtractor.restarts，增加时先清空之前写入的内容
+        """
+        if restarts is not None and restarts != self._restarts:
+            self._restarts = restarts
+            self.reset('')
+        if piece:
+            self._parts.append(piece)
+            if self._file is not None:
+                self._file.write(piece)
+
+    def reset(self, text):
+        """用 text 替换已写入的全部内容"""
+        self._parts = [text] if text else []
+        if self._file is not None:
+            self._file.seek(0)
+            self._file.truncate()
+            self._file.write(text)
+
+    def text(self):
+        """已写入的HTML"""
+        if len(self._parts) > 1:
+            self._parts = [''.join(self._parts)]
+        return self._parts[0] if self._parts else ''
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def commit(self, html_content):
+        """生成完成：文件内容与最终HTML不一致时原子地改写为最终HTML，并关闭文件"""
+        self.close()
+        if self.path and self.text() != html_content:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+                f.write(html_content)
+            os.replace(tmp_path, self.path)
+        self._parts = [html_content]
+
+
+def stitch_continuation(partial_html, continuation_text, min_overlap=MIN_STITCH_OVERLAP, max_overlap=MAX_STITCH_OVERLAP):
+    """
+    把续写请求返回的内容接到中断前已生成的HTML后面
+
+    去掉续写内容中多余的代码块标记和 </html> 之后的说明文字；
+    续写内容开头与已生成内容结尾重复的部分（至少 min_overlap 个字符）只保留一份。
+
+    参数:
+        partial_html (str): 中断前已生成的HTML
+        continuation_text (str): 续写请求返回的原始文本（可能不完整）
+
+    返回:
+        str: 拼接后的HTML
+    """
+    text = continuation_text.lstrip()
+    if text.startswith('```'):
+        text = text.split('\n', 1)[1] if '\n' in text else ''
+    end = text.find(TAG_END)
+    if end >= 0:
+        text = text[:end + len(TAG_END)]
+    elif text.rstrip().endswith('```'):
+        text = text.rstrip()[:-3]
+    for size in range(min(len(partial_html), len(text), max_overlap), min_overlap - 1, -1):
+        if partial_html.endswith(text[:size]):
+            text = text[size:]
+            break
+    return partial_html + text
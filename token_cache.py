@@ -0,0 +1,129 @@
+'''
+Token计数持久化缓存
+
+功能描述:
+把远程 count_tokens 的结果按 (模型名称, 文本SHA256) 保存到 ./temp 下的SQLite数据库，
+相同的文本（如固定的Prompt模板）再次计数时直接读取缓存，不再调用远程接口。
+缓存按条目数上限做LRU淘汰，避免无限增长。
+
+使用方法:
+1. cache = get_token_count_cache()
+2. tokens = cache.get(model_name, text)，未命中返回None
+3. cache.put(model_name, text, tokens)
+'''
+
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from threading import Lock
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temp', 'token_count_cache.sqlite3')
+DEFAULT_MAX_ENTRIES = 5000
+
+
+def text_sha256(text):
+    """计算文本的SHA256摘要"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class TokenCountCache:
+    """
+    基于SQLite的Token计数缓存
+
+    同一进程内共享一个连接，通过锁保证多线程安全。
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        初始化缓存
+
+        参数:
+            db_path (str): SQLite数据库文件路径
+            max_entries (int): 最多保留的条目数，超过后按最近使用时间淘汰
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS token_counts ("
+            " model TEXT NOT NULL,"
+            " sha256 TEXT NOT NULL,"
+            " tokens INTEGER NOT NULL,"
+            " chars INTEGER NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, sha256))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_token_counts_last_used ON token_counts (last_used)")
+        self._conn.commit()
+
+    def get(self, model_name, text):
+        """
+        读取缓存的Token数
+
+        返回:
+            int: 缓存的Token数，未命中返回None
+        """
+        sha = text_sha256(text)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT tokens FROM token_counts WHERE model = ? AND sha256 = ?", (model_name, sha)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE token_counts SET last_used = ? WHERE model = ? AND sha256 = ?", (time.time(), model_name, sha))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, model_name, text, tokens):
+        """写入Token数，并在超出上限时淘汰最久未使用的条目"""
+        sha = text_sha256(text)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO token_counts (model, sha256, tokens, chars, last_used) VALUES (?, ?, ?, ?, ?)",
+                (model_name, sha, int(tokens), len(text), time.time()))
+            count = self._conn.execute("SELECT COUNT(*) FROM token_counts").fetchone()[0]
+            if count > self.max_entries:
+                # 一次多淘汰10%，避免每次写入都触发淘汰
+                evict_count = count - int(self.max_entries * 0.9)
+                self._conn.execute(
+                    "DELETE FROM token_counts WHERE rowid IN "
+                    "(SELECT rowid FROM token_counts ORDER BY last_used ASC LIMIT ?)", (evict_count,))
+                logger.debug(f"Token计数缓存超出上限 {self.max_entries}，已淘汰 {evict_count} 条")
+            self._conn.commit()
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+
+_cache = None
+_cache_lock = Lock()
+
+
+def get_token_count_cache():
+    """获取进程内共享的Token计数缓存实例，配置从cfg.py读取"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            try:
+                from cfg import CHAT_DEMO_CFG
+            except ImportError:
+                CHAT_DEMO_CFG = {}
+            _cache = TokenCountCache(
+                CHAT_DEMO_CFG.get('token_cache_path', DEFAULT_DB_PATH),
+                CHAT_DEMO_CFG.get('token_cache_max_entries', DEFAULT_MAX_ENTRIES),
+            )
+        return _cache
@@ -0,0 +1,224 @@
+'''
+本地Token估算工具
+
+功能描述:
+按文字类别（中日韩文字、ASCII、Emoji、其它）统计字符数，再乘以各类别的"每字符Token数"比率，
+在本地快速估算文本的Token数，避免切分聊天记录时反复调用远程 count_tokens 接口。
+每次拿到远程 count_tokens 的真实结果后，都会用它来校准各类别比率（带先验的最小二乘），
+并持久化到 ./temp 目录，越用越准。
+
+使用方法:
+1. estimator = get_token_estimator(model_name)
+2. estimator.estimate(text) 获取本地估算值
+3. estimator.observe(text, real_tokens) 用真实结果校准
+4. estimator.save() 保存校准结果
+'''
+
+import json
+import logging
+import os
+import re
+from threading import Lock
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 文字类别及其初始比率（每字符Token数），后续会根据真实计数结果自动校准
+CATEGORIES = ('cjk', 'ascii', 'emoji', 'other')
+DEFAULT_RATIOS = {
+    'cjk': 0.8,  # 中日韩文字及全角标点
+    'ascii': 0.28,  # 英文、数字、半角标点、空白
+    'emoji': 1.6,  # Emoji 一般会被拆成多个Token
+    'other': 0.6,  # 其它Unicode字符
+}
+
+# 比率的合理范围，防止异常样本把比率带偏
+MIN_RATIO = 0.05
+MAX_RATIO = 4.0
+
+# 先验权重：相当于多少个"样本"的先验信心
+PRIOR_WEIGHT = 1.0
+
+_CJK_RE = re.compile(r'[\u2e80-\u2fdf\u3000-\u303f\u3040-\u30ff\u3100-\u31ff\u3400-\u4dbf'
+                     r'\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\ufe30-\ufe4f\uff00-\uffef]+')
+_EMOJI_RE = re.compile(r'[\U0001f000-\U0001faff\u2600-\u27bf\u2b00-\u2bff\ufe0f\u200d]+')
+_ASCII_RE = re.compile(r'[\x00-\x7f]+')
+
+DEFAULT_STATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temp')
+
+
+def count_script_chars(text):
+    """
+    统计文本中各文字类别的字符数
+
+    参数:
+        text (str): 待统计文本
+
+    返回:
+        dict: {类别: 字符数}
+    """
+    cjk = sum(len(m) for m in _CJK_RE.findall(text))
+    emoji = sum(len(m) for m in _EMOJI_RE.findall(text))
+    ascii_count = sum(len(m) for m in _ASCII_RE.findall(text))
+    other = len(text) - cjk - emoji - ascii_count
+    return {'cjk': cjk, 'ascii': ascii_count, 'emoji': emoji, 'other': max(other, 0)}
+
+
+def _solve_linear_system(matrix, vector):
+    """高斯消元求解小规模线性方程组（4x4），无解时返回None"""
+    n = len(vector)
+    a = [row[:] + [vector[i]] for i, row in enumerate(matrix)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(a[r][col]))
+        if abs(a[pivot][col]) < 1e-12:
+            return None
+        a[col], a[pivot] = a[pivot], a[col]
+        for r in range(n):
+            if r != col:
+                factor = a[r][col] / a[col][col]
+                for c in range(col, n + 1):
+                    a[r][c] -= factor * a[col][c]
+    return [a[i][n] / a[i][i] for i in range(n)]
+
+
+class TokenEstimator:
+    """
+    本地Token估算器
+
+    估算值 = Σ 类别字符数 × 类别比率。
+    校准采用带先验的最小二乘：每个样本按字符总数归一化（即拟合"每字符Token数"），
+    先验为 DEFAULT_RATIOS，因此样本很少时比率不会剧烈跳动。
+    同时记录"真实值/估算值"的最大偏差，供调用方在本地搜索时预留余量。
+    """
+
+    def __init__(self, model_name='default', state_dir=None):
+        """
+        初始化估算器
+
+        参数:
+            model_name (str): 模型名称，不同模型的分词器不同，校准结果分开保存
+            state_dir (str): 校准结果保存目录，默认 ./temp
+        """
+        self.model_name = model_name
+        self.state_dir = state_dir or DEFAULT_STATE_DIR
+        self._lock = Lock()
+
+        # 正规方程的累积量 (A = λI + Σxxᵀ, b = λr0 + Σxy)
+        self._ata = [[PRIOR_WEIGHT if i == j else 0.0 for j in range(len(CATEGORIES))] for i in range(len(CATEGORIES))]
+        self._atb = [PRIOR_WEIGHT * DEFAULT_RATIOS[c] for c in CATEGORIES]
+        self.ratios = dict(DEFAULT_RATIOS)
+        self.samples = 0
+        # 观测到的最大低估比例（真实值/估算值），用于本地搜索时的安全余量
+        self.max_underestimate = 1.0
+
+        self._load()
+
+    @property
+    def _state_file(self):
+        safe_name = re.sub(r'[^0-9A-Za-z._-]+', '_', self.model_name)
+        return os.path.join(self.state_dir, f"token_estimator_{safe_name}.json")
+
+    def estimate_counts(self, counts):
+        """根据各类别字符数估算Token数"""
+        return int(round(sum(counts[c] * self.ratios[c] for c in CATEGORIES)))
+
+    def estimate(self, text):
+        """
+        本地估算文本的Token数
+
+        参数:
+            text (str): 待估算文本
+
+        返回:
+            int: 估算的Token数
+        """
+        if not text:
+            return 0
+        return self.estimate_counts(count_script_chars(text))
+
+    def safety_factor(self):
+        """本地搜索时应乘上的安全系数（根据历史最大低估比例，额外留2%）"""
+        return self.max_underestimate * 1.02
+
+    def observe(self, text, actual_tokens):
+        """
+        用远程 count_tokens 的真实结果校准估算器
+
+        参数:
+            text (str): 被计数的文本
+            actual_tokens (int): 远程接口返回的真实Token数
+        """
+        if not text or actual_tokens is None or actual_tokens <= 0:
+            return
+        counts = count_script_chars(text)
+        total_chars = sum(counts.values())
+        if total_chars <= 0:
+            return
+
+        with self._lock:
+            estimated_before = self.estimate_counts(counts)
+            x = [counts[c] / total_chars for c in CATEGORIES]
+            y = actual_tokens / total_chars
+            for i in range(len(CATEGORIES)):
+                for j in range(len(CATEGORIES)):
+                    self._ata[i][j] += x[i] * x[j]
+                self._atb[i] += x[i] * y
+            self.samples += 1
+
+            solution = _solve_linear_system(self._ata, self._atb)
+            if solution:
+                self.ratios = {c: min(max(v, MIN_RATIO), MAX_RATIO) for c, v in zip(CATEGORIES, solution)}
+
+            estimated_after = self.estimate_counts(counts)
+            if estimated_after > 0:
+                # 历史偏差逐步衰减，避免一次异常样本永久放大余量；上限1.5
+                decayed = 1.0 + (self.max_underestimate - 1.0) * 0.9
+                self.max_underestimate = min(max(decayed, actual_tokens / estimated_after), 1.5)
+
+        logger.debug(f"Token估算器校准: 真实 {actual_tokens}, 校准前估算 {estimated_before}, 校准后估算 {estimated_after}, 比率 {self.ratios}")
+
+    def save(self):
+        """将校准结果保存到文件"""
+        try:
+            os.makedirs(self.state_dir, exist_ok=True)
+            with self._lock:
+                state = {
+                    'model_name': self.model_name,
+                    'ata': self._ata,
+                    'atb': self._atb,
+                    'ratios': self.ratios,
+                    'samples': self.samples,
+                    'max_underestimate': self.max_underestimate,
+                }
+            with open(self._state_file, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False)
+            logger.debug(f"Token估算器校准结果已保存: {self._state_file}")
+        except Exception as e:
+            logger.warning(f"保存Token估算器校准结果失败: {str(e)}")
+
+    def _load(self):
+        """从文件加载历史校准结果"""
+        try:
+            if os.path.exists(self._state_file):
+                with open(self._state_file, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+                self._ata = state['ata']
+                self._atb = state['atb']
+                self.ratios = {c: float(state['ratios'][c]) for c in CATEGORIES}
+                self.samples = int(state.get('samples', 0))
+                self.max_underestimate = float(state.get('max_underestimate', 1.0))
+                logger.debug(f"已加载Token估算器校准结果: {self._state_file} ({self.samples} 个样本)")
+        except Exception as e:
+            logger.warning(f"加载Token估算器校准结果失败，使用默认比率: {str(e)}")
+
+
+_estimators = {}
+_estimators_lock = Lock()
+
+
+def get_token_estimator(model_name='default'):
+    """获取指定模型共享的估算器实例（同一进程内复用）"""
+    with _estimators_lock:
+        if model_name not in _estimators:
+            _estimators[model_name] = TokenEstimator(model_name)
+        return _estimators[model_name]